@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Shared cache for build_mkqnximage.py outputs.
+
+Images are looked up by a key derived from the normalized mkqnximage command
+line plus content hashes of every input it reads (policy file, ssh identity,
+zoneinfo, extra directories, repositories, persistent local/ state and the
+mkqnximage tool itself). A hit downloads the contents of output/ instead of
+running mkqnximage; a miss builds locally and uploads the result unless the
+client is read-only.
+
+Protocol (HTTP or HTTPS, all paths below <url>/v1/<key>/):
+  GET  manifest.json      JSON list of artifacts with size and sha256; its
+                          presence marks a complete entry
+  GET  <name>             artifact data; honours "Range: bytes=N-" so that
+                          interrupted downloads resume
+  HEAD <name>.part        X-Upload-Offset of a partial upload
+  PUT  <name>             artifact data, optionally with "Content-Range:
+                          bytes N-M/T" to resume; X-Content-SHA256 is checked
+                          once the artifact is complete
+  PUT  manifest.json      commits the entry
+Writes require "Authorization: Bearer <token>" when the server has a token.
+
+Run "build_cache.py serve" for a minimal local server, e.g. for testing.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from config_parser import bool_of, str_of
+
+CHUNK = 1024 * 1024
+PROTOCOL = "v1"
+DEFAULT_REPOS = "$QNX_STAGE_nto:$QNX_TARGET"
+
+# Flags that change how mkqnximage runs but not what it produces.
+NEUTRAL_FLAGS = ("--force", "--clean", "--verbose", "--noprompt")
+
+# Persistent state mkqnximage keeps in local/ and reuses across builds.
+LOCAL_STATE = ("local/misc_files", "local/snippets", "local/valgrind.files")
+
+class CacheError(Exception):
+    pass
+
+def artifact_name_ok(name):
+    """True if name is a plain file name that stays inside the output directory."""
+    return (isinstance(name, str) and name not in ("", ".", "..")
+            and "/" not in name and "\\" not in name and not name.startswith("."))
+
+def check_manifest(manifest):
+    """Returns the artifact list of a manifest, raising CacheError if it is malformed."""
+    files = manifest.get("files") if isinstance(manifest, dict) else None
+    if not isinstance(files, list):
+        raise CacheError("malformed manifest: no file list")
+    for art in files:
+        if not isinstance(art, dict) or not artifact_name_ok(art.get("name")):
+            raise CacheError(f"malformed manifest: bad artifact {art!r}")
+        size, digest = art.get("size"), art.get("sha256")
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            raise CacheError(f"malformed manifest: bad size for {art['name']}")
+        if not isinstance(digest, str) or len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            raise CacheError(f"malformed manifest: bad sha256 for {art['name']}")
+    if len({art["name"] for art in files}) != len(files):
+        raise CacheError("malformed manifest: duplicate artifact names")
+    return files
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(CHUNK)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+def normalize_argv(cmd):
+    """Drops the tool path and the flags that don't influence the image."""
+    out = [Path(cmd[0]).name]
+    for arg in cmd[1:]:
+        if arg.split("=", 1)[0] in NEUTRAL_FLAGS:
+            continue
+        out.append(arg)
+    return out
+
+def _hash_tree(h, root, by_content):
+    """Feeds every file below root into h, sorted for determinism."""
+    root = Path(root)
+    if root.is_file():
+        files = [root]
+    else:
+        files = sorted(p for p in root.rglob("*") if p.is_file())
+    for p in files:
+        h.update(str(p.relative_to(root) if p != root else p.name).encode())
+        if by_content:
+            h.update(sha256_file(p).encode())
+        else:
+            st = p.stat()
+            h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+
+def _dirs(value):
+    for item in os.path.expandvars(value).split(":"):
+        item = item.strip().lstrip("+-")
+        if item and item != "none" and Path(item).expanduser().exists():
+            yield Path(item).expanduser()
+
+def cache_key(cfg, cmd):
+    """Returns the cache key for building cfg with the mkqnximage argv cmd."""
+    h = hashlib.sha256()
+    h.update(PROTOCOL.encode())
+    h.update(json.dumps(normalize_argv(cmd)).encode())
+    h.update(json.dumps({k: v for k, v in sorted(os.environ.items()) if k.startswith("QNX_")}).encode())
+    h.update(sha256_file(cmd[0]).encode())
+
+    for key, skip in (("MKQNX_POLICY", ("none",)), ("MKQNX_SSH_IDENT", ("prompt", "none"))):
+        val = str_of(cfg, key, "")
+        if val and val not in skip:
+            p = Path(os.path.expandvars(val)).expanduser()
+            h.update(sha256_file(p).encode() if p.is_file() else b"missing")
+    if bool_of(cfg, "MKQNX_ZONEINFO_SRC_CUSTOM"):
+        for d in _dirs(str_of(cfg, "MKQNX_ZONEINFO_PATH", "")):
+            _hash_tree(h, d, True)
+    for d in _dirs(str_of(cfg, "MKQNX_EXTRA_DIRS", "")):
+        _hash_tree(h, d, True)
+    # Repositories are usually the whole SDP; fingerprint them by size and
+    # mtime rather than reading every file on each build.
+    for d in _dirs(str_of(cfg, "MKQNX_REPOS", "") or DEFAULT_REPOS):
+        _hash_tree(h, d, False)
+    for state in LOCAL_STATE:
+        if Path(state).exists():
+            _hash_tree(h, state, True)
+    return h.hexdigest()
+
+class CacheClient:
+    """Talks to a cache server over HTTP(S)."""
+
+    def __init__(self, url, token=None, read_only=False, timeout=30):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.read_only = read_only
+        self.timeout = timeout
+
+    def _request(self, method, path, data=None, headers=None):
+        req = urllib.request.Request(f"{self.url}/{PROTOCOL}/{path}", data=data,
+                                     method=method, headers=headers or {})
+        if self.token:
+            req.add_header("Authorization", f"Bearer {self.token}")
+        return urllib.request.urlopen(req, timeout=self.timeout)
+
+    def lookup(self, key):
+        """Returns the manifest for key, or None on a miss."""
+        try:
+            with self._request("GET", f"{key}/manifest.json") as r:
+                return json.load(r)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise CacheError(f"lookup failed: HTTP {e.code}") from e
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise CacheError(f"lookup failed: {e}") from e
+
+    def fetch(self, key, manifest, out_dir):
+        """Downloads all artifacts of manifest into out_dir, resuming partial files."""
+        files = check_manifest(manifest)
+        out_dir = Path(out_dir)
+        staging = out_dir / ".cache-partial"
+        staging.mkdir(parents=True, exist_ok=True)
+        for art in files:
+            part = staging / (art["name"] + ".part")
+            self._download(key, art, part)
+            if sha256_file(part) != art["sha256"]:
+                part.unlink()
+                raise CacheError(f"integrity check failed for {art['name']}")
+        for art in files:
+            os.replace(staging / (art["name"] + ".part"), out_dir / art["name"])
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def _download(self, key, art, part):
+        offset = part.stat().st_size if part.exists() else 0
+        if offset > art["size"]:
+            part.unlink()
+            offset = 0
+        if offset == art["size"]:
+            return
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with self._request("GET", f"{key}/{art['name']}", headers=headers) as r:
+                mode = "ab" if offset and r.status == 206 else "wb"
+                with open(part, mode) as f:
+                    while True:
+                        buf = r.read(CHUNK)
+                        if not buf:
+                            break
+                        f.write(buf)
+        except (urllib.error.URLError, OSError) as e:
+            raise CacheError(f"download of {art['name']} failed: {e}") from e
+
+    def store(self, key, out_dir):
+        """Uploads the files in out_dir and commits the entry."""
+        if self.read_only:
+            return
+        files = []
+        for p in sorted(Path(out_dir).iterdir()):
+            # Hidden files are bookkeeping of our scripts, not build results;
+            # the server refuses their names anyway.
+            if not p.is_file() or p.name.startswith("."):
+                continue
+            art = {"name": p.name, "size": p.stat().st_size, "sha256": sha256_file(p)}
+            self._upload(key, p, art)
+            files.append(art)
+        body = json.dumps({"key": key, "files": files}).encode()
+        try:
+            self._request("PUT", f"{key}/manifest.json", data=body,
+                          headers={"Content-Type": "application/json"}).close()
+        except (urllib.error.URLError, OSError) as e:
+            raise CacheError(f"commit failed: {e}") from e
+
+    def _upload(self, key, path, art):
+        offset = 0
+        try:
+            with self._request("HEAD", f"{key}/{art['name']}.part") as r:
+                offset = int(r.headers.get("X-Upload-Offset", "0"))
+        except (urllib.error.URLError, OSError, ValueError):
+            offset = 0
+        if offset > art["size"]:
+            offset = 0
+        size = art["size"]
+        headers = {"X-Content-SHA256": art["sha256"], "Content-Length": str(size - offset)}
+        if offset:
+            headers["Content-Range"] = f"bytes {offset}-{size - 1}/{size}"
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                self._request("PUT", f"{key}/{art['name']}", data=f, headers=headers).close()
+        except (urllib.error.URLError, OSError) as e:
+            raise CacheError(f"upload of {art['name']} failed: {e}") from e
+
+def client_from_env(url=None, read_only=None):
+    """Builds a client from arguments, falling back to MKQNX_CACHE_* variables."""
+    url = url or os.environ.get("MKQNX_CACHE_URL", "")
+    if not url:
+        return None
+    if read_only is None:
+        read_only = os.environ.get("MKQNX_CACHE_READONLY", "") not in ("", "0", "no")
+    return CacheClient(url, token=os.environ.get("MKQNX_CACHE_TOKEN") or None, read_only=read_only)
+
+class CacheHandler(BaseHTTPRequestHandler):
+    """Request handler for the minimal local cache server."""
+
+    store_dir = Path(".")
+    read_only = False
+    token = None
+
+    def _path(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != PROTOCOL:
+            return None
+        key, name = parts[1], parts[2]
+        if not all(c in "0123456789abcdef" for c in key) or not artifact_name_ok(name):
+            return None
+        return self.store_dir / key / name
+
+    def _reply(self, code, headers=None):
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        if code >= 300:
+            self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        path = self._path()
+        if path is None or not path.exists():
+            self._reply(404)
+            return
+        self._reply(200, {"Content-Length": "0", "X-Upload-Offset": str(path.stat().st_size)})
+
+    def do_GET(self):
+        path = self._path()
+        if path is None or path.suffix == ".part" or not path.exists():
+            self._reply(404)
+            return
+        size = path.stat().st_size
+        start = 0
+        rng = self.headers.get("Range", "")
+        if rng.startswith("bytes=") and rng.endswith("-"):
+            start = min(int(rng[6:-1] or 0), size)
+        self._reply(206 if start else 200, {"Content-Length": str(size - start)})
+        with open(path, "rb") as f:
+            f.seek(start)
+            while True:
+                buf = f.read(CHUNK)
+                if not buf:
+                    break
+                self.wfile.write(buf)
+
+    def do_PUT(self):
+        if self.read_only:
+            self._reply(403)
+            return
+        if self.token and self.headers.get("Authorization") != f"Bearer {self.token}":
+            self._reply(401)
+            return
+        path = self._path()
+        if path is None:
+            self._reply(400)
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part = path.with_name(path.name + ".part")
+        start = 0
+        crange = self.headers.get("Content-Range", "")
+        if crange.startswith("bytes "):
+            start = int(crange[6:].split("-", 1)[0])
+        if start != (part.stat().st_size if part.exists() else 0):
+            self._reply(416)
+            return
+        remaining = int(self.headers.get("Content-Length", "0"))
+        with open(part, "ab" if start else "wb") as f:
+            while remaining > 0:
+                buf = self.rfile.read(min(CHUNK, remaining))
+                if not buf:
+                    break
+                f.write(buf)
+                remaining -= len(buf)
+        if remaining:
+            # Client went away; keep the partial file for a resumed upload.
+            self._reply(400)
+            return
+        want = self.headers.get("X-Content-SHA256")
+        if want and sha256_file(part) != want:
+            part.unlink()
+            self._reply(422)
+            return
+        os.replace(part, path)
+        self._reply(201)
+
+    def log_message(self, fmt, *args):
+        print(f"[cache] {self.address_string()} {fmt % args}", file=sys.stderr)
+
+def serve(store_dir, host, port, read_only, token):
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    handler = type("Handler", (CacheHandler,), {
+        "store_dir": store_dir, "read_only": read_only, "token": token})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    print(f"Serving build cache from {store_dir} on http://{host}:{httpd.server_port}/")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Minimal local build cache server.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    s = sub.add_parser("serve", help="serve a cache directory over HTTP")
+    s.add_argument("--dir", default="build-cache", help="directory holding cache entries")
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=8765)
+    s.add_argument("--read-only", action="store_true", help="reject uploads")
+    s.add_argument("--token", default=os.environ.get("MKQNX_CACHE_TOKEN"),
+                   help="bearer token required for uploads")
+    args = parser.parse_args()
+    serve(args.dir, args.host, args.port, args.read_only, args.token)
+
+if __name__ == "__main__":
+    main()
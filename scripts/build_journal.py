@@ -0,0 +1,145 @@
+"""
+Journal of completed build steps, for resuming failed builds.
+
+For every step the journal in local/.journal.json records a hash of its
+inputs (the tool command line, the contents of the files it reads and the
+results of the steps it depends on), whether it succeeded and a
+fingerprint (size and mtime) of the artifacts it left behind. A resumed
+build reuses a step when its input hash is unchanged and its artifacts are
+still intact, and restarts from the first step that was invalidated.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from config_parser import str_of
+
+# Kept out of output/, whose files are the build results (and what the build
+# cache uploads).
+JOURNAL_PATH = Path("local/.journal.json")
+VERSION = 1
+
+# Options whose value only matters to one step. The policy is compiled into
+# /proc/boot/secpol.bin, so fixing it only needs the boot partition rebuilt.
+OPTION_OWNERS = {"--policy": "boot"}
+
+# Config keys naming files or directories whose contents a step reads.
+# Repositories are left out: they are usually the whole SDP and fingerprinting
+# them would cost more than the resume saves; use --from-step after updating
+# them.
+STEP_INPUTS = {
+    "shared": ("MKQNX_SSH_IDENT",),
+    "boot": ("MKQNX_POLICY",),
+    "system": ("MKQNX_ZONEINFO_PATH",),
+    "data": ("MKQNX_EXTRA_DIRS",),
+    "mkqnximage": ("MKQNX_SSH_IDENT", "MKQNX_POLICY", "MKQNX_ZONEINFO_PATH", "MKQNX_EXTRA_DIRS"),
+}
+
+def _file_digest(h, path):
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(buf)
+
+def hash_inputs(h, cfg, keys):
+    """Feeds the contents of the files named by cfg[keys] into h."""
+    for key in keys:
+        for item in os.path.expandvars(str_of(cfg, key, "")).split(":"):
+            p = Path(item.lstrip("+-")).expanduser()
+            if not item or not p.exists():
+                continue
+            files = [p] if p.is_file() else sorted(q for q in p.rglob("*") if q.is_file())
+            for q in files:
+                h.update(str(q).encode())
+                _file_digest(h, q)
+
+def local_state_digest(h, local=Path("local")):
+    """Feeds the small persistent files of local/ into h."""
+    if not local.is_dir():
+        return
+    for q in sorted(local.rglob("*")):
+        # Hidden files are caches and counters of our own scripts.
+        if any(part.startswith(".") for part in q.relative_to(local).parts):
+            continue
+        if q.is_file() and q.stat().st_size <= 1024 * 1024:
+            h.update(str(q.relative_to(local)).encode())
+            _file_digest(h, q)
+
+def artifacts(step_dir):
+    """Returns {relative path: [size, mtime_ns]} for the files a step produced."""
+    step_dir = Path(step_dir)
+    out = {}
+    for sub in ("output", "local"):
+        for q in sorted((step_dir / sub).rglob("*")):
+            # Hidden entries are our own bookkeeping (journal, pipeline
+            # directories, partial downloads), not build results.
+            if q.is_file() and not any(part.startswith(".") for part in q.relative_to(step_dir).parts):
+                st = q.stat()
+                out[str(q.relative_to(step_dir))] = [st.st_size, st.st_mtime_ns]
+    return out
+
+class Journal:
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = Path(path)
+        self.steps = {}
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if data.get("version") == VERSION:
+                self.steps = data["steps"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"version": VERSION, "steps": self.steps}, indent=1), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def reset(self):
+        self.steps = {}
+
+    def failed_step(self):
+        """Returns the name of a step that failed in the journaled build, or None."""
+        for name, entry in self.steps.items():
+            if entry["status"] == "failed":
+                return name
+        return None
+
+    def step_hash(self, name, cmd, cfg, deps):
+        """Hashes everything step name depends on."""
+        h = hashlib.sha256()
+        for arg in cmd:
+            opt = arg.split("=", 1)[0]
+            if OPTION_OWNERS.get(opt, name) in (name, "mkqnximage"):
+                h.update(arg.encode() + b"\0")
+        hash_inputs(h, cfg, STEP_INPUTS.get(name.rsplit("/", 1)[-1], ()))
+        if name.rsplit("/", 1)[-1] in ("shared", "mkqnximage"):
+            local_state_digest(h)
+        # A dependency that ran again leaves artifacts with new mtimes.
+        for d in deps:
+            h.update(json.dumps([d, self.steps.get(d, {}).get("artifacts")], sort_keys=True).encode())
+        return h.hexdigest()
+
+    def rehash(self, name, digest):
+        """Updates the input hash of a completed step.
+
+        Steps that read local/ also write it; once their results are copied
+        back the hash must describe the new state or the next run would
+        consider them out of date.
+        """
+        if name in self.steps:
+            self.steps[name]["hash"] = digest
+            self.save()
+
+    def reusable(self, name, digest, step_dir):
+        entry = self.steps.get(name)
+        return (entry is not None and entry["status"] == "done" and entry["hash"] == digest
+                and entry["artifacts"] == artifacts(step_dir))
+
+    def record(self, name, digest, ok, step_dir, seconds):
+        self.steps[name] = {
+            "hash": digest,
+            "status": "done" if ok else "failed",
+            "artifacts": artifacts(step_dir) if ok else {},
+            "seconds": round(seconds, 3),
+        }
+        self.save()
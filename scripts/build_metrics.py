@@ -0,0 +1,214 @@
+"""
+Prometheus metrics export for image builds and VM runs.
+
+Metrics are written in the Prometheus text exposition format 0.0.4, either as a
+file for the node_exporter textfile collector (MKQNX_METRICS_DIR) or pushed
+to a Pushgateway compatible endpoint (MKQNX_METRICS_PUSH).
+
+ProcessSampler polls /proc while a subprocess runs to record the peak RSS,
+CPU time and I/O bytes of its whole process tree at low overhead.
+"""
+import json
+import operator
+import os
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+
+PREFIX = "mkqnx_"
+
+class Metrics:
+    """A set of metric families rendered into one exposition."""
+
+    def __init__(self, job, labels=None):
+        self.job = job
+        self.labels = dict(labels or {})
+        self.families = {}
+
+    def _family(self, name, mtype, help_text):
+        fam = self.families.get(name)
+        if fam is None:
+            fam = self.families[name] = {"type": mtype, "help": help_text, "samples": []}
+        return fam
+
+    def gauge(self, name, value, help_text, merge=None, **labels):
+        """Adds a sample; with merge, an existing sample with the same labels
+        becomes merge(old, value) instead of being repeated."""
+        samples = self._family(PREFIX + name, "gauge", help_text)["samples"]
+        if merge is not None:
+            for i, (suffix, old_labels, old) in enumerate(samples):
+                if old_labels == labels:
+                    samples[i] = (suffix, labels, merge(old, value))
+                    return
+        samples.append(("", labels, value))
+
+    def counter(self, name, value, help_text, **labels):
+        # The family and its sample share the _total name, as the 0.0.4
+        # text format parsers (e.g. node_exporter's textfile collector) expect.
+        self._family(PREFIX + name + "_total", "counter", help_text)["samples"].append(("", labels, value))
+
+    @contextmanager
+    def phase(self, name):
+        """Times the enclosed block as one build phase."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.gauge("build_phase_seconds", time.monotonic() - start,
+                       "Wall time spent in each build phase.", phase=name)
+
+    def render(self):
+        lines = []
+        for name, fam in self.families.items():
+            lines.append(f"# HELP {name} {fam['help']}")
+            lines.append(f"# TYPE {name} {fam['type']}")
+            for suffix, labels, value in fam["samples"]:
+                merged = dict(self.labels, **labels)
+                lbl = ",".join(f'{k}="{_escape(str(v))}"' for k, v in sorted(merged.items()))
+                lines.append(f"{name}{suffix}{{{lbl}}} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, directory):
+        """Atomically writes <directory>/<job>.prom."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp = directory / f".{self.job}.prom.tmp"
+        tmp.write_text(self.render(), encoding="utf-8")
+        os.replace(tmp, directory / f"{self.job}.prom")
+
+    def push(self, url, timeout=10):
+        """PUTs the metrics to <url>/metrics/job/<job>."""
+        req = urllib.request.Request(f"{url.rstrip('/')}/metrics/job/{self.job}",
+                                     data=self.render().encode(), method="PUT",
+                                     headers={"Content-Type": "text/plain; version=0.0.4"})
+        urllib.request.urlopen(req, timeout=timeout).close()
+
+    def emit(self, directory=None, push_url=None):
+        """Writes and/or pushes the metrics; returns a list of error strings."""
+        errors = []
+        if directory:
+            try:
+                self.write_textfile(directory)
+            except OSError as e:
+                errors.append(f"writing metrics to {directory}: {e}")
+        if push_url:
+            try:
+                self.push(push_url)
+            except OSError as e:
+                errors.append(f"pushing metrics to {push_url}: {e}")
+        return errors
+
+def _escape(s):
+    return s.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _number(v):
+    if isinstance(v, bool):
+        return "1" if v else "0"
+    if isinstance(v, float):
+        return repr(round(v, 6))
+    return str(v)
+
+def bump_counters(directory, job, **increments):
+    """Adds to counters kept in <directory>/.<job>.counters.json; returns totals.
+
+    The textfile is rewritten on every build, so cumulative counters such as
+    cache lookups and hits need a little state of their own.
+    """
+    path = Path(directory) / f".{job}.counters.json"
+    try:
+        totals = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        totals = {}
+    for k, v in increments.items():
+        totals[k] = totals.get(k, 0) + v
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(totals), encoding="utf-8")
+    return totals
+
+def metrics_target(args_dir, args_push):
+    """Resolves the metrics directory and push URL from arguments and environment."""
+    return (args_dir or os.environ.get("MKQNX_METRICS_DIR") or None,
+            args_push or os.environ.get("MKQNX_METRICS_PUSH") or None)
+
+class ProcessSampler(threading.Thread):
+    """Samples RSS, CPU and I/O of a process and all of its descendants."""
+
+    def __init__(self, pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.samples = 0
+        # Last seen counters per pid, so exited processes still count.
+        self._io = {}
+        self._cpu = {}
+        self._done = threading.Event()
+        self._page = os.sysconf("SC_PAGE_SIZE")
+        self._tick = os.sysconf("SC_CLK_TCK")
+
+    def _tree(self):
+        pids = [self.pid]
+        i = 0
+        while i < len(pids):
+            p = pids[i]
+            i += 1
+            try:
+                for tid in os.listdir(f"/proc/{p}/task"):
+                    with open(f"/proc/{p}/task/{tid}/children") as f:
+                        pids.extend(int(c) for c in f.read().split())
+            except OSError:
+                continue
+        return pids
+
+    def sample(self):
+        rss = 0
+        for p in self._tree():
+            try:
+                with open(f"/proc/{p}/statm") as f:
+                    rss += int(f.read().split()[1]) * self._page
+                with open(f"/proc/{p}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                    self._cpu[p] = (int(fields[11]) + int(fields[12])) / self._tick
+                with open(f"/proc/{p}/io") as f:
+                    io = dict(ln.split(": ") for ln in f.read().splitlines())
+                    self._io[p] = (int(io["read_bytes"]), int(io["write_bytes"]))
+            except (OSError, ValueError, IndexError, KeyError):
+                continue
+        self.peak_rss = max(self.peak_rss, rss)
+        self.samples += 1
+
+    def run(self):
+        while not self._done.is_set():
+            self.sample()
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    @property
+    def cpu_seconds(self):
+        return sum(self._cpu.values())
+
+    @property
+    def read_bytes(self):
+        return sum(r for r, _ in self._io.values())
+
+    @property
+    def write_bytes(self):
+        return sum(w for _, w in self._io.values())
+
+    def export(self, metrics, process):
+        """Adds the figures to metrics, merged with earlier runs of the same process."""
+        metrics.gauge("process_runs", 1, "Times the process was run during the build.",
+                      merge=operator.add, process=process)
+        metrics.gauge("process_peak_rss_bytes", self.peak_rss,
+                      "Peak resident set size of the process tree.", merge=max, process=process)
+        metrics.gauge("process_cpu_seconds", self.cpu_seconds,
+                      "CPU time used by the process tree.", merge=operator.add, process=process)
+        metrics.gauge("process_read_bytes", self.read_bytes,
+                      "Bytes read from storage by the process tree.", merge=operator.add, process=process)
+        metrics.gauge("process_write_bytes", self.write_bytes,
+                      "Bytes written to storage by the process tree.", merge=operator.add, process=process)
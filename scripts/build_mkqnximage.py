@@ -1,34 +1,39 @@
 #!/usr/bin/env python3
 
+import argparse
+import contextlib
+import os
 import shlex
 import shutil
 import subprocess
 import sys
 import re
+import time
 from pathlib import Path
-from config_parser import parse_config, bool_of, str_of, int_of
-
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: build_mkqnximage.py .config", file=sys.stderr)
-        sys.exit(2)
-
-    conf_path = Path(sys.argv[1])
-    if not conf_path.exists():
-        print("Config file not found:", conf_path, file=sys.stderr)
-        sys.exit(1)
-
-    cfg = parse_config(conf_path)
-
-    mkqnx_cmd = shutil.which("mkqnximage")
-    if not mkqnx_cmd:
-        print("Error: 'mkqnximage' not found on PATH.", file=sys.stderr)
-        sys.exit(1)
-
+from config_parser import parse_config, bool_of, bool_of_env, str_of, int_of
+from build_cache import CacheError, cache_key, client_from_env
+from build_metrics import Metrics, ProcessSampler, bump_counters, metrics_target
+from disk_image import disk_images, read_partitions
+from staging import Workspace, absolutize_cfg, expected_size, pick_workspace
+from pipeline import Pipeline, PipelineError
+from image_pipeline import WORK_DIR, arch_builds, collect, image_steps, multiarch_steps, supports_steps
+from build_journal import Journal
+from cgroup_governor import CgroupError, Governor
+from buildlog import LogWriter, Tee
+import preflight
+
+ARCHS = ("x86_64", "aarch64le")
+RAM_RE = re.compile(r'^[1-9][0-9]*([MG])?$', re.IGNORECASE)
+MACADDR_RE = re.compile(r'^[0-9A-Fa-f]{2}(:[0-9A-Fa-f]{2}){5}$')
+
+def build_command(cfg, mkqnx_cmd, force=True):
+    """Translates a parsed .config into the mkqnximage argument vector."""
     cmd = [mkqnx_cmd]
 
-    # Always pass --force (script-enforced)
-    cmd.append("--force")
+    # Always pass --force (script-enforced) unless an incremental rebuild
+    # was explicitly requested, e.g. by the watch mode.
+    if force:
+        cmd.append("--force")
 
     # ARCH: check choice symbols
     arch = "x86_64"
@@ -71,7 +76,7 @@ def main():
         cmd.append(f"--proc={proc}")
 
     ram = str_of(cfg, "MKQNX_RAM", "1G")
-    if not re.match(r'^[1-9][0-9]*([MG])?$', ram, re.IGNORECASE):
+    if not RAM_RE.match(ram):
         print("Warning: MKQNX_RAM has invalid format; using 1G.", file=sys.stderr)
         ram = "1G"
     if ram != "1G":
@@ -153,6 +158,9 @@ def main():
     if hostname:
         cmd.append(f"--hostname={hostname}")
     mac = str_of(cfg, "MKQNX_MACADDR", "")
+    if mac and not MACADDR_RE.match(mac):
+        print("Warning: MKQNX_MACADDR has invalid format; using a random address.", file=sys.stderr)
+        mac = ""
     if mac:
         cmd.append(f"--macaddr={mac}")
     time_servers = str_of(cfg, "MKQNX_TIME_SERVERS", "pool.ntp.org")
@@ -236,15 +244,438 @@ def main():
     if bool_of(cfg, "MKQNX_SLM"):
         cmd.append("--slm=yes")
 
-    # Print and execute
+    return cmd
+
+def run_mkqnximage(cmd, metrics=None, cwd=None):
+    """Runs mkqnximage and returns its exit code, sampling it for metrics."""
     print("Running command:")
     print(" ".join(shlex.quote(x) for x in cmd))
+    proc = subprocess.Popen(cmd, cwd=cwd)
+    sampler = None
+    if metrics is not None:
+        sampler = ProcessSampler(proc.pid)
+        sampler.start()
+    rc = proc.wait()
+    if sampler is not None:
+        sampler.stop()
+        sampler.export(metrics, "mkqnximage")
+    if rc != 0:
+        print("mkqnximage exited with code", rc, file=sys.stderr)
+    return rc
+
+def run_staged(cfg, mkqnx_cmd, force, mode, metrics=None, resume=False):
+    """Runs mkqnximage in a tmpfs workspace if one is suitable, else in place.
+
+    A failed staged build keeps its workspace; resuming continues in it.
+    """
+    ws = Workspace.kept()
+    if ws is not None and (not resume or mode == "off"):
+        ws.cleanup()
+        ws = None
+    if ws is not None:
+        print(f"Staging in {ws.path}: resuming the failed build.")
+    else:
+        parent, reason = pick_workspace(mode, expected_size())
+        if parent is None:
+            if mode != "off":
+                print(f"Staging on disk: {reason}.")
+            return run_mkqnximage(build_command(cfg, mkqnx_cmd, force), metrics)
+        ws = Workspace(parent)
+        print(f"Staging in {ws.path}: {reason}.")
+    keep = False
     try:
-        subprocess.check_call(cmd)
-    except subprocess.CalledProcessError as e:
-        print("mkqnximage exited with code", e.returncode, file=sys.stderr)
-        sys.exit(e.returncode)
+        ws.seed()
+        cmd = build_command(absolutize_cfg(cfg, ws.root), mkqnx_cmd, force)
+        rc = run_mkqnximage(cmd, metrics, cwd=ws.path)
+        if rc != 0 and ws.free_ratio() < 0.05:
+            print("Staging area ran out of space; retrying on disk.", file=sys.stderr)
+            ws.cleanup()
+            return run_mkqnximage(build_command(cfg, mkqnx_cmd, force), metrics)
+        if rc == 0:
+            ws.collect()
+            print(f"Staging: {ws.staged_bytes / 2**20:.1f} MiB written to {ws.path.parent}, "
+                  f"{ws.persisted_bytes / 2**20:.1f} MiB written to persistent storage.")
+            if metrics is not None:
+                metrics.gauge("staging_bytes", ws.staged_bytes, "Bytes written to the RAM staging area.")
+                metrics.gauge("staging_persisted_bytes", ws.persisted_bytes,
+                              "Bytes copied from the staging area to persistent storage.")
+        else:
+            print(f"Keeping the staging area {ws.path} for --resume; "
+                  "the next build without --resume removes it.", file=sys.stderr)
+            ws.keep()
+            keep = True
+        return rc
+    finally:
+        if not keep:
+            ws.cleanup()
+
+def run_journaled(cfg, mkqnx_cmd, force, stage, metrics=None, resume=False, from_step=None):
+    """Runs mkqnximage as a single journaled step."""
+    if from_step not in (None, "mkqnximage"):
+        print(f"Error: unknown step {from_step}; without --pipeline the only step is mkqnximage.",
+              file=sys.stderr)
+        return 2
+    journal = Journal()
+    digest = journal.step_hash("mkqnximage", build_command(cfg, mkqnx_cmd, False), cfg, [])
+    if resume and from_step is None:
+        if journal.reusable("mkqnximage", digest, "."):
+            print("Build is up to date.")
+            return 0
+        # Without --force mkqnximage keeps the intermediate files that are
+        # still valid and only redoes what changed since the failed run.
+        force = False
+    started = time.monotonic()
+    rc = run_staged(cfg, mkqnx_cmd, force, stage, metrics, resume and from_step is None)
+    journal.record("mkqnximage", digest, rc == 0, ".", time.monotonic() - started)
+    if rc == 0:
+        journal.rehash("mkqnximage", journal.step_hash("mkqnximage", build_command(cfg, mkqnx_cmd, False), cfg, []))
+    if rc != 0:
+        print("Fix the problem and run again with --resume to reuse the intact intermediate files.",
+              file=sys.stderr)
+    return rc
+
+def run_steps(pipeline, cfg, jobs, metrics=None, resume=False, from_step=None):
+    """Runs a build pipeline, reusing journaled steps; returns the exit code."""
+    if from_step is not None and from_step not in pipeline.steps:
+        print(f"Error: unknown step {from_step}; steps are {', '.join(pipeline.order)}.", file=sys.stderr)
+        return 2
+
+    journal = Journal()
+    if not resume and from_step is None:
+        journal.reset()
+    elif resume and from_step is None and journal.failed_step():
+        print(f"[pipeline] resuming the build that failed in step {journal.failed_step()}")
+    forced = pipeline.downstream(from_step) if from_step else set()
+    hashes = {}
+
+    def reuse(step):
+        hashes[step.name] = journal.step_hash(step.name, step.cmd, cfg, step.deps)
+        return step.name not in forced and journal.reusable(step.name, hashes[step.name], step.cwd)
+
+    def on_finish(step, ok):
+        journal.record(step.name, hashes[step.name], ok, step.cwd, step.seconds)
+
+    ok = pipeline.run(jobs, reuse=reuse, on_finish=on_finish)
+    print("[pipeline]", pipeline.report())
+    if pipeline.reused:
+        print("[pipeline] reused:", ", ".join(pipeline.reused))
+    if metrics is not None:
+        for step in pipeline.steps.values():
+            if step.returncode is not None:
+                metrics.gauge("build_step_seconds", step.seconds, "Wall time of each pipeline step.", step=step.name)
+    if not ok:
+        print(f"Fix the problem and run again with --resume to restart from step {pipeline.failed}.",
+              file=sys.stderr)
+        return 1
+    return 0
+
+def rehash_state_steps(pipeline, cfg):
+    """Updates the journal of the steps that read local/ after their state was collected.
+
+    Reused steps are rehashed too: collect() copies their local/ state back
+    as well, and a stale hash would make the next run redo them.
+    """
+    journal = Journal()
+    for step in pipeline.steps.values():
+        if step.returncode != 0 and step.name not in pipeline.reused:
+            continue
+        if step.name.rsplit("/", 1)[-1] in ("shared", "mkqnximage"):
+            journal.rehash(step.name, journal.step_hash(step.name, step.cmd, cfg, step.deps))
+
+def run_pipeline(cfg, tool, force, jobs, metrics=None, resume=False, from_step=None):
+    """Builds the partitions concurrently with a step tool and assembles the disk."""
+    if str_of(cfg, "MKQNX_PART_SIZES", "full") == "full":
+        print("Warning: pipeline mode needs fixed MKQNX_PART_SIZES; building in one step.", file=sys.stderr)
+        return run_mkqnximage(build_command(cfg, tool, force), metrics)
+
+    opts = build_command(absolutize_cfg(cfg, "."), tool, force)[1:]
+    try:
+        pipeline = Pipeline(image_steps(tool, opts))
+    except PipelineError as e:
+        print("Error:", e, file=sys.stderr)
+        return 1
+    rc = run_steps(pipeline, cfg, jobs, metrics, resume, from_step)
+    if rc == 0:
+        collect()
+        rehash_state_steps(pipeline, cfg)
+    return rc
+
+def arch_cfg(cfg, arch):
+    """Returns a copy of cfg building for arch."""
+    out = dict(cfg)
+    out["MKQNX_ARCH_X86_64"] = arch == "x86_64"
+    out["MKQNX_ARCH_AARCH64LE"] = arch == "aarch64le"
+    return out
+
+def run_multiarch(cfg, archs, tool, stepped, force, jobs, metrics=None, resume=False, from_step=None):
+    """Builds an image per architecture into output/<arch>/, sharing what doesn't depend on it.
+
+    With a step tool the arch-independent steps run once; the stock
+    mkqnximage has no steps, so each architecture is built completely and
+    only the builds run concurrently.
+    """
+    if "aarch64le" in archs and (bool_of(cfg, "MKQNX_TYPE_VMWARE") or bool_of(cfg, "MKQNX_TYPE_VBOX")):
+        print("Error: VMware and VirtualBox images can only be built for x86_64.", file=sys.stderr)
+        return 2
+    cfgs = {arch: absolutize_cfg(arch_cfg(cfg, arch), ".") for arch in archs}
+    if stepped and str_of(cfg, "MKQNX_PART_SIZES", "full") == "full":
+        print("Warning: sharing steps between architectures needs fixed MKQNX_PART_SIZES; "
+              "building each architecture completely.", file=sys.stderr)
+        stepped = False
+    fresh_state = not (Path("local") / "misc_files").is_dir()
+    if stepped:
+        steps, shared = multiarch_steps(tool, {a: build_command(c, tool, force)[1:] for a, c in cfgs.items()})
+    else:
+        steps, shared = arch_builds({a: build_command(c, tool, force) for a, c in cfgs.items()}), []
+    try:
+        pipeline = Pipeline(steps)
+    except PipelineError as e:
+        print("Error:", e, file=sys.stderr)
+        return 1
+    rc = run_steps(pipeline, cfg, jobs, metrics, resume, from_step)
+    if rc != 0:
+        return rc
+
+    for arch in archs:
+        state = WORK_DIR / "shared" if stepped else WORK_DIR / archs[0] / "assemble"
+        collect(WORK_DIR / arch, Path("output") / arch, state)
+    rehash_state_steps(pipeline, cfg)
+
+    ran = [s for s in pipeline.steps.values() if s.returncode is not None]
+    shared_secs = sum(s.seconds for s in ran if s.name in shared)
+    if shared:
+        print(f"[multi-arch] shared steps ({', '.join(shared)}): {shared_secs:.1f}s of work done once "
+              f"for {len(archs)} architectures, saving {shared_secs * (len(archs) - 1):.1f}s")
+        for arch in archs:
+            secs = sum(s.seconds for s in ran if s.name.startswith(arch + "/"))
+            print(f"[multi-arch] {arch}: {secs:.1f}s of architecture-specific work, images in output/{arch}/")
+    else:
+        print(f"[multi-arch] {Path(tool).name} has no --step support: {len(archs)} complete builds ran "
+              "concurrently and nothing was shared")
+        for arch in archs:
+            secs = sum(s.seconds for s in ran if s.name.startswith(arch + "/"))
+            print(f"[multi-arch] {arch}: {secs:.1f}s full build, images in output/{arch}/")
+        if fresh_state:
+            print(f"[multi-arch] there was no local/ state to start from, so each image has its own users, "
+                  f"passwords and keys; local/ now holds those of {archs[0]} for the next build")
+    if metrics is not None and shared:
+        metrics.gauge("build_shared_seconds", shared_secs, "Work done once for all architectures.")
+    return 0
+
+def record_outputs(metrics, out_dir="output"):
+    """Adds the sizes of the built images and their partitions to metrics."""
+    out_dir = Path(out_dir)
+    if not out_dir.is_dir():
+        return
+    for p in sorted(out_dir.iterdir()):
+        if p.is_file():
+            metrics.gauge("image_bytes", p.stat().st_size, "Size of each file in output/.", file=p.name)
+    for img in disk_images(out_dir):
+        for part in read_partitions(img):
+            metrics.gauge("partition_bytes", part.size, "Size of each partition of the disk images.",
+                          file=img.name, partition=part.name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a QNX image with mkqnximage from a .config file.")
+    parser.add_argument("config", help="path to the .config file")
+    parser.add_argument("--no-force", action="store_true",
+                        help="don't pass --force; let mkqnximage reuse up-to-date intermediate files")
+    parser.add_argument("--cache", metavar="URL",
+                        help="shared build cache to consult before building (default: $MKQNX_CACHE_URL)")
+    parser.add_argument("--cache-readonly", action="store_true",
+                        help="only download from the build cache, never upload (default: $MKQNX_CACHE_READONLY)")
+    parser.add_argument("--metrics-dir", metavar="DIR",
+                        help="write a Prometheus textfile here (default: $MKQNX_METRICS_DIR)")
+    parser.add_argument("--metrics-push", metavar="URL",
+                        help="push metrics to this Pushgateway (default: $MKQNX_METRICS_PUSH)")
+    parser.add_argument("--stage", choices=("off", "auto", "ram"), default=os.environ.get("MKQNX_STAGE", "off"),
+                        help="build in a tmpfs workspace: 'auto' when it fits in free memory, "
+                             "'ram' whenever the tmpfs has room (default: $MKQNX_STAGE or off)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="build the boot, system and data partitions concurrently with a step tool "
+                             "(not the stock mkqnximage; needs fixed MKQNX_PART_SIZES)")
+    parser.add_argument("--step-tool", metavar="PATH", default=os.environ.get("MKQNX_STEP_TOOL"),
+                        help="tool implementing the pipeline steps (default: $MKQNX_STEP_TOOL)")
+    parser.add_argument("-j", "--jobs", type=int, help="maximum number of concurrent pipeline steps")
+    parser.add_argument("--archs", metavar="LIST", default=os.environ.get("MKQNX_ARCHS"),
+                        help="build for each of these comma-separated architectures into output/<arch>/ "
+                             f"({', '.join(ARCHS)}; default: $MKQNX_ARCHS)")
+    parser.add_argument("--resume", action="store_true",
+                        help="reuse the steps of the previous build whose inputs and results are unchanged")
+    parser.add_argument("--from-step", metavar="STEP",
+                        help="rerun STEP and everything after it, reusing earlier steps")
+    parser.add_argument("--no-preflight", action="store_true",
+                        help="don't check the config against the host capabilities before building")
+    parser.add_argument("--cgroup", action="store_true", default=bool_of_env("MKQNX_CGROUP"),
+                        help="run mkqnximage in its own cgroup v2 below mkqnx.slice (default: $MKQNX_CGROUP)")
+    parser.add_argument("--cpu-weight", type=int, default=os.environ.get("MKQNX_CPU_WEIGHT"),
+                        help="cgroup cpu.weight, 1-10000 (default: $MKQNX_CPU_WEIGHT or unchanged)")
+    parser.add_argument("--io-max", metavar="SPEC", default=os.environ.get("MKQNX_IO_MAX"),
+                        help="cgroup io.max limits, e.g. 'wbps=100M rbps=200M' (default: $MKQNX_IO_MAX)")
+    parser.add_argument("--memory-high", metavar="SIZE", default=os.environ.get("MKQNX_MEMORY_HIGH"),
+                        help="cgroup memory.high, e.g. 4G (default: $MKQNX_MEMORY_HIGH)")
+    parser.add_argument("--log-dir", metavar="DIR", default=os.environ.get("MKQNX_LOG_DIR"),
+                        help="archive the build output, compressed and indexed, in DIR "
+                             "(default: $MKQNX_LOG_DIR; search it with scripts/buildlog.py)")
+    parser.add_argument("--psi-limit", type=float, default=os.environ.get("MKQNX_PSI_LIMIT"),
+                        help="only start when no resource stalls more than this percentage "
+                             "(PSI avg10, default: $MKQNX_PSI_LIMIT)")
+    args = parser.parse_args()
+
+    if not args.log_dir:
+        rc = build(args)
+    else:
+        writer = LogWriter({"config": args.config, "argv": sys.argv[1:]}, args.log_dir)
+        started = time.time()
+        rc = 1
+        try:
+            with Tee(writer):
+                rc = build(args)
+        finally:
+            # Pipeline steps log to their own directories; archive them too.
+            for log in sorted(WORK_DIR.rglob("step.log")):
+                if log.stat().st_mtime >= started:
+                    writer.write(f"==> {log.parent.relative_to(WORK_DIR)}/step.log <==\n".encode())
+                    writer.write(log.read_bytes())
+            writer.close(rc)
+        print(f"Build log archived as {writer.id} in {args.log_dir}.")
+    if rc != 0:
+        sys.exit(rc)
+
+def build(args):
+    """Runs the build described by the parsed arguments; returns the exit code."""
+    conf_path = Path(args.config)
+    if not conf_path.exists():
+        print("Config file not found:", conf_path, file=sys.stderr)
+        return 1
+
+    started = time.monotonic()
+    cfg = parse_config(conf_path)
+
+    archs = [a.strip() for a in (args.archs or "").split(",") if a.strip()]
+    for arch in archs:
+        if arch not in ARCHS:
+            print(f"Error: unknown architecture {arch}; choose from {', '.join(ARCHS)}.", file=sys.stderr)
+            return 1
+
+    if args.pipeline:
+        mkqnx_cmd = shutil.which(args.step_tool) if args.step_tool else None
+        if not mkqnx_cmd:
+            print("Error: pipeline mode needs a step tool; set --step-tool or MKQNX_STEP_TOOL.", file=sys.stderr)
+            return 1
+        if not supports_steps(mkqnx_cmd):
+            print(f"Error: {mkqnx_cmd} does not implement the --step protocol pipeline mode needs; "
+                  "the stock mkqnximage can only build without --pipeline.", file=sys.stderr)
+            return 1
+    else:
+        mkqnx_cmd = shutil.which("mkqnximage")
+        if not mkqnx_cmd:
+            print("Error: 'mkqnximage' not found on PATH.", file=sys.stderr)
+            return 1
+
+    metrics_dir, metrics_push = metrics_target(args.metrics_dir, args.metrics_push)
+    metrics = None
+    if metrics_dir or metrics_push:
+        arch = "aarch64le" if bool_of(cfg, "MKQNX_ARCH_AARCH64LE") else "x86_64"
+        metrics = Metrics("mkqnx_build", {"config": conf_path.name, "arch": arch})
+    phase = metrics.phase if metrics else (lambda name: contextlib.nullcontext())
+
+    if not args.no_preflight:
+        with phase("preflight"):
+            caps = preflight.probe()
+            cfg, findings = preflight.check(cfg, caps)
+            if not args.pipeline:
+                # Step tools take the mkqnximage options but don't list them.
+                findings += preflight.check_options(build_command(cfg, mkqnx_cmd), caps)
+        preflight.report([f for f in findings if f[0] != "note"])
+        if any(level == "error" for level, _ in findings):
+            print("Error: the host can't build this config; use --no-preflight to build anyway.", file=sys.stderr)
+            return 1
+
+    with phase("prepare"):
+        cmd = build_command(cfg, mkqnx_cmd, force=not args.no_force)
+
+    rc = 0
+    hit = False
+    cache = client_from_env(args.cache, True if args.cache_readonly else None)
+    if cache and archs:
+        print("Warning: the build cache holds single-architecture builds; not using it.", file=sys.stderr)
+        cache = None
+    if cache:
+        with phase("cache_lookup"):
+            try:
+                key = cache_key(cfg, cmd)
+                manifest = cache.lookup(key)
+                if manifest:
+                    cache.fetch(key, manifest, "output")
+                    print("Build cache hit:", key)
+                    hit = True
+                else:
+                    print("Build cache miss:", key)
+            except CacheError as e:
+                print("Warning: build cache unavailable:", e, file=sys.stderr)
+                cache = None
+
+    governor = None
+    if not hit and args.cgroup:
+        governor = Governor(args.cpu_weight, args.io_max, args.memory_high, args.psi_limit)
+        with phase("admission"):
+            if not governor.admit():
+                print("Warning: host still under pressure; building anyway.", file=sys.stderr)
+        try:
+            governor.enter()
+        except CgroupError as e:
+            print("Warning: building without a cgroup:", e, file=sys.stderr)
+            governor = None
+
+    if not hit:
+        try:
+            with phase("mkqnximage"):
+                if archs:
+                    rc = run_multiarch(cfg, archs, mkqnx_cmd, supports_steps(mkqnx_cmd), not args.no_force,
+                                       args.jobs, metrics, args.resume, args.from_step)
+                elif args.pipeline:
+                    rc = run_pipeline(cfg, mkqnx_cmd, not args.no_force, args.jobs, metrics,
+                                      args.resume, args.from_step)
+                else:
+                    rc = run_journaled(cfg, mkqnx_cmd, not args.no_force, args.stage, metrics,
+                                       args.resume, args.from_step)
+        finally:
+            usage = governor.leave() if governor else {}
+        if usage:
+            print("cgroup usage: " + ", ".join(f"{k}={v:g}" for k, v in usage.items()))
+        if metrics is not None and governor is not None:
+            metrics.gauge("build_admission_wait_seconds", governor.waited,
+                          "Time the build waited for host pressure to drop.")
+            for key, value in usage.items():
+                metrics.gauge(f"build_cgroup_{key}", value,
+                              f"{key.replace('_', ' ').capitalize()} used by the build's cgroup.")
+
+    if rc == 0 and cache and not hit and not cache.read_only:
+        with phase("cache_store"):
+            try:
+                cache.store(key, "output")
+                print("Stored build in cache:", key)
+            except CacheError as e:
+                print("Warning: could not store build in cache:", e, file=sys.stderr)
+
+    if metrics:
+        metrics.gauge("build_seconds", time.monotonic() - started, "Total wall time of the build.")
+        metrics.gauge("build_timestamp_seconds", time.time(), "Time the last build finished.")
+        if not hit:
+            metrics.gauge("mkqnximage_exit_code", rc, "Exit code of the last mkqnximage run.")
+        if cache:
+            totals = bump_counters(metrics_dir or "local", metrics.job, lookups=1, hits=int(hit))
+            metrics.counter("build_cache_lookups", totals["lookups"], "Build cache lookups.")
+            metrics.counter("build_cache_hits", totals["hits"], "Build cache hits.")
+            metrics.gauge("build_cache_hit_ratio", totals["hits"] / totals["lookups"],
+                          "Fraction of build cache lookups that were hits.")
+        if rc == 0:
+            record_outputs(metrics)
+        for err in metrics.emit(metrics_dir, metrics_push):
+            print("Warning:", err, file=sys.stderr)
+
+    return rc
 
 if __name__ == "__main__":
     main()
-
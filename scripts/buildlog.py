@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Compressed, indexed archive of build logs.
+
+Each build's output is stored as a sequence of independently compressed
+frames of about 1 MiB of text (zstd when available, else zlib) in
+<dir>/<id>.log.<codec>, with an index <dir>/<id>.idx holding the build's
+metadata and, per frame, its offset, its line numbers and a bloom filter
+of the lower-cased character trigrams of its lines.
+
+"buildlog.py grep" derives the trigrams every match must contain from the
+pattern and only decompresses the frames whose filters have all of them,
+so searching hundreds of builds mostly reads the small index files.
+
+Usage:
+  buildlog.py grep [-i] [-F] [--last N] [--dir DIR] PATTERN
+  buildlog.py list [--dir DIR]
+  buildlog.py show [--dir DIR] ID
+"""
+import argparse
+import base64
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import re._constants as sre_constants
+    import re._parser as sre_parse
+except ImportError:                                 # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+try:
+    from compression import zstd as _zstd          # Python 3.14+
+    CODEC = "zstd"
+    _compress, _decompress = (lambda b: _zstd.compress(b, 10)), _zstd.decompress
+except ImportError:
+    try:
+        import zstandard as _zstd
+        CODEC = "zstd"
+        _compress = _zstd.ZstdCompressor(level=10).compress
+        _decompress = _zstd.ZstdDecompressor().decompress
+    except ImportError:
+        CODEC = "zlib"
+        _compress, _decompress = (lambda b: zlib.compress(b, 6)), zlib.decompress
+
+LOG_DIR = Path(os.environ.get("MKQNX_LOG_DIR", "build-logs"))
+FRAME = 1024 * 1024
+VERSION = 1
+BLOOM_BITS_PER_ITEM = 10
+BLOOM_HASHES = 5
+
+def decompress(codec, data):
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if CODEC != "zstd":
+        raise RuntimeError("this log is zstd-compressed; install zstandard or use Python 3.14+")
+    return _decompress(data)
+
+def trigrams(text):
+    text = text.lower()
+    # Deduplicating the character tuples first is faster than slicing.
+    return {"".join(t) for t in set(zip(text, text[1:], text[2:]))}
+
+class Bloom:
+    def __init__(self, nbits, data=None):
+        self.nbits = nbits
+        self.bits = bytearray(data if data is not None else (nbits + 7) // 8)
+
+    def _positions(self, item):
+        b = item.encode("utf-8", "surrogateescape")
+        h1 = zlib.crc32(b)
+        h2 = zlib.crc32(b, 0x9E3779B9) | 1
+        return ((h1 + i * h2) % self.nbits for i in range(BLOOM_HASHES))
+
+    def add(self, item):
+        for p in self._positions(item):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+def _literal_runs(parsed, runs):
+    run = ""
+    for op, av in parsed:
+        if op is sre_constants.LITERAL:
+            run += chr(av)
+            continue
+        runs.append(run)
+        run = ""
+        if op is sre_constants.SUBPATTERN:
+            _literal_runs(av[-1], runs)
+        # Anything else (alternatives, repeats, classes) requires no
+        # particular literal text.
+    runs.append(run)
+    return runs
+
+def required_trigrams(pattern, fixed=False):
+    """Returns the trigrams every match of pattern contains (lower-cased)."""
+    if fixed:
+        return trigrams(pattern)
+    try:
+        runs = _literal_runs(sre_parse.parse(pattern), [])
+    except re.error:
+        return set()
+    out = set()
+    for r in runs:
+        out |= trigrams(r)
+    return out
+
+class LogWriter:
+    """Writes one build's log as compressed frames and its index."""
+
+    def __init__(self, meta, log_dir=LOG_DIR):
+        self.dir = Path(log_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.id = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        self.path = self.dir / f"{self.id}.log.{CODEC}"
+        self.f = open(self.path, "wb")
+        self.meta = dict(meta, id=self.id, started=time.time(), codec=CODEC)
+        self.frames = []
+        self.buf = bytearray()
+        self.lines = 0
+        self.raw = 0
+
+    def write(self, data):
+        self.buf += data
+        if len(self.buf) >= FRAME:
+            cut = self.buf.rfind(b"\n", 0, len(self.buf)) + 1 or len(self.buf)
+            self._frame(bytes(self.buf[:cut]))
+            del self.buf[:cut]
+
+    def _frame(self, data):
+        text = data.decode("utf-8", "replace")
+        lines = text.splitlines()
+        # Build logs repeat a lot of lines; take each one's trigrams once.
+        grams = trigrams("\n".join(set(lines)))
+        bloom = Bloom(max(64, len(grams) * BLOOM_BITS_PER_ITEM))
+        for g in grams:
+            bloom.add(g)
+        blob = _compress(data)
+        self.frames.append({"offset": self.f.tell(), "size": len(blob), "first_line": self.lines + 1,
+                            "lines": len(lines), "bloom_bits": bloom.nbits,
+                            "bloom": base64.b64encode(bytes(bloom.bits)).decode("ascii")})
+        self.f.write(blob)
+        self.lines += len(lines)
+        self.raw += len(data)
+
+    def close(self, returncode=None):
+        if self.buf:
+            self._frame(bytes(self.buf))
+            self.buf.clear()
+        self.f.close()
+        self.meta.update(finished=time.time(), returncode=returncode, lines=self.lines,
+                         raw_bytes=self.raw, stored_bytes=self.path.stat().st_size, frames=self.frames)
+        tmp = self.dir / f"{self.id}.idx.tmp"
+        tmp.write_text(json.dumps(dict(self.meta, version=VERSION)), encoding="utf-8")
+        os.replace(tmp, self.dir / f"{self.id}.idx")
+
+class Tee:
+    """Copies everything this process and its children write to stdout and stderr into a LogWriter.
+
+    The two streams stay separate on the terminal; in the archive they are
+    interleaved a line at a time.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.saved = os.dup(1), os.dup(2)
+        self.threads = []
+        for fd, out in ((1, self.saved[0]), (2, self.saved[1])):
+            r, w = os.pipe()
+            os.dup2(w, fd)
+            os.close(w)
+            thread = threading.Thread(target=self._pump, args=(r, out), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self.writer
+
+    def _pump(self, r, out):
+        partial = b""
+        while True:
+            data = os.read(r, 65536)
+            if not data:
+                break
+            os.write(out, data)
+            lines, nl, partial = (partial + data).rpartition(b"\n")
+            if nl:
+                with self.lock:
+                    self.writer.write(lines + nl)
+        if partial:
+            with self.lock:
+                self.writer.write(partial)
+        os.close(r)
+
+    def __exit__(self, *exc):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(self.saved[0], 1)
+        os.dup2(self.saved[1], 2)
+        for thread in self.threads:
+            thread.join()
+        for fd in self.saved:
+            os.close(fd)
+        return False
+
+def load_indexes(log_dir=LOG_DIR):
+    out = []
+    for p in sorted(Path(log_dir).glob("*.idx")):
+        try:
+            idx = json.loads(p.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if idx.get("version") == VERSION:
+            out.append(idx)
+    return out
+
+def read_frame(log_dir, idx, frame):
+    path = Path(log_dir) / f"{idx['id']}.log.{idx['codec']}"
+    with open(path, "rb") as f:
+        f.seek(frame["offset"])
+        return decompress(idx["codec"], f.read(frame["size"])).decode("utf-8", "replace")
+
+def search_build(log_dir, idx, regex, grams):
+    """Returns (matches, frames read) for one build."""
+    matches = []
+    read = 0
+    for frame in idx["frames"]:
+        if grams:
+            bloom = Bloom(frame["bloom_bits"], base64.b64decode(frame["bloom"]))
+            if not all(g in bloom for g in grams):
+                continue
+        read += 1
+        for n, ln in enumerate(read_frame(log_dir, idx, frame).splitlines(), frame["first_line"]):
+            if regex.search(ln):
+                matches.append((n, ln))
+    return matches, read
+
+def describe(idx):
+    when = time.strftime("%Y-%m-%d %H:%M", time.localtime(idx["started"]))
+    return f"{idx['id']} {when} {idx.get('config', '?')} rc={idx.get('returncode')}"
+
+def cmd_grep(args):
+    flags = re.IGNORECASE if args.ignore_case else 0
+    regex = re.compile(re.escape(args.pattern) if args.fixed_strings else args.pattern, flags)
+    grams = required_trigrams(args.pattern, args.fixed_strings)
+    indexes = load_indexes(args.dir)
+    if args.last:
+        indexes = indexes[-args.last:]
+    start = time.monotonic()
+    total = sum(len(i["frames"]) for i in indexes)
+    read = found = 0
+    with ThreadPoolExecutor() as pool:
+        results = pool.map(lambda i: search_build(args.dir, i, regex, grams), indexes)
+        for idx, (matches, n) in zip(indexes, results):
+            read += n
+            if matches:
+                found += 1
+                print(f"== {describe(idx)}")
+                for line_no, ln in matches[:args.max_count]:
+                    print(f"{line_no}: {ln}")
+                if len(matches) > args.max_count:
+                    print(f"... {len(matches) - args.max_count} more")
+    print(f"{found} of {len(indexes)} builds match; decompressed {read} of {total} frames "
+          f"in {time.monotonic() - start:.2f}s.", file=sys.stderr)
+    return 0 if found else 1
+
+def cmd_list(args):
+    for idx in load_indexes(args.dir):
+        ratio = idx["raw_bytes"] / idx["stored_bytes"] if idx.get("stored_bytes") else 0
+        print(f"{describe(idx)} {idx['lines']} lines, {idx['raw_bytes'] >> 10} KiB -> "
+              f"{idx['stored_bytes'] >> 10} KiB ({ratio:.1f}x)")
+    return 0
+
+def cmd_show(args):
+    for idx in load_indexes(args.dir):
+        if idx["id"] == args.id:
+            for frame in idx["frames"]:
+                sys.stdout.write(read_frame(args.dir, idx, frame))
+            return 0
+    print("No such build log:", args.id, file=sys.stderr)
+    return 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Search and show archived build logs.")
+    parser.add_argument("--dir", type=Path, default=LOG_DIR, help="archive directory (default: $MKQNX_LOG_DIR "
+                                                                  "or build-logs)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("grep", help="search the logs of all builds")
+    p.add_argument("pattern", help="regular expression")
+    p.add_argument("-i", "--ignore-case", action="store_true")
+    p.add_argument("-F", "--fixed-strings", action="store_true", help="pattern is a plain string")
+    p.add_argument("--last", type=int, help="only search the last N builds")
+    p.add_argument("-m", "--max-count", type=int, default=20, help="matching lines to show per build")
+    p.set_defaults(func=cmd_grep)
+    p = sub.add_parser("list", help="list the archived builds")
+    p.set_defaults(func=cmd_list)
+    p = sub.add_parser("show", help="print the log of one build")
+    p.add_argument("id")
+    p.set_defaults(func=cmd_show)
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+cgroup v2 resource governor for builds on shared hosts.
+
+With the governor enabled the build waits until the host's pressure stall
+information (PSI) shows enough headroom, then moves itself into its own
+cgroup below a common slice (mkqnx.slice by default) before mkqnximage is
+started, so mkqnximage and everything it runs inherit the limits:
+
+  cpu.weight   share of the CPU relative to other builds and services
+  io.max       read/write bandwidth caps on the build directory's disk
+  memory.high  throttling (not killing) threshold for the build's memory
+
+Overlapping builds thus share the machine proportionally instead of
+thrashing it. When the build ends, its CPU time, peak memory and I/O are
+read from cpu.stat, memory.peak and io.stat.
+
+The cgroup and PSI locations can be overridden (MKQNX_CGROUP_ROOT,
+MKQNX_PSI_DIR), so the governor can be exercised against a directory tree
+that imitates them.
+"""
+import os
+import re
+import time
+from pathlib import Path
+
+CGROUP_ROOT = Path(os.environ.get("MKQNX_CGROUP_ROOT", "/sys/fs/cgroup"))
+PSI_DIR = Path(os.environ.get("MKQNX_PSI_DIR", "/proc/pressure"))
+SLICE = "mkqnx.slice"
+CONTROLLERS = ("cpu", "io", "memory")
+PSI_RESOURCES = ("cpu", "io", "memory")
+
+SIZE_RE = re.compile(r"^(\d+)([KMG]?)$", re.IGNORECASE)
+SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+class CgroupError(Exception):
+    pass
+
+def parse_size(text):
+    """Parses sizes like 512M or 2G into bytes."""
+    m = SIZE_RE.match(text.strip())
+    if not m:
+        raise CgroupError(f"invalid size: {text}")
+    return int(m.group(1)) * SIZE_UNITS[m.group(2).lower()]
+
+def read_psi(resource, psi_dir=PSI_DIR):
+    """Returns the 'some' avg10 stall percentage of resource, or None."""
+    try:
+        with open(Path(psi_dir) / resource) as f:
+            for ln in f:
+                if ln.startswith("some "):
+                    fields = dict(kv.split("=", 1) for kv in ln.split()[1:])
+                    return float(fields["avg10"])
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+def block_device(path="."):
+    """Returns "major:minor" of the whole disk holding path, as io.max wants it."""
+    dev = os.stat(path).st_dev
+    majmin = f"{os.major(dev)}:{os.minor(dev)}"
+    sysfs = Path("/sys/dev/block") / majmin
+    if (sysfs / "partition").exists():
+        try:
+            return (sysfs.resolve().parent / "dev").read_text().strip()
+        except OSError:
+            pass
+    return majmin
+
+def io_max_line(spec, path="."):
+    """Turns "wbps=50M riops=1000" (with an optional leading MAJ:MIN) into an io.max line."""
+    fields = spec.split()
+    dev = fields.pop(0) if fields and re.match(r"^\d+:\d+$", fields[0]) else block_device(path)
+    out = []
+    for f in fields:
+        key, _, val = f.partition("=")
+        if key not in ("rbps", "wbps", "riops", "wiops") or not val:
+            raise CgroupError(f"invalid io.max setting: {f}")
+        out.append(f"{key}={val if val == 'max' or key.endswith('iops') else parse_size(val)}")
+    return " ".join([dev] + out)
+
+class Governor:
+    def __init__(self, cpu_weight=None, io_max=None, memory_high=None, psi_limit=None,
+                 root=CGROUP_ROOT, slice_name=SLICE, psi_dir=PSI_DIR):
+        self.root = Path(root)
+        self.slice = self.root / slice_name
+        self.cpu_weight = cpu_weight
+        self.io_max = io_max
+        self.memory_high = memory_high
+        self.psi_limit = psi_limit
+        self.psi_dir = Path(psi_dir)
+        self.path = None
+        self.origin = None
+        self.waited = 0.0
+
+    def available(self):
+        return (self.root / "cgroup.controllers").is_file()
+
+    def pressure(self):
+        return {r: read_psi(r, self.psi_dir) for r in PSI_RESOURCES}
+
+    def admit(self, timeout=600, interval=5, log=print):
+        """Waits until no resource stalls more than psi_limit percent.
+
+        Returns True once admitted and False if the host was still under
+        pressure after timeout seconds; the caller may then build anyway.
+        """
+        if self.psi_limit is None:
+            return True
+        start = time.monotonic()
+        announced = False
+        while True:
+            busy = {r: v for r, v in self.pressure().items() if v is not None and v > self.psi_limit}
+            self.waited = time.monotonic() - start
+            if not busy:
+                return True
+            if self.waited >= timeout:
+                return False
+            if not announced:
+                log("Waiting for host pressure to drop: " +
+                    ", ".join(f"{r} {v:.0f}%" for r, v in busy.items()))
+                announced = True
+            time.sleep(interval)
+
+    def _write(self, name, value):
+        try:
+            (self.path / name).write_text(f"{value}\n")
+        except OSError as e:
+            raise CgroupError(f"cannot set {name} of {self.path}: {e}") from e
+
+    def _enable_controllers(self, cgroup):
+        try:
+            have = (cgroup / "cgroup.controllers").read_text().split()
+        except OSError:
+            return
+        wanted = [c for c in CONTROLLERS if c in have]
+        if wanted:
+            try:
+                (cgroup / "cgroup.subtree_control").write_text(" ".join("+" + c for c in wanted) + "\n")
+            except OSError as e:
+                raise CgroupError(f"cannot enable {', '.join(wanted)} in {cgroup}: {e}") from e
+
+    def enter(self, name=None):
+        """Creates the build's cgroup, applies the limits and moves this process into it."""
+        if not self.available():
+            raise CgroupError(f"no cgroup v2 hierarchy at {self.root}")
+        try:
+            self.slice.mkdir(exist_ok=True)
+            self._enable_controllers(self.root)
+            self._enable_controllers(self.slice)
+            self.path = self.slice / (name or f"build-{os.getpid()}")
+            created = not self.path.exists()
+            self.path.mkdir(exist_ok=True)
+        except OSError as e:
+            self.path = None
+            raise CgroupError(f"cannot create cgroup in {self.slice}: {e}") from e
+        try:
+            if self.cpu_weight is not None:
+                self._write("cpu.weight", self.cpu_weight)
+            if self.io_max:
+                self._write("io.max", io_max_line(self.io_max))
+            if self.memory_high:
+                self._write("memory.high", parse_size(self.memory_high))
+            self.origin = self._current()
+            self._write("cgroup.procs", os.getpid())
+        except CgroupError:
+            # Don't leave an unused cgroup behind for every failed attempt.
+            if created:
+                try:
+                    self.path.rmdir()
+                except OSError:
+                    pass
+            self.path = None
+            raise
+
+    def _current(self):
+        try:
+            for ln in Path("/proc/self/cgroup").read_text().splitlines():
+                if ln.startswith("0::"):
+                    return self.root / ln[3:].lstrip("/")
+        except OSError:
+            pass
+        return self.root
+
+    def stats(self):
+        """Returns cpu_seconds, memory_peak_bytes, io_read_bytes and io_write_bytes."""
+        out = {}
+        try:
+            for ln in (self.path / "cpu.stat").read_text().splitlines():
+                key, _, val = ln.partition(" ")
+                if key == "usage_usec":
+                    out["cpu_seconds"] = int(val) / 1e6
+        except (OSError, ValueError):
+            pass
+        try:
+            out["memory_peak_bytes"] = int((self.path / "memory.peak").read_text())
+        except (OSError, ValueError):
+            pass
+        try:
+            rbytes = wbytes = 0
+            for ln in (self.path / "io.stat").read_text().splitlines():
+                fields = dict(kv.split("=", 1) for kv in ln.split()[1:] if "=" in kv)
+                rbytes += int(fields.get("rbytes", 0))
+                wbytes += int(fields.get("wbytes", 0))
+            out["io_read_bytes"] = rbytes
+            out["io_write_bytes"] = wbytes
+        except (OSError, ValueError):
+            pass
+        return out
+
+    def leave(self):
+        """Moves this process back and removes the build's cgroup; returns its stats."""
+        if self.path is None:
+            return {}
+        stats = self.stats()
+        try:
+            (self.origin / "cgroup.procs").write_text(f"{os.getpid()}\n")
+        except OSError:
+            pass
+        # The cgroup can only be removed once it is empty; leftover
+        # processes (e.g. a VM started by the build) keep it alive.
+        try:
+            self.path.rmdir()
+        except OSError:
+            pass
+        self.path = None
+        return stats
@@ -1,4 +1,5 @@
 
+import os
 import re
 
 def parse_config(conf_path):
@@ -28,6 +29,10 @@ def bool_of(cfg, k):
     """Returns the boolean value of a key in the config."""
     return bool(cfg.get(k, False))
 
+def bool_of_env(name):
+    """Returns the boolean value of an environment variable, spelled like a config value (y/n) or 1/0."""
+    return os.environ.get(name, "").strip().lower() in ("y", "yes", "1", "true")
+
 def str_of(cfg, k, default=""):
     """Returns the string value of a key in the config."""
     v = cfg.get(k, None)
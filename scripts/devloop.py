@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+Development loop that serves /fs/qnx from the host instead of rebuilding.
+
+Changing a binary normally means rebuilding the image and rebooting the VM.
+In the dev loop the image is built once with MKQNX_NFS pointing at a host
+directory (devloop/export by default), which the guest mounts at /fs/qnx.
+The build outputs given with --src are then synced into that directory
+whenever they change, so a new binary is visible in the running VM within
+seconds:
+
+- Only files whose size or modification time changed are copied, each to a
+  temporary name first and renamed, so the guest never sees half a file.
+  Files removed from a source directory are removed from the export.
+- After every sync the generation number in /fs/qnx/.devloop-generation is
+  bumped and, with --ssh, the --on-sync command is run in the guest (e.g.
+  to restart the program under test).
+- The image is only rebuilt when .config or another system-level input
+  (repositories, policy, ssh identity) changes; changes to local/ and the
+  extra directories get an incremental rebuild as in watch_build.py.
+
+The directory is exported with unfsd (unfs3) when it is installed, or with
+the kernel NFS server through exportfs when running as root. Without
+either, a stand-in pushes the synced files into the guest over ssh (to
+/data/devloop) instead, and MKQNX_NFS is left unchanged.
+
+With QEMU and VirtualBox NAT networking the host is 10.0.2.2 as seen from
+the guest; use --host-addr for other network setups.
+"""
+import argparse
+import ipaddress
+import json
+import os
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from config_parser import parse_config
+from disk_image import disk_images
+from watch_build import SCOPE_FULL, SCOPE_NONE, Builder, WatchSet, make_watcher
+
+RUN_SCRIPT = Path(__file__).resolve().parent / "run_image.py"
+
+DEVLOOP_DIR = Path("devloop")
+HOST_ADDR = "10.0.2.2"
+MOUNT_POINT = "/fs/qnx"
+PUSH_DIR = "/data/devloop"
+GENERATION_FILE = ".devloop-generation"
+# Sources are synced as a whole; a burst of writes by a compiler or an
+# install step is combined into one sync.
+SYNC_DEBOUNCE = 0.2
+
+class DevloopError(Exception):
+    pass
+
+def nfs_spec(export, host_addr=HOST_ADDR):
+    """Returns the MKQNX_NFS value that mounts export from the host."""
+    return f"{host_addr}:{Path(export).resolve()}"
+
+def write_derived_config(conf_path, out_path, nfs):
+    """Writes conf_path to out_path with MKQNX_NFS set to nfs; returns the parsed result."""
+    lines = conf_path.read_text(encoding="utf-8").splitlines()
+    new_line = f'CONFIG_MKQNX_NFS="{nfs}"'
+    found = False
+    out_lines = []
+    for ln in lines:
+        stripped = ln.strip()
+        if stripped.startswith("CONFIG_MKQNX_NFS=") or stripped == "# CONFIG_MKQNX_NFS is not set":
+            out_lines.append(new_line)
+            found = True
+        else:
+            out_lines.append(ln)
+    if not found:
+        out_lines.append(new_line)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_suffix(".tmp")
+    tmp.write_text("\n".join(out_lines) + "\n", encoding="utf-8")
+    os.replace(tmp, out_path)
+    return parse_config(out_path)
+
+def parse_source(spec):
+    """Parses "DIR" or "DIR=SUBDIR" into (source directory, path below the export)."""
+    src, _, dest = spec.partition("=")
+    dest = dest.strip("/")
+    if dest and ".." in Path(dest).parts:
+        raise DevloopError(f"invalid destination in --src {spec}")
+    return Path(src).expanduser().resolve(), Path(dest)
+
+class Syncer:
+    """Mirrors the source directories into the export directory incrementally."""
+
+    def __init__(self, sources, export, state_path):
+        self.sources = sources
+        self.export = Path(export)
+        self.state_path = state_path
+        self.synced = {}
+        try:
+            self.synced = json.loads(state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            pass
+        self.generation = self.synced.pop("", 0)
+
+    def _scan(self):
+        """Returns {relative target: (source path, size, mtime_ns, mode)}."""
+        files = {}
+        for src, dest in self.sources:
+            for dirpath, dirnames, filenames in os.walk(src):
+                dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+                for fn in filenames:
+                    p = os.path.join(dirpath, fn)
+                    try:
+                        st = os.stat(p)
+                    except OSError:
+                        continue
+                    rel = str(dest / os.path.relpath(p, src))
+                    # With overlapping destinations the first source wins.
+                    files.setdefault(rel, (p, st.st_size, st.st_mtime_ns, st.st_mode & 0o7777))
+        return files
+
+    def sync(self):
+        """Copies new and changed files and deletes removed ones; returns (copied, removed)."""
+        files = self._scan()
+        copied = []
+        for rel, (p, size, mtime, mode) in sorted(files.items()):
+            if self.synced.get(rel) == [size, mtime, mode] and (self.export / rel).exists():
+                continue
+            target = self.export / rel
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_name(f".{target.name}.devloop-tmp")
+            try:
+                shutil.copy2(p, tmp)
+                os.replace(tmp, target)
+            except OSError as e:
+                # The file may still be being written; the next event retries it.
+                print(f"[devloop] cannot copy {p}: {e}", file=sys.stderr)
+                tmp.unlink(missing_ok=True)
+                continue
+            self.synced[rel] = [size, mtime, mode]
+            copied.append(rel)
+        removed = []
+        for rel in sorted(set(self.synced) - set(files)):
+            try:
+                (self.export / rel).unlink()
+            except FileNotFoundError:
+                pass
+            del self.synced[rel]
+            removed.append(rel)
+        if copied or removed:
+            self.generation += 1
+            (self.export / GENERATION_FILE).write_text(f"{self.generation}\n")
+            self._save()
+        return copied, removed
+
+    def _save(self):
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(dict(self.synced, **{"": self.generation})), encoding="utf-8")
+        os.replace(tmp, self.state_path)
+
+class NfsServer:
+    """Exports a directory with unfsd or the kernel NFS server."""
+
+    def __init__(self, kind, export, clients, state_dir):
+        self.kind = kind
+        self.export = Path(export).resolve()
+        self.clients = clients
+        self.state_dir = state_dir
+        self.proc = None
+
+    @staticmethod
+    def detect(wanted="auto"):
+        """Returns the server kind to use: unfsd, kernel or ssh (the stand-in)."""
+        if wanted in ("unfsd", "auto") and shutil.which("unfsd"):
+            return "unfsd"
+        if wanted in ("kernel", "auto") and shutil.which("exportfs") and os.geteuid() == 0:
+            return "kernel"
+        if wanted != "auto" and wanted != "ssh":
+            raise DevloopError(f"NFS server '{wanted}' is not available on this host")
+        return "ssh"
+
+    @staticmethod
+    def owner():
+        """Returns the uid and gid of the invoking user, also when run through sudo."""
+        if os.geteuid() == 0 and "SUDO_UID" in os.environ:
+            return int(os.environ["SUDO_UID"]), int(os.environ.get("SUDO_GID", os.environ["SUDO_UID"]))
+        return os.getuid(), os.getgid()
+
+    def options(self, client):
+        """Returns the export options for client.
+
+        Every access is mapped to the invoking user, so the guest can't
+        touch anything that user couldn't. Only NAT guests, which an
+        unprivileged QEMU or VirtualBox relays from unprivileged ports on
+        the loopback address, are accepted from ports above 1023.
+        """
+        uid, gid = self.owner()
+        options = ["rw", "all_squash", f"anonuid={uid}", f"anongid={gid}"]
+        try:
+            loopback = client == "localhost" or ipaddress.ip_address(client).is_loopback
+        except ValueError:
+            loopback = False
+        if loopback:
+            options.insert(1, "insecure")
+        return ",".join(options)
+
+    def start(self):
+        if self.kind == "unfsd":
+            exports = self.state_dir / "exports"
+            exports.write_text("".join(f"{self.export} {c}({self.options(c)})\n" for c in self.clients))
+            # -d keeps unfsd in the foreground so it stops with the dev loop.
+            self.proc = subprocess.Popen(["unfsd", "-d", "-e", str(exports.resolve())], start_new_session=True)
+            time.sleep(0.5)
+            if self.proc.poll() is not None:
+                raise DevloopError(f"unfsd exited with code {self.proc.returncode}")
+        elif self.kind == "kernel":
+            for c in self.clients:
+                rc = subprocess.call(["exportfs", "-o", self.options(c) + ",no_subtree_check", f"{c}:{self.export}"])
+                if rc != 0:
+                    raise DevloopError(f"exportfs failed with code {rc}; is the NFS server running?")
+
+    def stop(self):
+        if self.kind == "unfsd" and self.proc is not None and self.proc.poll() is None:
+            os.killpg(self.proc.pid, signal.SIGTERM)
+            self.proc.wait()
+        elif self.kind == "kernel":
+            for c in self.clients:
+                subprocess.call(["exportfs", "-u", f"{c}:{self.export}"])
+
+class Guest:
+    """Runs commands in (and, for the stand-in, copies files to) the guest over ssh."""
+
+    def __init__(self, target, port=None, identity=None):
+        self.ssh = ["ssh", "-o", "BatchMode=yes", "-o", "ConnectTimeout=5"]
+        if port:
+            self.ssh += ["-p", str(port)]
+        if identity:
+            self.ssh += ["-i", identity]
+        self.ssh.append(target)
+
+    def run(self, command):
+        return subprocess.call(self.ssh + [command], stdin=subprocess.DEVNULL)
+
+    def push(self, export, copied, removed, guest_dir=PUSH_DIR):
+        """Copies the changed files into guest_dir with one tar stream."""
+        q = shlex.quote(guest_dir)
+        script = f"mkdir -p {q} && cd {q}"
+        if removed:
+            script += " && rm -f " + " ".join(shlex.quote(r) for r in removed)
+        if copied:
+            script += " && tar xf -"
+            tar = subprocess.Popen(["tar", "cf", "-", "-C", str(export), "--", *copied, GENERATION_FILE],
+                                   stdout=subprocess.PIPE)
+            rc = subprocess.call(self.ssh + [script], stdin=tar.stdout)
+            tar.stdout.close()
+            tar.wait()
+            return rc or tar.returncode
+        return subprocess.call(self.ssh + [script], stdin=subprocess.DEVNULL)
+
+class Vm:
+    """Keeps the image running in the background with run_image.py."""
+
+    def __init__(self):
+        self.proc = None
+
+    def start(self):
+        print("[devloop] starting the VM", flush=True)
+        self.proc = subprocess.Popen([sys.executable, str(RUN_SCRIPT)], start_new_session=True)
+
+    def stop(self):
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        os.killpg(self.proc.pid, signal.SIGTERM)
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+            self.proc.wait()
+
+def devloop(args):
+    conf_path = Path(args.config)
+    state_dir = DEVLOOP_DIR
+    export = Path(args.export) if args.export else state_dir / "export"
+    sources = [parse_source(s) for s in args.src]
+    for src, _ in sources:
+        if not src.is_dir():
+            raise DevloopError(f"source directory not found: {src}")
+
+    kind = NfsServer.detect(args.server)
+    if kind == "ssh" and not args.ssh:
+        raise DevloopError("no NFS server (unfsd, or exportfs as root) found; "
+                           "install unfs3 or give --ssh for the ssh stand-in")
+    export.mkdir(parents=True, exist_ok=True)
+    guest = Guest(args.ssh, args.ssh_port, args.ssh_key) if args.ssh else None
+    derived = state_dir / "config"
+    built = state_dir / "built.config"
+
+    def derive():
+        if kind == "ssh":
+            shutil.copyfile(conf_path, derived)
+            return parse_config(derived)
+        return write_derived_config(conf_path, derived, nfs_spec(export, args.host_addr))
+
+    cfg = parse_config(conf_path)
+    derived_cfg = derive()
+    if kind == "ssh":
+        print(f"[devloop] no NFS server; pushing {export} to {args.ssh}:{PUSH_DIR} over ssh", flush=True)
+    else:
+        print(f"[devloop] exporting {export} with {kind} as {nfs_spec(export, args.host_addr)} "
+              f"(mounted at {MOUNT_POINT})", flush=True)
+
+    server = NfsServer(kind, export, args.clients.split(","), state_dir)
+    syncer = Syncer(sources, export, state_dir / "sync.json")
+    builder = Builder(derived)
+    vm = Vm() if args.run else None
+    watcher = make_watcher()
+    watchset = None
+
+    def rewatch():
+        nonlocal watchset
+        watcher.clear()
+        watchset = WatchSet(conf_path, cfg)
+        for d, recursive in watchset.directories():
+            watcher.add(d, recursive)
+        for src, _ in sources:
+            watcher.add(src, True)
+
+    def built_cfg():
+        return parse_config(built) if built.exists() else None
+
+    def do_sync():
+        start = time.monotonic()
+        copied, removed = syncer.sync()
+        if not copied and not removed:
+            return
+        rc = 0
+        if kind == "ssh":
+            rc = guest.push(export, copied, removed)
+        if rc == 0 and guest and args.on_sync:
+            rc = guest.run(args.on_sync)
+        names = ", ".join((copied + removed)[:3]) + (", ..." if len(copied) + len(removed) > 3 else "")
+        status = "" if rc == 0 else f"; guest notification failed with code {rc}"
+        print(f"[devloop] synced {len(copied)} changed and {len(removed)} removed file(s) ({names}) "
+              f"in {time.monotonic() - start:.2f}s, generation {syncer.generation}{status}", flush=True)
+
+    server.start()
+    try:
+        rewatch()
+        do_sync()
+        if derived_cfg != built_cfg() or not list(disk_images("output")):
+            if vm:
+                vm.stop()
+            builder.start(SCOPE_FULL)
+        elif vm:
+            vm.start()
+        print("[devloop] watching for changes; press Ctrl-C to stop", flush=True)
+
+        pending = SCOPE_NONE
+        sync_pending = False
+        last_event = 0.0
+        while True:
+            building = builder.running()
+            changed = watcher.read(args.debounce if pending or sync_pending else 0.5)
+            if builder.reap():
+                building = True
+                while True:
+                    more = watcher.read(0)
+                    if not more:
+                        break
+                    changed += more
+                if builder.owed == SCOPE_NONE:
+                    shutil.copyfile(derived, built)
+                    if vm:
+                        vm.start()
+            for p in changed:
+                p = Path(p)
+                if any(p == src or src in p.parents for src, _ in sources):
+                    sync_pending = True
+                    last_event = time.monotonic()
+                    continue
+                if p == watchset.conf_path:
+                    if not p.exists() or parse_config(p) == cfg:
+                        continue
+                    cfg = parse_config(p)
+                    new_cfg = derive()
+                    rewatch()
+                    if new_cfg == derived_cfg:
+                        continue
+                    derived_cfg = new_cfg
+                scope = watchset.scope_of(p, building)
+                if scope == SCOPE_NONE:
+                    continue
+                pending = max(pending, scope)
+                last_event = time.monotonic()
+            if time.monotonic() - last_event < max(args.debounce, SYNC_DEBOUNCE):
+                continue
+            if sync_pending:
+                sync_pending = False
+                do_sync()
+            if pending:
+                builder.cancel()
+                if vm:
+                    vm.stop()
+                builder.start(pending)
+                pending = SCOPE_NONE
+    finally:
+        builder.cancel()
+        if vm:
+            vm.stop()
+        server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve build outputs to the running image over NFS "
+                                                 "and only rebuild it when its configuration changes.")
+    parser.add_argument("config", nargs="?", default=".config", help="path to the .config file")
+    parser.add_argument("--src", action="append", default=[], metavar="DIR[=SUBDIR]",
+                        help="directory to sync into the export (below SUBDIR); may be repeated")
+    parser.add_argument("--export", help="host directory mounted at /fs/qnx (default: devloop/export)")
+    parser.add_argument("--host-addr", default=HOST_ADDR,
+                        help=f"address of the host as seen from the guest (default {HOST_ADDR})")
+    parser.add_argument("--clients", default="127.0.0.1",
+                        help="comma separated hosts allowed to mount the export; NAT guests connect "
+                             "from 127.0.0.1 (default)")
+    parser.add_argument("--server", choices=("auto", "unfsd", "kernel", "ssh"), default="auto",
+                        help="how to serve the export (default: unfsd, else the kernel server, else ssh)")
+    parser.add_argument("--ssh", metavar="USER@HOST", help="guest to notify (and push to with --server=ssh)")
+    parser.add_argument("--ssh-port", type=int, help="ssh port of the guest, e.g. a forwarded host port")
+    parser.add_argument("--ssh-key", help="ssh private key for the guest")
+    parser.add_argument("--on-sync", metavar="CMD", help="command run in the guest after every sync")
+    parser.add_argument("--run", action="store_true", help="run the image in the background and restart "
+                                                           "it after rebuilds")
+    parser.add_argument("--debounce", type=float, default=0.3,
+                        help="seconds of quiet before a burst of changes is acted on (default 0.3)")
+    args = parser.parse_args()
+
+    if not Path(args.config).exists():
+        print("Config file not found:", args.config, file=sys.stderr)
+        sys.exit(1)
+    try:
+        devloop(args)
+    except DevloopError as e:
+        print("Error:", e, file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Helpers for inspecting the disk images mkqnximage produces.
+
+The images carry a classic MBR partition table with the boot, system and
+data partitions as primary entries.
+"""
+import struct
+from pathlib import Path
+
+SECTOR = 512
+MBR_SIGNATURE = b"\x55\xaa"
+PART_NAMES = ("boot", "system", "data")
+
+class Partition:
+    def __init__(self, index, ptype, start, size):
+        self.index = index
+        self.type = ptype
+        self.start = start
+        self.size = size
+
+    @property
+    def end(self):
+        return self.start + self.size
+
+    @property
+    def name(self):
+        return PART_NAMES[self.index] if self.index < len(PART_NAMES) else f"part{self.index + 1}"
+
+def read_mbr(path):
+    """Returns the 512 byte MBR of path, or None if it has no valid signature."""
+    with open(path, "rb") as f:
+        mbr = f.read(SECTOR)
+    if len(mbr) < SECTOR or mbr[510:512] != MBR_SIGNATURE:
+        return None
+    return mbr
+
+def read_partitions(path):
+    """Returns the used primary partitions of a raw disk image, in table order."""
+    mbr = read_mbr(path)
+    if mbr is None:
+        return []
+    parts = []
+    for i in range(4):
+        ptype, lba, count = struct.unpack_from("<4xB3xII", mbr, 446 + i * 16)
+        if ptype and count:
+            parts.append(Partition(i, ptype, lba * SECTOR, count * SECTOR))
+    return parts
+
+def disk_images(out_dir="output"):
+    """Yields the files in out_dir that look like raw partitioned disk images."""
+    out_dir = Path(out_dir)
+    if not out_dir.is_dir():
+        return
+    for p in sorted(out_dir.iterdir()):
+        if p.is_file() and p.stat().st_size > SECTOR and read_mbr(p) is not None:
+            yield p
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Filesystem microbenchmarks run inside the guest, compared across configs.
+
+"fs_bench.py run" builds every given config with a benchmark payload added
+through MKQNX_EXTRA_DIRS (as snippets/post_start.custom), boots it and
+collects the results the payload prints on the console. The payload times
+open, stat, exec, read and write loops on the IFS (/proc/boot), the system
+and data partitions and paths resolved through / (where the union
+filesystem matters), using the shell's time keyword, and prints one line
+per measurement:
+
+  FSBENCH begin version=1 config=defconfig options="union qcfs=no ..."
+  FSBENCH test=open target=system path=/system/lib/libc.so.6 n=2000 run=1 time="0.52s real ..."
+  FSBENCH test=exec target=data error=not-executable
+  FSBENCH end
+
+The console logs are kept (fsbench/<config>.log by default), and
+"fs_bench.py report" turns recorded logs into the comparison table without
+building or booting anything, so the parsing and aggregation can be
+checked offline.
+
+Latencies are per operation, with the cost of the empty shell loop
+subtracted, and throughputs are in MiB/s; each is the median over the
+repeated runs.
+"""
+import argparse
+import re
+import shlex
+import shutil
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from config_parser import bool_of, parse_config, str_of
+from run_image import run_vm
+from verify_repro import run_build
+
+PAYLOAD_VERSION = 1
+OUT_DIR = Path("fsbench")
+LATENCY_TESTS = ("open", "stat", "exec")
+THROUGHPUT_TESTS = ("read", "write")
+TARGETS = ("ifs", "system", "data", "root")
+
+LINE_RE = re.compile(r"^.*?FSBENCH (.*?)\r?$", re.MULTILINE)
+# pdksh/ksh: "0.52s real 0.01s user 0.20s system"; bash: "real 0m0.520s ...".
+KSH_TIME_RE = re.compile(r"([\d.]+)s real")
+BASH_TIME_RE = re.compile(r"real\s+(?:(\d+)m)?([\d.]+)s")
+
+PAYLOAD = r"""# Filesystem benchmark payload, generated by scripts/fs_bench.py.
+(
+FSB_N=@N@
+FSB_REPEAT=@REPEAT@
+FSB_MB=@MB@
+FSB_READS=@READS@
+FSB_DIR=/data/fsbench
+
+fsb_first() {
+    for f in "$@"; do
+        [ -f "$f" ] && { echo "$f"; return 0; }
+    done
+    return 1
+}
+fsb_size() {
+    set -- $(ls -lL "$1")
+    echo $5
+}
+fsb_nop() {
+    i=0
+    while [ $i -lt $FSB_N ]; do i=$((i + 1)); done
+}
+fsb_open() {
+    i=0
+    while [ $i -lt $FSB_N ]; do : < "$1"; i=$((i + 1)); done
+}
+fsb_stat() {
+    i=0
+    while [ $i -lt $FSB_N ]; do [ -e "$1" ]; i=$((i + 1)); done
+}
+fsb_exec() {
+    i=0
+    while [ $i -lt $FSB_N ]; do "$1" > /dev/null 2>&1; i=$((i + 1)); done
+}
+fsb_read() {
+    i=0
+    while [ $i -lt $FSB_READS ]; do dd if="$1" of=/dev/null bs=65536 2> /dev/null; i=$((i + 1)); done
+}
+fsb_write() {
+    dd if=/dev/zero of="$1" bs=65536 count=$((FSB_MB * 16)) 2> /dev/null
+    sync
+}
+fsb_time() {
+    t=$( { time "$@" > /dev/null 2>&1; } 2>&1 )
+    echo $t
+}
+fsb_report() {
+    # test target path n bytes run
+    echo "FSBENCH test=$1 target=$2 path=$3 n=$4 bytes=$5 run=$6 time=\"$(fsb_time fsb_$1 "$3")\""
+}
+
+sleep @SETTLE@
+mkdir -p $FSB_DIR
+echo "FSBENCH begin version=@VERSION@ config=@CONFIG@ options=\"@OPTIONS@\" n=$FSB_N repeat=$FSB_REPEAT"
+fsb_write $FSB_DIR/blob
+for bin in uname echo ls; do
+    src=$(fsb_first /system/bin/$bin /proc/boot/$bin) && break
+done
+[ -n "$src" ] && cp "$src" $FSB_DIR/exec && chmod 755 $FSB_DIR/exec
+
+ifs_file=$(fsb_first /proc/boot/libc.so.*)
+system_file=$(fsb_first /system/lib/libc.so.*)
+root_file=$(fsb_first /lib/libc.so.* /usr/lib/libc.so.*)
+ifs_bin=$(fsb_first /proc/boot/uname /proc/boot/echo /proc/boot/ls)
+system_bin=$(fsb_first /system/bin/uname /system/bin/echo /system/bin/ls)
+root_bin=$(fsb_first /bin/uname /bin/echo /bin/ls /usr/bin/uname)
+
+run=1
+while [ $run -le $FSB_REPEAT ]; do
+    fsb_report nop none - $FSB_N 0 $run
+    for target in ifs system data root; do
+        eval file=\$${target}_file
+        eval bin=\$${target}_bin
+        [ $target = data ] && { file=$FSB_DIR/blob; bin=$FSB_DIR/exec; }
+        if [ -n "$file" ]; then
+            fsb_report open $target "$file" $FSB_N 0 $run
+            fsb_report stat $target "$file" $FSB_N 0 $run
+            fsb_report read $target "$file" $FSB_READS $(( $(fsb_size "$file") * FSB_READS )) $run
+        elif [ $run -eq 1 ]; then
+            echo "FSBENCH test=open target=$target error=no-file"
+        fi
+        if [ -z "$bin" ]; then
+            [ $run -eq 1 ] && echo "FSBENCH test=exec target=$target error=no-binary"
+        elif "$bin" > /dev/null 2>&1; then
+            fsb_report exec $target "$bin" $FSB_N 0 $run
+        elif [ $run -eq 1 ]; then
+            echo "FSBENCH test=exec target=$target path=$bin error=not-executable"
+        fi
+    done
+    fsb_report write data $FSB_DIR/blob 1 $((FSB_MB * 1048576)) $run
+    run=$((run + 1))
+done
+rm -rf $FSB_DIR
+echo "FSBENCH end"
+) &
+"""
+
+def fs_options(cfg):
+    """Summarizes the options that affect filesystem performance."""
+    qcfs = "no"
+    for name in ("YES", "LZ4HC", "ZSTD"):
+        if bool_of(cfg, "MKQNX_QCFS_" + name):
+            qcfs = "lz4hc" if name == "YES" else name.lower()
+    ro = "qtd" if bool_of(cfg, "MKQNX_QTD") else "qtsafefs" if bool_of(cfg, "MKQNX_QTSAFEFS") else "none"
+    data = "nosuid" if bool_of(cfg, "MKQNX_SECURE_DATA_NOSUID") else \
+        "noexec" if bool_of(cfg, "MKQNX_SECURE_DATA_NOEXEC") else "no"
+    return (f"{'union' if bool_of(cfg, 'MKQNX_UNION') else 'no-union'} qcfs={qcfs} ro={ro} "
+            f"secure-data={data}{' pathtrust' if bool_of(cfg, 'MKQNX_PATHTRUST') else ''}")
+
+def write_payload(dest, config="config", options="", n=2000, repeat=3, mb=16, reads=20, settle=5):
+    """Writes the payload as an extra content directory at dest."""
+    text = PAYLOAD
+    for key, val in (("N", n), ("REPEAT", repeat), ("MB", mb), ("READS", reads), ("SETTLE", settle),
+                     ("VERSION", PAYLOAD_VERSION), ("CONFIG", config), ("OPTIONS", options)):
+        text = text.replace(f"@{key}@", str(val))
+    snippets = Path(dest) / "snippets"
+    snippets.mkdir(parents=True, exist_ok=True)
+    (snippets / "post_start.custom").write_text(text, encoding="utf-8")
+
+def parse_time(text):
+    """Returns the real time in seconds from the output of the time keyword, or None."""
+    m = KSH_TIME_RE.search(text)
+    if m:
+        return float(m.group(1))
+    m = BASH_TIME_RE.search(text)
+    if m:
+        return int(m.group(1) or 0) * 60 + float(m.group(2))
+    return None
+
+def parse_console(text):
+    """Parses the FSBENCH lines of a console log.
+
+    Returns a dict with the begin line's fields under "info", the timed
+    samples, the reported errors and whether the end line was seen.
+    """
+    out = {"info": {}, "samples": [], "errors": [], "complete": False}
+    for m in LINE_RE.finditer(text):
+        body = m.group(1)
+        if body.startswith("begin"):
+            # A reboot restarts the payload; only the last run counts.
+            out = {"info": {}, "samples": [], "errors": [], "complete": False}
+            body = body[len("begin"):]
+        elif body.strip() == "end":
+            out["complete"] = True
+            continue
+        try:
+            fields = dict(f.split("=", 1) for f in shlex.split(body) if "=" in f)
+        except ValueError:
+            continue
+        if "test" not in fields:
+            out["info"].update(fields)
+        elif "error" in fields:
+            out["errors"].append(fields)
+        else:
+            seconds = parse_time(fields.get("time", ""))
+            try:
+                n, nbytes = int(fields["n"]), int(fields.get("bytes", 0))
+            except (KeyError, ValueError):
+                continue
+            if seconds is not None:
+                out["samples"].append({"test": fields["test"], "target": fields.get("target", ""),
+                                       "path": fields.get("path", ""), "n": n, "bytes": nbytes,
+                                       "seconds": seconds})
+    return out
+
+def summarize(parsed):
+    """Returns {(test, target): value}: microseconds per op or MiB/s, medians over runs."""
+    loop = [s["seconds"] / s["n"] for s in parsed["samples"] if s["test"] == "nop" and s["n"]]
+    per_iter = statistics.median(loop) if loop else 0.0
+    values = {}
+    for s in parsed["samples"]:
+        if s["test"] in LATENCY_TESTS and s["n"]:
+            values.setdefault((s["test"], s["target"]), []).append(
+                max(0.0, s["seconds"] / s["n"] - per_iter) * 1e6)
+        elif s["test"] in THROUGHPUT_TESTS and s["seconds"] > 0:
+            values.setdefault((s["test"], s["target"]), []).append(s["bytes"] / s["seconds"] / 2**20)
+    out = {k: statistics.median(v) for k, v in values.items()}
+    for e in parsed["errors"]:
+        out.setdefault((e["test"], e.get("target", "")), e["error"])
+    return out
+
+def unit(test):
+    return "us/op" if test in LATENCY_TESTS else "MiB/s"
+
+def table(results):
+    """Formats [(label, summary)] as a comparison table.
+
+    The first config is the baseline; the others show their change
+    relative to it, positive meaning faster.
+    """
+    keys = []
+    for test in LATENCY_TESTS + THROUGHPUT_TESTS:
+        for target in TARGETS:
+            if any((test, target) in s for _, s in results):
+                keys.append((test, target))
+    header = ["test"] + [label for label, _ in results]
+    rows = []
+    base = results[0][1] if results else {}
+    for test, target in keys:
+        row = [f"{test} {target} ({unit(test)})"]
+        for i, (_, s) in enumerate(results):
+            v = s.get((test, target))
+            if v is None:
+                row.append("-")
+            elif isinstance(v, str):
+                row.append(v)
+            else:
+                cell = f"{v:.1f}"
+                b = base.get((test, target))
+                if i and isinstance(b, float) and b > 0 and v > 0:
+                    gain = (b / v - 1) if test in LATENCY_TESTS else (v / b - 1)
+                    cell += f" ({gain * 100:+.0f}%)"
+                row.append(cell)
+        rows.append(row)
+    widths = [max(len(r[i]) for r in [header] + rows) for i in range(len(header))]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(header, widths)).rstrip()]
+    lines.append("  ".join("-" * w for w in widths))
+    lines += ["  ".join(c.ljust(w) for c, w in zip(r, widths)).rstrip() for r in rows]
+    return "\n".join(lines)
+
+def report(logs, out=sys.stdout):
+    """Parses recorded console logs and prints the comparison; returns the number of unusable logs."""
+    results = []
+    bad = 0
+    for log in logs:
+        parsed = parse_console(Path(log).read_text(encoding="utf-8", errors="replace"))
+        label = parsed["info"].get("config") or Path(log).stem
+        if not parsed["samples"]:
+            print(f"Warning: no benchmark results in {log}", file=sys.stderr)
+            bad += 1
+            continue
+        if not parsed["complete"]:
+            print(f"Warning: {log} ends before the benchmark finished", file=sys.stderr)
+        print(f"{label}: {parsed['info'].get('options', '?')}", file=out)
+        results.append((label, summarize(parsed)))
+    if results:
+        print(file=out)
+        print(table(results), file=out)
+    return bad
+
+def with_payload(cfg, payload_dir):
+    """Returns a copy of cfg with payload_dir added to MKQNX_EXTRA_DIRS."""
+    out = dict(cfg)
+    extra = str_of(cfg, "MKQNX_EXTRA_DIRS", "")
+    out["MKQNX_EXTRA_DIRS"] = f"{extra}:{payload_dir}" if extra not in ("", "none") else str(payload_dir)
+    return out
+
+def config_names(paths):
+    """Returns a distinct name for each config, used for its directory, log and label.
+
+    Configs with the same file name are told apart by their parent
+    directories, e.g. a-defconfig and b-defconfig, or else by a number.
+    """
+    paths = [Path(p).resolve() for p in paths]
+
+    def name(path, depth):
+        parts = [path.name.lstrip(".") or "config"]
+        parts[:0] = [d.name for d in reversed(path.parents[:depth]) if d.name]
+        return "-".join(parts)
+
+    depths = [0] * len(paths)
+    while True:
+        names = [name(p, d) for p, d in zip(paths, depths)]
+        grown = False
+        for i, n in enumerate(names):
+            clash = any(m == n and paths[j] != paths[i] for j, m in enumerate(names))
+            if clash and depths[i] < len(paths[i].parents) - 1:
+                depths[i] += 1
+                grown = True
+        if not grown:
+            break
+    # The same file given more than once.
+    seen = {}
+    out = []
+    for n in names:
+        seen[n] = seen.get(n, 0) + 1
+        out.append(n if seen[n] == 1 else f"{n}-{seen[n]}")
+    return out
+
+def cmd_run(args):
+    tool = shutil.which(args.tool)
+    if not tool:
+        print(f"Error: '{args.tool}' not found on PATH.", file=sys.stderr)
+        return 1
+    out_dir = Path(args.out).resolve()
+    jobs = []
+    for conf, name in zip(args.configs, config_names(args.configs)):
+        conf_path = Path(conf)
+        if not conf_path.exists():
+            print("Config file not found:", conf_path, file=sys.stderr)
+            return 1
+        cfg = parse_config(conf_path)
+        work = out_dir / name
+        if work.exists():
+            shutil.rmtree(work)
+        work.mkdir(parents=True)
+        write_payload(work / "payload", name, fs_options(cfg), args.n, args.repeat, args.mb, args.reads,
+                      args.settle)
+        jobs.append((name, with_payload(cfg, work / "payload"), work))
+
+    print(f"Building {len(jobs)} config(s) in {out_dir}...")
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        rcs = list(pool.map(lambda j: run_build(j[1], tool, ".", j[2], False), jobs))
+    for (name, _, work), rc in zip(jobs, rcs):
+        if rc != 0:
+            print(f"Error: building {name} failed with code {rc}; see {work / 'build.log'}.", file=sys.stderr)
+            return 1
+
+    logs = []
+    # One VM at a time so the runs don't disturb each other.
+    for name, _, work in jobs:
+        log = out_dir / f"{name}.log"
+        log.unlink(missing_ok=True)
+        start = time.monotonic()
+        result = run_vm([tool, "--run"], until=r"FSBENCH end", timeout=args.timeout, log=log,
+                        echo=args.verbose, cwd=work)
+        boot = f", login after {result.boot_to_login:.1f}s" if result.boot_to_login is not None else ""
+        status = "done" if result.matched else "timed out" if result.timed_out else "VM stopped"
+        print(f"  {name}: {status} in {time.monotonic() - start:.1f}s{boot}")
+        logs.append(log)
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+    print()
+    return 1 if report(logs) else 0
+
+def cmd_report(args):
+    return 1 if report(args.logs) else 0
+
+def cmd_payload(args):
+    cfg = parse_config(Path(args.config)) if args.config else {}
+    write_payload(args.dir, Path(args.config).name.lstrip(".") if args.config else "config",
+                  fs_options(cfg), args.n, args.repeat, args.mb, args.reads, args.settle)
+    print(f"Wrote {Path(args.dir) / 'snippets' / 'post_start.custom'}; add {args.dir} to MKQNX_EXTRA_DIRS.")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark filesystem operations in the guest across configs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def payload_options(p):
+        p.add_argument("-n", type=int, default=2000, help="operations per latency measurement (default 2000)")
+        p.add_argument("--repeat", type=int, default=3, help="runs of every measurement (default 3)")
+        p.add_argument("--mb", type=int, default=16, help="MiB written by the write test (default 16)")
+        p.add_argument("--reads", type=int, default=20, help="reads of the file in the read test (default 20)")
+        p.add_argument("--settle", type=int, default=5, help="seconds to wait after startup (default 5)")
+
+    p = sub.add_parser("run", help="build and boot each config and compare the results")
+    p.add_argument("configs", nargs="+", help=".config files to compare; the first is the baseline")
+    p.add_argument("--tool", default="mkqnximage", help="mkqnximage or a compatible tool (default: mkqnximage)")
+    p.add_argument("--out", default=str(OUT_DIR), help="directory for the builds and console logs "
+                                                       "(default: fsbench)")
+    p.add_argument("--timeout", type=float, default=600, help="seconds to wait for each VM (default 600)")
+    p.add_argument("-j", "--jobs", type=int, default=2, help="configs built at the same time (default 2)")
+    p.add_argument("--keep", action="store_true", help="keep the build directories")
+    p.add_argument("-v", "--verbose", action="store_true", help="echo the VM consoles")
+    payload_options(p)
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("report", help="compare recorded console logs")
+    p.add_argument("logs", nargs="+", help="console logs; the first is the baseline")
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser("payload", help="write the payload as an extra content directory")
+    p.add_argument("dir", help="directory to create")
+    p.add_argument("-c", "--config", help="config whose options to record in the results")
+    payload_options(p)
+    p.set_defaults(func=cmd_payload)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+if __name__ == "__main__":
+    main()
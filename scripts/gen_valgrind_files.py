@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Generates local/valgrind.files for images built with MKQNX_VALGRIND.
+
+Scans the repository directories (MKQNX_REPOS, or $QNX_STAGE_nto and
+$QNX_TARGET) for ELF executables and shared libraries, resolves the
+shared library dependencies of the requested target executables and writes
+the minimal list of binaries whose symbols valgrind needs to make sense of
+them. Binaries without any symbol information (no .symtab, no .debug_info
+and no .gnu_debuglink) are left out since storing them would not help.
+
+The scan result is cached in local/.valgrind-scan.json and only files whose
+size or mtime changed are read again on the next run.
+
+Usage: gen_valgrind_files.py [-c .config] [-o local/valgrind.files] exe...
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from config_parser import bool_of, parse_config, str_of
+
+DEFAULT_REPOS = "$QNX_STAGE_nto:$QNX_TARGET"
+CACHE_PATH = Path("local/.valgrind-scan.json")
+CACHE_VERSION = 1
+
+ET_EXEC = 2
+ET_DYN = 3
+SHT_DYNAMIC = 6
+DT_NULL = 0
+DT_NEEDED = 1
+DT_SONAME = 14
+
+def read_elf(path):
+    """Returns the ELF facts we need about path, or None if it isn't one."""
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < 64:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if m[:4] != b"\x7fELF":
+                    return None
+                return _parse_elf(m)
+    except (OSError, ValueError, struct.error):
+        return None
+
+def _parse_elf(m):
+    is64 = m[4] == 2
+    end = "<" if m[5] == 1 else ">"
+    if is64:
+        e_type, = struct.unpack_from(end + "H", m, 16)
+        e_shoff, = struct.unpack_from(end + "Q", m, 40)
+        e_shentsize, e_shnum, e_shstrndx = struct.unpack_from(end + "HHH", m, 58)
+        sh_fmt, dyn_fmt = end + "IIQQQQIIQQ", end + "qQ"
+    else:
+        e_type, = struct.unpack_from(end + "H", m, 16)
+        e_shoff, = struct.unpack_from(end + "I", m, 32)
+        e_shentsize, e_shnum, e_shstrndx = struct.unpack_from(end + "HHH", m, 46)
+        sh_fmt, dyn_fmt = end + "IIIIIIIIII", end + "iI"
+    if e_type not in (ET_EXEC, ET_DYN) or not e_shoff or e_shstrndx >= e_shnum:
+        return None
+
+    sections = []
+    for i in range(e_shnum):
+        name, typ, _, _, off, size, link, _, _, _ = struct.unpack_from(sh_fmt, m, e_shoff + i * e_shentsize)
+        sections.append((name, typ, off, size, link))
+
+    def cstr(table, idx):
+        # A malformed sh_link or offset yields an empty name rather than an error.
+        if table >= len(sections):
+            return ""
+        start = sections[table][2] + idx
+        if start >= len(m):
+            return ""
+        stop = m.find(b"\0", start)
+        return m[start:stop if stop != -1 else len(m)].decode("utf-8", "replace")
+
+    names = {cstr(e_shstrndx, s[0]) for s in sections}
+    needed = []
+    soname = None
+    dyn_size = struct.calcsize(dyn_fmt)
+    for _, typ, off, size, link in sections:
+        if typ != SHT_DYNAMIC:
+            continue
+        for pos in range(off, off + size, dyn_size):
+            tag, val = struct.unpack_from(dyn_fmt, m, pos)
+            if tag == DT_NULL:
+                break
+            if tag == DT_NEEDED:
+                name = cstr(link, val)
+                if name:
+                    needed.append(name)
+            elif tag == DT_SONAME:
+                soname = cstr(link, val) or None
+    return {
+        "needed": needed,
+        "soname": soname,
+        "debuglink": ".gnu_debuglink" in names,
+        "debuginfo": ".debug_info" in names,
+        "symtab": ".symtab" in names,
+    }
+
+def scan_roots(cfg):
+    """Returns the directories mkqnximage would search for this config."""
+    arch = "aarch64le" if bool_of(cfg, "MKQNX_ARCH_AARCH64LE") else "x86_64"
+    roots = []
+    for item in os.path.expandvars(str_of(cfg, "MKQNX_REPOS", "") or DEFAULT_REPOS).split(":"):
+        item = item.strip()
+        if not item or not Path(item).is_dir():
+            continue
+        p = Path(item)
+        roots.append(p / arch if (p / arch).is_dir() else p)
+    return roots
+
+def load_cache():
+    try:
+        data = json.loads(CACHE_PATH.read_text(encoding="utf-8"))
+        if data.get("version") == CACHE_VERSION:
+            return data["files"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+def save_cache(files):
+    CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = CACHE_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"version": CACHE_VERSION, "files": files}), encoding="utf-8")
+    os.replace(tmp, CACHE_PATH)
+
+def scan(roots, jobs):
+    """Returns {path: entry} for every ELF file below roots."""
+    cache = load_cache()
+    stats = {}
+    for root in roots:
+        for dirpath, _, filenames in os.walk(root):
+            for fn in filenames:
+                p = os.path.join(dirpath, fn)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                if st.st_size >= 64 and os.path.isfile(p):
+                    stats[p] = (st.st_size, st.st_mtime_ns, root)
+
+    files = {}
+    todo = []
+    for p, (size, mtime, root) in stats.items():
+        old = cache.get(p)
+        if old and old["size"] == size and old["mtime"] == mtime:
+            files[p] = old
+        else:
+            todo.append(p)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for p, info in zip(todo, pool.map(read_elf, todo)):
+            size, mtime, _ = stats[p]
+            files[p] = {"size": size, "mtime": mtime, "elf": info}
+    save_cache(files)
+    print(f"Scanned {len(stats)} files ({len(todo)} read, {len(stats) - len(todo)} cached).", file=sys.stderr)
+
+    out = {}
+    for p, entry in files.items():
+        if entry["elf"] is not None:
+            root = stats[p][2]
+            out[p] = dict(entry["elf"], target="/" + os.path.relpath(p, root))
+    return out
+
+def closure(elfs, targets):
+    """Returns the paths of targets and every library they load, transitively.
+
+    Symlinks (e.g. the libc.so development link) are resolved to the file
+    they point to, so every library is listed under its real name.
+    """
+    def real(p):
+        r = os.path.realpath(p)
+        return r if r in elfs else p
+
+    # Exact file names win over sonames, so a development symlink whose
+    # target carries the soname can't stand in for the real file.
+    by_name = {}
+    for p in sorted(elfs):
+        by_name.setdefault(os.path.basename(p), real(p))
+    for p, info in sorted(elfs.items()):
+        if info["soname"]:
+            by_name.setdefault(info["soname"], real(p))
+
+    result = []
+    seen = set()
+    missing = []
+    queue = []
+    for t in targets:
+        p = real(t) if t in elfs else by_name.get(os.path.basename(t))
+        if p is None:
+            missing.append(t)
+        else:
+            queue.append(p)
+    while queue:
+        p = queue.pop(0)
+        if p in seen:
+            continue
+        seen.add(p)
+        result.append(p)
+        for lib in elfs[p]["needed"]:
+            dep = by_name.get(lib)
+            if dep is None:
+                missing.append(lib)
+            else:
+                queue.append(dep)
+    return result, sorted(set(missing))
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate local/valgrind.files for the given executables.")
+    parser.add_argument("targets", nargs="+", help="executables to debug, by name or path")
+    parser.add_argument("-c", "--config", default=".config", help="config file (default .config)")
+    parser.add_argument("-o", "--output", default="local/valgrind.files", help="file to write")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="scanner threads")
+    args = parser.parse_args()
+
+    conf_path = Path(args.config)
+    if not conf_path.exists():
+        print("Config file not found:", conf_path, file=sys.stderr)
+        sys.exit(1)
+    cfg = parse_config(conf_path)
+    if not bool_of(cfg, "MKQNX_VALGRIND"):
+        print("Warning: MKQNX_VALGRIND is not enabled in", conf_path, file=sys.stderr)
+
+    roots = scan_roots(cfg)
+    if not roots:
+        print("Error: no repository directories found; set MKQNX_REPOS or QNX_TARGET.", file=sys.stderr)
+        sys.exit(1)
+    elfs = scan(roots, args.jobs)
+    paths, missing = closure(elfs, args.targets)
+    for name in missing:
+        print("Warning: not found in repositories:", name, file=sys.stderr)
+
+    keep = [p for p in paths if elfs[p]["symtab"] or elfs[p]["debuginfo"] or elfs[p]["debuglink"]]
+    for p in paths:
+        if p not in keep:
+            print("Skipping (no symbols):", elfs[p]["target"], file=sys.stderr)
+
+    out = Path(args.output)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text("".join(elfs[p]["target"] + "\n" for p in keep), encoding="utf-8")
+    split = sum(1 for p in keep if elfs[p]["debuglink"])
+    print(f"Wrote {len(keep)} entries to {out} ({split} with separate debug info).")
+
+if __name__ == "__main__":
+    main()
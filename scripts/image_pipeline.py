@@ -0,0 +1,131 @@
+"""
+Split-phase image build: boot, system and data partitions in parallel.
+
+With fixed MKQNX_PART_SIZES the partitions of the disk image don't depend on
+each other's size, so they can be produced independently and assembled at
+the end. The build is decomposed into these steps, each run in its own
+directory below output/.pipeline/:
+
+  shared    generates the inputs every partition needs once (users,
+            passwords, ssh keys: the persistent local/ state)
+  boot      builds the IFS / boot partition image       (needs shared)
+  system    builds the /system partition image          (needs shared)
+  data      builds the /data partition image            (needs shared)
+  assemble  builds the final disk from the three images (needs all three)
+
+Each step runs the step tool with the regular mkqnximage options plus
+--step=<name>; assemble also gets --parts=<dir>:<dir>:<dir> listing the
+output/ directories of the partition steps. shared starts with a copy of
+the current local/ state and the partition steps with a copy of the one
+shared produced. The step tool must implement this protocol and list --step
+in its --help output (scripts/stub_mkqnximage.py does, with simulated
+latencies); the stock mkqnximage doesn't.
+
+Several architectures can be built by one pipeline. The arch-independent
+steps, shared and (when the /data options match) data, then run once in
+output/.pipeline/ and only boot, system and assemble run per architecture,
+in output/.pipeline/<arch>/. Without a step tool, multi-arch builds run a
+complete mkqnximage per architecture concurrently instead.
+"""
+import shutil
+import subprocess
+from pathlib import Path
+from pipeline import Step
+from preflight import PROBE_TIMEOUT, parse_options
+from staging import STATE_MAX
+
+PARTS = ("boot", "system", "data")
+WORK_DIR = Path("output/.pipeline")
+# Options that only affect the architecture-specific steps.
+ARCH_OPTIONS = ("--arch", "--cpu", "--proc", "--ram")
+
+def supports_steps(tool):
+    """True if tool implements the step protocol, going by its --help output."""
+    try:
+        res = subprocess.run([tool, "--help"], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return "step" in parse_options(res.stdout.decode("utf-8", "replace"))
+
+def seed_local(src):
+    """Returns a prepare hook copying src/local, without hidden files, into the step's directory."""
+    def prepare(step):
+        if (src / "local").is_dir():
+            shutil.copytree(src / "local", step.cwd / "local", symlinks=True, dirs_exist_ok=True,
+                            ignore=shutil.ignore_patterns(".*"))
+    return prepare
+
+def image_steps(tool, opts, work_dir=WORK_DIR, prefix="", shared_dir=None, data_dir=None):
+    """Returns the steps building an image with the step tool.
+
+    opts are the mkqnximage options, with paths already made absolute.
+    prefix namespaces the step names and shared_dir points the partition
+    steps at an existing shared step, so several images can be built by one
+    pipeline; data_dir likewise reuses an existing data step.
+    """
+    work_dir = Path(work_dir).resolve()
+    shared = shared_dir or work_dir / "shared"
+    steps = []
+    if shared_dir is None:
+        steps.append(Step(prefix + "shared", [], [tool, "--step=shared"] + opts, shared,
+                          prepare=seed_local(Path.cwd())))
+    for part in PARTS:
+        if part == "data" and data_dir is not None:
+            continue
+        steps.append(Step(prefix + part, ["shared" if shared_dir else prefix + "shared"],
+                          [tool, f"--step={part}"] + opts, work_dir / part, prepare=seed_local(shared)))
+    part_dirs = [data_dir if p == "data" and data_dir is not None else work_dir / p for p in PARTS]
+    parts = ":".join(str(d / "output") for d in part_dirs)
+    deps = ["data" if p == "data" and data_dir is not None else prefix + p for p in PARTS]
+    steps.append(Step(prefix + "assemble", deps,
+                      [tool, "--step=assemble", f"--parts={parts}"] + opts, work_dir / "assemble"))
+    return steps
+
+def arch_independent(opts):
+    return [o for o in opts if o.split("=", 1)[0] not in ARCH_OPTIONS]
+
+def multiarch_steps(tool, opts_by_arch, work_dir=WORK_DIR):
+    """Returns (steps, shared step names) building one image per architecture."""
+    work_dir = Path(work_dir).resolve()
+    archs = list(opts_by_arch)
+    first = opts_by_arch[archs[0]]
+    shared = work_dir / "shared"
+    steps = [Step("shared", [], [tool, "--step=shared"] + first, shared, prepare=seed_local(Path.cwd()))]
+    data_dir = None
+    if all(arch_independent(o) == arch_independent(first) for o in opts_by_arch.values()):
+        data_dir = work_dir / "data"
+        steps.append(Step("data", ["shared"], [tool, "--step=data"] + first, data_dir, prepare=seed_local(shared)))
+    for arch in archs:
+        steps += image_steps(tool, opts_by_arch[arch], work_dir / arch, f"{arch}/", shared, data_dir)
+    return steps, [s.name for s in steps[:2 if data_dir else 1]]
+
+def arch_builds(cmds_by_arch, work_dir=WORK_DIR):
+    """Returns steps running a complete build per architecture, concurrently."""
+    work_dir = Path(work_dir).resolve()
+    return [Step(f"{arch}/mkqnximage", [], cmd, work_dir / arch / "assemble", prepare=seed_local(Path.cwd()))
+            for arch, cmd in cmds_by_arch.items()]
+
+def collect(work_dir=WORK_DIR, out_dir="output", shared_dir=None, root="."):
+    """Copies the assembled images into out_dir and keeps the shared local/ state.
+
+    The local/ state comes from shared_dir, by default the shared step of
+    work_dir.
+    """
+    root = Path(root).resolve()
+    work_dir = Path(work_dir).resolve()
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    for p in (work_dir / "assemble" / "output").iterdir():
+        if p.is_file():
+            shutil.copy2(p, out / p.name)
+    state = (shared_dir or work_dir / "shared") / "local"
+    if state.is_dir():
+        for p in state.rglob("*"):
+            # Hidden files (journal, counters) belong to the project, not the step.
+            if any(part.startswith(".") for part in p.relative_to(state).parts):
+                continue
+            if p.is_file() and p.stat().st_size <= STATE_MAX:
+                dst = root / "local" / p.relative_to(state)
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(p, dst)
@@ -0,0 +1,175 @@
+"""
+Minimal reader for the Kconfig tree of this project.
+
+Only the subset of the Kconfig language used here is understood: source,
+menu/endmenu, choice/endchoice, config with bool/int/string types, prompt,
+default, depends on, range and help. It is meant for checking .config files
+from Python, not as a replacement for scripts/kconfig.
+"""
+import re
+from pathlib import Path
+
+class Symbol:
+    def __init__(self, name, filename, lineno):
+        self.name = name
+        self.type = None
+        self.default = None
+        self.depends = []
+        self.range = None
+        self.choice = None
+        self.filename = filename
+        self.lineno = lineno
+
+    def default_value(self):
+        """Returns the value this symbol takes when nothing else is set."""
+        if self.choice is not None:
+            return "y" if self.choice.default_member() is self else "n"
+        if self.default is not None:
+            return self.default
+        return {"bool": "n", "int": "0", "string": ""}.get(self.type, "")
+
+class Choice:
+    def __init__(self, filename, lineno):
+        self.members = []
+        self.default = None
+        self.depends = []
+        self.filename = filename
+        self.lineno = lineno
+
+    def default_member(self):
+        for m in self.members:
+            if m.name == self.default:
+                return m
+        return self.members[0] if self.members else None
+
+def _indent(line):
+    return len(line.expandtabs(8)) - len(line.expandtabs(8).lstrip())
+
+def _unquote(val):
+    val = val.strip()
+    if len(val) >= 2 and val[0] == val[-1] and val[0] in "\"'":
+        return val[1:-1]
+    return val
+
+def load_kconfig(path):
+    """Parses the Kconfig tree rooted at path into an ordered {name: Symbol} map."""
+    path = Path(path)
+    symbols = {}
+    _parse_file(path, path.parent, symbols, [])
+    return symbols
+
+def _parse_file(path, topdir, symbols, stack):
+    lines = path.read_text(encoding="utf-8").splitlines()
+    cur = None
+    choice = stack[-1] if stack and isinstance(stack[-1], Choice) else None
+    i = 0
+    while i < len(lines):
+        raw = lines[i]
+        i += 1
+        ln = raw.strip()
+        if not ln or ln.startswith("#"):
+            continue
+        word, _, rest = ln.partition(" ")
+        rest = rest.strip()
+        if word in ("help", "---help---"):
+            # Help text runs until the indentation drops below its first line.
+            body = None
+            while i < len(lines):
+                if lines[i].strip():
+                    if body is None:
+                        body = _indent(lines[i])
+                        if body <= _indent(raw):
+                            break
+                    elif _indent(lines[i]) < body:
+                        break
+                i += 1
+        elif word == "source":
+            _parse_file(topdir / _unquote(rest), topdir, symbols, stack)
+        elif word == "choice":
+            choice = Choice(str(path), i)
+            stack.append(choice)
+            cur = choice
+        elif word == "endchoice":
+            stack.pop()
+            choice = None
+            cur = None
+        elif word in ("menu", "if"):
+            stack.append(word)
+            cur = None
+        elif word in ("endmenu", "endif"):
+            stack.pop()
+            cur = None
+        elif word in ("config", "menuconfig"):
+            cur = symbols.setdefault(rest, Symbol(rest, str(path), i))
+            if choice is not None:
+                cur.choice = choice
+                choice.members.append(cur)
+        elif cur is None:
+            continue
+        elif word in ("bool", "tristate", "int", "hex", "string"):
+            if isinstance(cur, Symbol):
+                cur.type = word
+        elif word.startswith("def_"):
+            cur.type = word[4:]
+            cur.default = _unquote(rest)
+        elif word == "default":
+            cur.default = rest if isinstance(cur, Choice) else _unquote(re.sub(r"\s+if\s+.*$", "", rest))
+        elif word == "depends":
+            cur.depends.append(rest[3:].strip() if rest.startswith("on ") else rest)
+        elif word == "range" and isinstance(cur, Symbol):
+            lo, hi = rest.split()[:2]
+            cur.range = (lo, hi)
+
+_TOKEN_RE = re.compile(r"\s*(&&|\|\||!=|[!()=]|[A-Za-z0-9_]+|\"[^\"]*\")")
+
+def eval_expr(expr, values):
+    """Evaluates a Kconfig dependency expression; values maps names to 'y'/'n'/str."""
+    tokens = _TOKEN_RE.findall(expr)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos - 1]
+
+    def atom():
+        tok = take()
+        if tok == "!":
+            return not atom()
+        if tok == "(":
+            val = or_expr()
+            take()
+            return val
+        lhs = values.get(tok, _unquote(tok) if tok.startswith('"') else "n")
+        if peek() in ("=", "!="):
+            op = take()
+            rhs = take()
+            rhs = values.get(rhs, _unquote(rhs))
+            return (lhs == rhs) == (op == "=")
+        return lhs not in ("n", "", None)
+
+    def and_expr():
+        val = atom()
+        while peek() == "&&":
+            take()
+            val = atom() and val
+        return val
+
+    def or_expr():
+        val = and_expr()
+        while peek() == "||":
+            take()
+            val = and_expr() or val
+        return val
+
+    return or_expr()
+
+def is_visible(sym, values):
+    """Returns True if the dependencies of sym (and its choice) are met."""
+    deps = list(sym.depends)
+    if sym.choice is not None:
+        deps += sym.choice.depends
+    return all(eval_expr(d, values) for d in deps)
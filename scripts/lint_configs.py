@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Checks configuration snapshots against the Kconfig tree.
+
+For every file given (all of configs/ by default) this reports:
+- symbols that Kconfig doesn't know about (renamed or removed options)
+- visible symbols that are missing from the snapshot (added options)
+- values of the wrong type, outside their range or in an invalid format
+  (MKQNX_CPU, MKQNX_RAM, MKQNX_MACADDR)
+- choices with no member or more than one member selected
+- options set to a non-default value that build_mkqnximage.py never reads
+
+Errors make the exit status non-zero; warnings only do so with --strict.
+"""
+import argparse
+import contextlib
+import io
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from build_mkqnximage import MACADDR_RE, RAM_RE, build_command
+from config_parser import parse_config
+from kconfig_symbols import is_visible, load_kconfig
+
+ROOT = Path(__file__).resolve().parent.parent
+SET_RE = re.compile(r'^CONFIG_([A-Za-z0-9_]+)=(.*)$')
+UNSET_RE = re.compile(r'^# CONFIG_([A-Za-z0-9_]+) is not set$')
+INT_RE = re.compile(r'^-?[0-9]+$')
+
+class Finding:
+    def __init__(self, path, lineno, severity, message):
+        self.path = path
+        self.lineno = lineno
+        self.severity = severity
+        self.message = message
+
+    def __str__(self):
+        loc = f"{self.path}:{self.lineno}" if self.lineno else str(self.path)
+        return f"{loc}: {self.severity}: {self.message}"
+
+class TrackingDict(dict):
+    """A dict that remembers which keys were looked up."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.read = set()
+
+    def get(self, k, default=None):
+        self.read.add(k)
+        return super().get(k, default)
+
+    def __getitem__(self, k):
+        self.read.add(k)
+        return super().__getitem__(k)
+
+    def __contains__(self, k):
+        self.read.add(k)
+        return super().__contains__(k)
+
+def read_entries(path):
+    """Returns {name: (raw value, line number)}, with unset symbols as 'n'."""
+    entries = {}
+    for lineno, ln in enumerate(path.read_text(encoding="utf-8").splitlines(), 1):
+        ln = ln.strip()
+        m = SET_RE.match(ln)
+        if m:
+            entries[m.group(1)] = (m.group(2).strip(), lineno)
+            continue
+        m = UNSET_RE.match(ln)
+        if m:
+            entries[m.group(1)] = ("n", lineno)
+    return entries
+
+def consumed_keys(path):
+    """Returns the config keys build_mkqnximage.py reads for this file."""
+    cfg = TrackingDict(parse_config(path))
+    with contextlib.redirect_stderr(io.StringIO()):
+        build_command(cfg, "mkqnximage")
+    return cfg.read
+
+def check_value(sym, raw):
+    """Returns an error message if raw is not a valid value for sym."""
+    if sym.type == "bool":
+        if raw not in ("y", "n"):
+            return f"{sym.name} is a bool but has value {raw}"
+    elif sym.type == "int":
+        if not INT_RE.match(raw):
+            return f"{sym.name} is an int but has value {raw}"
+        if sym.range and not int(sym.range[0]) <= int(raw) <= int(sym.range[1]):
+            return f"{sym.name}={raw} is outside range {sym.range[0]}..{sym.range[1]}"
+    elif sym.type == "string":
+        if not (len(raw) >= 2 and raw[0] == raw[-1] == '"'):
+            return f"{sym.name} is a string but its value is not quoted"
+    return None
+
+def check_format(name, val):
+    """Validates option values whose format build_mkqnximage.py relies on."""
+    if name == "MKQNX_CPU" and INT_RE.match(val) and not 1 <= int(val) <= 4:
+        return f"MKQNX_CPU={val} must be between 1 and 4"
+    if name == "MKQNX_RAM" and not RAM_RE.match(val):
+        return f'MKQNX_RAM="{val}" is not a size like 512M or 1G'
+    if name == "MKQNX_MACADDR" and val and not MACADDR_RE.match(val):
+        return f'MKQNX_MACADDR="{val}" is not of the form xx:xx:xx:xx:xx:xx'
+    return None
+
+def lint(path, symbols, entries):
+    out = []
+
+    def report(lineno, severity, message):
+        out.append(Finding(path, lineno, severity, message))
+
+    values = {name: raw.strip('"') for name, (raw, _) in entries.items()}
+
+    for name, (raw, lineno) in entries.items():
+        sym = symbols.get(name)
+        if sym is None:
+            report(lineno, "error", f"unknown symbol {name}")
+            continue
+        err = check_value(sym, raw) or check_format(name, raw.strip('"'))
+        if err:
+            report(lineno, "error", err)
+        if raw == "y" and not is_visible(sym, values):
+            report(lineno, "error", f"{name} is set but its dependencies ({' && '.join(sym.depends)}) are not met")
+
+    for sym in symbols.values():
+        if sym.name not in entries and is_visible(sym, values):
+            report(0, "error", f"missing symbol {sym.name} (defined in {Path(sym.filename).relative_to(ROOT)}:{sym.lineno})")
+
+    choices = []
+    for sym in symbols.values():
+        if sym.choice is not None and sym.choice not in choices:
+            choices.append(sym.choice)
+    for choice in choices:
+        visible = [m for m in choice.members if is_visible(m, values)]
+        selected = [m.name for m in visible if values.get(m.name) == "y"]
+        if visible and len(selected) != 1:
+            names = ", ".join(selected) if selected else "none"
+            report(0, "error", f"choice {{{', '.join(m.name for m in visible)}}} "
+                               f"must have exactly one member set, has {names}")
+
+    read = consumed_keys(path)
+    for name, (raw, lineno) in entries.items():
+        sym = symbols.get(name)
+        if sym is None or name in read:
+            continue
+        # Deselected choice members are implied by the selected one.
+        if sym.choice is not None and raw == "n":
+            continue
+        if raw.strip('"') != sym.default_value():
+            report(lineno, "warning", f"{name} is set but never read by build_mkqnximage.py")
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description="Check configuration files against the Kconfig tree.")
+    parser.add_argument("configs", nargs="*", help="config files to check (default: configs/*)")
+    parser.add_argument("--kconfig", default=str(ROOT / "Kconfig"), help="top-level Kconfig file")
+    parser.add_argument("--strict", action="store_true", help="treat warnings as errors")
+    args = parser.parse_args()
+
+    paths = [Path(p) for p in args.configs] or sorted(p for p in (ROOT / "configs").iterdir() if p.is_file())
+    symbols = load_kconfig(args.kconfig)
+    with ThreadPoolExecutor() as pool:
+        all_entries = list(pool.map(read_entries, paths))
+
+    findings = []
+    for path, entries in zip(paths, all_entries):
+        findings += lint(path, symbols, entries)
+    for f in findings:
+        print(f)
+
+    errors = sum(f.severity == "error" or args.strict for f in findings)
+    print(f"{len(paths)} config(s) checked, {len(findings)} finding(s)", file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Small dependency-driven step runner.
+
+A pipeline is a set of named steps, each with the steps it depends on and a
+callable that performs it in its own working directory. Steps whose
+dependencies have completed run concurrently on a thread pool (the work
+itself happens in subprocesses). Once a step fails no new steps are started
+and the pipeline reports which one failed.
+"""
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+class Step:
+    def __init__(self, name, deps, cmd, cwd, env=None, prepare=None):
+        self.name = name
+        self.deps = list(deps)
+        self.cmd = cmd
+        self.cwd = Path(cwd)
+        self.env = env
+        # Called with the step before it runs, e.g. to seed its directory.
+        self.prepare = prepare
+        self.seconds = 0.0
+        self.returncode = None
+
+    @property
+    def log(self):
+        return self.cwd / "step.log"
+
+    def run(self):
+        start = time.monotonic()
+        self.cwd.mkdir(parents=True, exist_ok=True)
+        if self.prepare is not None:
+            self.prepare(self)
+        with open(self.log, "wb") as log:
+            self.returncode = subprocess.call(self.cmd, cwd=self.cwd, env=self.env,
+                                              stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+        self.seconds = time.monotonic() - start
+        return self.returncode
+
+class PipelineError(Exception):
+    pass
+
+class Pipeline:
+    def __init__(self, steps):
+        self.steps = {s.name: s for s in steps}
+        self.failed = None
+        self.reused = []
+        self.wall = 0.0
+        for s in steps:
+            for d in s.deps:
+                if d not in self.steps:
+                    raise PipelineError(f"step {s.name} depends on unknown step {d}")
+        self.order = self._toposort()
+
+    def _toposort(self):
+        order = []
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise PipelineError("dependency cycle: " + " -> ".join(path + [name]))
+            state[name] = "visiting"
+            for d in self.steps[name].deps:
+                visit(d, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.steps:
+            visit(name, [])
+        return order
+
+    def run(self, jobs=None, reuse=None, on_finish=None):
+        """Runs every step; returns True if all of them succeeded.
+
+        reuse(step) is asked once a step's dependencies are done and may
+        return True to keep its previous results instead of running it.
+        on_finish(step, ok) is called after each step that ran.
+        """
+        start = time.monotonic()
+        done = set()
+        pending = list(self.order)
+        running = {}
+        self.reused = []
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while pending or running:
+                progress = True
+                while progress and self.failed is None:
+                    progress = False
+                    for name in list(pending):
+                        step = self.steps[name]
+                        if not all(d in done for d in step.deps):
+                            continue
+                        pending.remove(name)
+                        if reuse is not None and reuse(step):
+                            done.add(name)
+                            self.reused.append(name)
+                            print(f"[pipeline] {name}: up to date", flush=True)
+                            progress = True
+                        else:
+                            print(f"[pipeline] {name}: started", flush=True)
+                            running[pool.submit(step.run)] = name
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    name = running.pop(fut)
+                    step = self.steps[name]
+                    try:
+                        rc = fut.result()
+                    except OSError as e:
+                        print(f"[pipeline] {name}: {e}", file=sys.stderr)
+                        rc = step.returncode = 1
+                    if on_finish is not None:
+                        on_finish(step, rc == 0)
+                    if rc == 0:
+                        done.add(name)
+                        print(f"[pipeline] {name}: done in {step.seconds:.1f}s", flush=True)
+                    elif self.failed is None:
+                        self.failed = name
+                        print(f"[pipeline] {name}: failed with code {rc}, see {step.log}",
+                              file=sys.stderr, flush=True)
+        self.wall = time.monotonic() - start
+        return self.failed is None and not pending
+
+    def downstream(self, name):
+        """Returns name and every step that depends on it, directly or not."""
+        out = {name}
+        for n in self.order:
+            if any(d in out for d in self.steps[n].deps):
+                out.add(n)
+        return out
+
+    def report(self, ran=None):
+        ran = [self.steps[n] for n in (ran or self.order) if self.steps[n].returncode is not None]
+        serial = sum(s.seconds for s in ran)
+        speedup = serial / self.wall if self.wall else 1.0
+        return f"{len(ran)} step(s), {serial:.1f}s of work in {self.wall:.1f}s wall time ({speedup:.1f}x)"
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Host preflight checks for mkqnximage builds.
+
+Before a build the host is probed for what the configuration needs: KVM
+access, the QEMU, VirtualBox and VMware tools and their versions, and the
+options the installed mkqnximage understands. The probes run concurrently
+and their results are cached in local/.preflight.json, keyed on the path,
+size and mtime of each binary, so repeated builds only pay for a few stat
+calls; a probe is rerun when its binary changes.
+
+The results are then checked against the configuration. Options
+mkqnximage doesn't know, and values outside the alternatives its help lists
+(e.g. --qcfs=zstd when it shows --qcfs=yes|no), are rejected before any time
+is spent building; if the help can't be read, the options are not checked;
+settings this host can't run the image with (e.g. more CPUs than it has, or
+several CPUs for aarch64 on QEMU 2.x) only get a warning, because the image
+may be meant for another machine and must not depend on the build host.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from config_parser import parse_config, bool_of, int_of
+
+CACHE_PATH = Path("local/.preflight.json")
+VERSION = 2
+PROBE_TIMEOUT = 10
+
+VERSION_RE = re.compile(r"(\d+)\.(\d+)(?:\.(\d+))?")
+OPTION_RE = re.compile(r"(?<![\w-])--([a-z][a-z0-9_-]*)")
+# "--opt=a|b|c"; placeholders such as <path> or SIZE make the value free-form.
+VALUES_RE = re.compile(r"(?<![\w-])--([a-z][a-z0-9_-]*)=(\S+\|[^\s\],)]+)")
+VALUE_RE = re.compile(r"^[a-z0-9][a-z0-9_.+-]*$")
+
+# Probes: name -> (candidate binaries, arguments printing the information).
+PROBES = {
+    "qemu-x86_64": (("qemu-system-x86_64",), ["--version"]),
+    "qemu-aarch64": (("qemu-system-aarch64",), ["--version"]),
+    "vbox": (("VBoxManage", "vboxmanage"), ["--version"]),
+    "vmware": (("vmrun",), []),
+    "mkqnximage": (("mkqnximage",), ["--help"]),
+}
+
+KVM_DEV = "/dev/kvm"
+
+def _fingerprint(path):
+    st = os.stat(path)
+    return [path, st.st_size, st.st_mtime_ns]
+
+def _run_probe(path, args):
+    try:
+        res = subprocess.run([path] + args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return {"error": str(e)}
+    return {"output": res.stdout.decode("utf-8", "replace")[:65536], "returncode": res.returncode}
+
+def parse_version(text):
+    m = VERSION_RE.search(text or "")
+    return [int(g) for g in m.groups() if g is not None] if m else None
+
+def parse_options(text):
+    return sorted(set(OPTION_RE.findall(text or "")))
+
+def parse_values(text):
+    """Returns {option: [values]} for the options whose help lists every accepted value."""
+    values = {}
+    for opt, alts in VALUES_RE.findall(text or ""):
+        alts = alts.split("|")
+        if all(VALUE_RE.match(a) for a in alts):
+            values[opt] = sorted(set(values.get(opt, [])) | set(alts))
+    return values
+
+def kvm_status():
+    """Returns (usable, reason) for hardware acceleration through /dev/kvm."""
+    if not os.path.exists(KVM_DEV):
+        return False, f"{KVM_DEV} does not exist (virtualization disabled or kvm module not loaded)"
+    if not os.access(KVM_DEV, os.R_OK | os.W_OK):
+        return False, f"no access to {KVM_DEV} (add yourself to the kvm group)"
+    return True, "available"
+
+def probe(cache_path=CACHE_PATH, refresh=False):
+    """Returns the host capabilities, probing only binaries that changed."""
+    cache_path = Path(cache_path)
+    cached = {}
+    if not refresh:
+        try:
+            data = json.loads(cache_path.read_text(encoding="utf-8"))
+            if data.get("version") == VERSION:
+                cached = data["probes"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    results = {}
+    todo = {}
+    for name, (binaries, args) in PROBES.items():
+        path = next(filter(None, (shutil.which(b) for b in binaries)), None)
+        if path is None:
+            results[name] = {"found": False}
+            continue
+        fp = _fingerprint(path)
+        if cached.get(name, {}).get("fingerprint") == fp:
+            results[name] = cached[name]
+        else:
+            todo[name] = (path, args, fp)
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=len(todo)) as pool:
+            futures = {name: pool.submit(_run_probe, path, args) for name, (path, args, _) in todo.items()}
+        for name, fut in futures.items():
+            path, _, fp = todo[name]
+            res = fut.result()
+            entry = {"found": True, "path": path, "fingerprint": fp, "error": res.get("error")}
+            if name == "mkqnximage":
+                entry["options"] = parse_options(res.get("output"))
+                entry["values"] = parse_values(res.get("output"))
+            else:
+                entry["version"] = parse_version(res.get("output"))
+            results[name] = entry
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cache_path.with_name(cache_path.name + ".tmp")
+            tmp.write_text(json.dumps({"version": VERSION, "probes": results}, indent=1), encoding="utf-8")
+            os.replace(tmp, cache_path)
+        except OSError:
+            pass
+
+    # Cheap enough to check every time, and group membership can change
+    # without any binary changing.
+    results["kvm"] = dict(zip(("usable", "reason"), kvm_status()))
+    results["host"] = {"machine": platform.machine(), "cpus": os.cpu_count() or 1}
+    return results
+
+def check(cfg, caps):
+    """Checks cfg against the host capabilities.
+
+    Returns (cfg, findings) where cfg is a copy with the adjustments applied
+    and findings is a list of (level, message) with level "error",
+    "warning" or "note". Only invalid values are adjusted; what merely
+    doesn't fit this host is reported.
+    """
+    cfg = dict(cfg)
+    findings = []
+    arch = "aarch64le" if bool_of(cfg, "MKQNX_ARCH_AARCH64LE") else "x86_64"
+    typ = "qemu"
+    for t in ("VMWARE", "VBOX", "QVM"):
+        if bool_of(cfg, f"MKQNX_TYPE_{t}"):
+            typ = t.lower()
+
+    cpu = int_of(cfg, "MKQNX_CPU", 2)
+    if not 1 <= cpu <= 4:
+        findings.append(("warning", f"MKQNX_CPU={cpu} is outside 1-4; using 2"))
+        cpu = 2
+
+    if typ == "qemu":
+        host_cpus = caps["host"]["cpus"]
+        if cpu > host_cpus:
+            findings.append(("warning", f"MKQNX_CPU={cpu} exceeds the {host_cpus} host CPU(s); "
+                                        f"the image will run slowly here"))
+        qemu = caps["qemu-aarch64" if arch == "aarch64le" else "qemu-x86_64"]
+        if not qemu["found"]:
+            findings.append(("warning", f"no QEMU for {arch} found; the image can be built but not run here"))
+        elif arch == "aarch64le" and qemu.get("version") and qemu["version"][0] < 3 and cpu > 1:
+            findings.append(("warning", f"QEMU {'.'.join(map(str, qemu['version']))} runs aarch64 with "
+                                        f"only 1 CPU; set MKQNX_CPU=1 to run the image here"))
+        host_arch = {"amd64": "x86_64", "arm64": "aarch64"}.get(caps["host"]["machine"].lower(),
+                                                                 caps["host"]["machine"])
+        if qemu["found"] and host_arch == arch.replace("le", ""):
+            kvm = caps["kvm"]
+            if kvm["usable"]:
+                findings.append(("note", "QEMU will use KVM acceleration"))
+            else:
+                findings.append(("warning", f"QEMU will run in TCG emulation, which is much slower: {kvm['reason']}"))
+        elif qemu["found"]:
+            findings.append(("note", f"{arch} on a {host_arch} host runs in TCG emulation"))
+    elif typ == "vbox" and not caps["vbox"]["found"]:
+        findings.append(("warning", "VBoxManage not found; the image can be built but not run here"))
+    elif typ == "vmware" and not caps["vmware"]["found"]:
+        findings.append(("warning", "vmrun not found; the image can be built but not run here"))
+
+    if cpu != int_of(cfg, "MKQNX_CPU", 2):
+        cfg["MKQNX_CPU"] = str(cpu)
+    return cfg, findings
+
+def check_options(cmd, caps):
+    """Returns findings for options and values of cmd the installed mkqnximage lacks.
+
+    Without a usable --help output there is nothing to check against, which
+    is only a warning; mkqnximage still rejects what it doesn't understand.
+    Every mkqnximage has --type, so help text without it wasn't understood.
+    """
+    entry = caps["mkqnximage"]
+    if not entry.get("found"):
+        return []
+    known = entry.get("options")
+    if not known or "type" not in known:
+        return [("warning", "could not read the options of mkqnximage from its --help output; "
+                            "not checking them")]
+    values = entry.get("values") or {}
+    findings = []
+    for arg in cmd[1:]:
+        opt, sep, val = arg.partition("=")
+        if not opt.startswith("--"):
+            continue
+        if opt[2:] not in known:
+            findings.append(("error", f"this mkqnximage does not support {opt}"))
+        elif sep and opt[2:] in values and val not in values[opt[2:]]:
+            findings.append(("error", f"this mkqnximage does not accept {arg}; "
+                                      f"{opt} takes {'|'.join(values[opt[2:]])}"))
+    return findings
+
+def report(findings, out=sys.stderr):
+    for level, msg in findings:
+        print(f"Preflight {level}: {msg}", file=out)
+
+def main():
+    parser = argparse.ArgumentParser(description="Probe the host for what building and running the image needs.")
+    parser.add_argument("config", nargs="?", help="also check this .config against the host")
+    parser.add_argument("--refresh", action="store_true", help="ignore cached probe results")
+    args = parser.parse_args()
+
+    caps = probe(refresh=args.refresh)
+    for name, entry in caps.items():
+        if name in ("kvm", "host"):
+            continue
+        if not entry["found"]:
+            print(f"{name:14} not found")
+        elif name == "mkqnximage":
+            print(f"{name:14} {entry['path']} ({len(entry.get('options') or [])} options)")
+        else:
+            version = ".".join(map(str, entry.get("version") or [])) or "unknown version"
+            print(f"{name:14} {entry['path']} {version}")
+    print(f"{'kvm':14} {caps['kvm']['reason']}")
+    print(f"{'host':14} {caps['host']['machine']}, {caps['host']['cpus']} CPU(s)")
+
+    if args.config:
+        from build_mkqnximage import build_command
+        cfg = parse_config(Path(args.config))
+        cfg, findings = check(cfg, caps)
+        findings += check_options(build_command(cfg, "mkqnximage"), caps)
+        report(findings, sys.stdout)
+        if any(level == "error" for level, _ in findings):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Precomputes the integrity measurements of the /system content.
+
+With QFIM, a QTD container or qtsafefs, every file that goes into /system
+has to be hashed. This tool hashes the input set (the repository
+directories and extra content directories the build searches, or only the
+target paths of a list) on a process pool, reading each file through mmap,
+and writes the results as local/qfim/measurements.sha256 in sha256sum
+format with the target paths, e.g. for signing or checking the content
+outside the build. mkqnximage doesn't read the manifest, so the build never
+runs this tool itself.
+
+The measurements are cached in local/.qfim-cache.json keyed on path, size
+and mtime, so a rebuild only rehashes files that changed. Files that are
+hard links of each other are hashed once.
+
+Usage: qfim_measure.py [-c .config] [--list FILE] [-j N]
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from config_parser import bool_of, parse_config, str_of
+from gen_valgrind_files import scan_roots
+
+CACHE_PATH = Path("local/.qfim-cache.json")
+CACHE_VERSION = 1
+MANIFEST_PATH = Path("local/qfim/measurements.sha256")
+KEYWORDS = ("", "none")
+
+def enabled(cfg):
+    return any(bool_of(cfg, k) for k in ("MKQNX_QFIM", "MKQNX_QTD", "MKQNX_QTSAFEFS"))
+
+def hash_file(path):
+    """Returns (path, hex sha256) or (path, None) if it can't be read."""
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    h.update(m)
+    except (OSError, ValueError):
+        return path, None
+    return path, h.hexdigest()
+
+def read_list(path):
+    """Returns the set of target paths listed one per line in path."""
+    return {ln.strip() for ln in Path(path).read_text(encoding="utf-8").splitlines() if ln.strip()}
+
+def input_roots(cfg):
+    """Returns the directories whose files can end up in /system."""
+    roots = scan_roots(cfg)
+    extra = str_of(cfg, "MKQNX_EXTRA_DIRS", "")
+    for item in os.path.expandvars(extra).split(":"):
+        item = item.lstrip("+-")
+        if item not in KEYWORDS and Path(item).is_dir():
+            roots.append(Path(item))
+    return roots
+
+def collect(roots, wanted=None):
+    """Returns {path: (target, stat)} for the regular files below roots.
+
+    When a target is found in several roots, the first root wins, like the
+    search order of mkifs and mkqnx6fsimg. wanted restricts the result to
+    the given target paths.
+    """
+    files = {}
+    targets = set()
+    for root in roots:
+        for dirpath, _, filenames in os.walk(root):
+            for fn in filenames:
+                p = os.path.join(dirpath, fn)
+                target = "/" + os.path.relpath(p, root)
+                if target in targets or (wanted is not None and target not in wanted):
+                    continue
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                if os.path.isfile(p):
+                    targets.add(target)
+                    files[p] = (target, st)
+    return files
+
+def load_cache():
+    try:
+        data = json.loads(CACHE_PATH.read_text(encoding="utf-8"))
+        if data.get("version") == CACHE_VERSION:
+            return data["files"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+def save_cache(files):
+    CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = CACHE_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"version": CACHE_VERSION, "files": files}), encoding="utf-8")
+    os.replace(tmp, CACHE_PATH)
+
+def measure(cfg, wanted=None, jobs=None, manifest=MANIFEST_PATH):
+    """Hashes the /system input set and writes the manifest; returns (files, hashed)."""
+    files = collect(input_roots(cfg), wanted)
+    cache = load_cache()
+    digests = {}
+    todo = {}
+    for p, (_, st) in files.items():
+        old = cache.get(p)
+        if old and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+            digests[p] = old[2]
+            continue
+        # Hard links share an inode; hash them once.
+        todo.setdefault((st.st_dev, st.st_ino), []).append(p)
+
+    if todo:
+        first = [paths[0] for paths in todo.values()]
+        chunk = max(1, min(64, len(first) // ((jobs or os.cpu_count() or 1) * 4)))
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = dict(pool.map(hash_file, first, chunksize=chunk))
+        for paths in todo.values():
+            for p in paths:
+                digests[p] = results[paths[0]]
+
+    cached = {}
+    for p, (_, st) in files.items():
+        if digests.get(p) is not None:
+            cached[p] = [st.st_size, st.st_mtime_ns, digests[p]]
+    save_cache(cached)
+
+    manifest = Path(manifest)
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    lines = [f"{digests[p]}  {target}\n"
+             for p, (target, _) in sorted(files.items(), key=lambda kv: kv[1][0]) if digests.get(p)]
+    tmp = manifest.with_suffix(".tmp")
+    tmp.write_text("".join(lines), encoding="utf-8")
+    os.replace(tmp, manifest)
+    for p in files:
+        if digests.get(p) is None:
+            print("Warning: could not read", p, file=sys.stderr)
+    return len(files), sum(len(paths) for paths in todo.values())
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the integrity measurements of the /system content.")
+    parser.add_argument("-c", "--config", default=".config", help="config file (default .config)")
+    parser.add_argument("--list", metavar="FILE", help="only measure the target paths listed in FILE")
+    parser.add_argument("-o", "--output", default=str(MANIFEST_PATH), help="manifest to write")
+    parser.add_argument("-j", "--jobs", type=int, help="hashing processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    conf_path = Path(args.config)
+    if not conf_path.exists():
+        print("Config file not found:", conf_path, file=sys.stderr)
+        sys.exit(1)
+    cfg = parse_config(conf_path)
+    if not enabled(cfg):
+        print("Warning: none of MKQNX_QFIM, MKQNX_QTD and MKQNX_QTSAFEFS is enabled in", conf_path,
+              file=sys.stderr)
+    wanted = read_list(args.list) if args.list else None
+
+    start = time.monotonic()
+    total, hashed = measure(cfg, wanted, args.jobs, args.output)
+    print(f"Measured {total} files ({hashed} hashed, {total - hashed} cached) "
+          f"in {time.monotonic() - start:.1f}s; wrote {args.output}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Measures the guest's memory use and recommends a value for MKQNX_RAM.
+
+"ram_profile.py run" builds the config with a sampling payload added
+through MKQNX_EXTRA_DIRS (as snippets/post_start.custom), boots it and
+starts the given workload once startup is done. While the workload runs
+(and at least for --duration seconds), the payload prints the free and
+total memory reported by "pidin info" on the console:
+
+  RAMPROF begin version=1 config=defconfig ram=1G packages="MKQNX_PYTHON"
+  RAMPROF sample t=10 CPU:X86_64 Release:8.0.0 FreeMem:846MB/1023MB ...
+  RAMPROF workload rc=0
+  RAMPROF end
+
+The peak use, plus what the kernel keeps from the configured RAM, plus
+--headroom, rounded up to 64 MiB, is the recommended MKQNX_RAM; --write
+stores it in the config. Every profile is also recorded in
+local/.ram-profile.json with the packages the config enables (Python,
+Valgrind, the sanitizers, ...), and the report estimates how much memory
+each package costs from the runs with and without it.
+
+"ram_profile.py report" analyses recorded console logs the same way,
+without building or booting anything.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import shlex
+import shutil
+import sys
+import time
+from pathlib import Path
+from config_parser import bool_of, parse_config, str_of
+from edit_users import read_config_lines, write_config_lines
+from fs_bench import with_payload
+from run_image import run_vm
+from verify_repro import run_build
+
+PAYLOAD_VERSION = 1
+OUT_DIR = Path("ramprof")
+HISTORY_PATH = Path("local/.ram-profile.json")
+HISTORY_VERSION = 1
+MiB = 1024 * 1024
+STEP = 64 * MiB
+MIN_RAM = 256 * MiB
+PACKAGES = ("MKQNX_PYTHON", "MKQNX_VALGRIND", "MKQNX_SANITIZERS", "MKQNX_PERL", "MKQNX_GRAPHICS",
+            "MKQNX_QAUDIT", "MKQNX_PKCS11", "MKQNX_TOMCRYPT", "MKQNX_IO_SOCK_DIAG", "MKQNX_USB")
+
+LINE_RE = re.compile(r"^.*?RAMPROF (.*?)\r?$", re.MULTILINE)
+# pidin info: "FreeMem:846MB/1023MB" (QNX 8) or "FreeMem:1913Mb/2047Mb" (QNX 7).
+FREEMEM_RE = re.compile(r"FreeMem:\s*(\d+)\s*([KMG]?)b?\s*/\s*(\d+)\s*([KMG]?)b?", re.IGNORECASE)
+UNITS = {"": 1, "k": 1024, "m": MiB, "g": 1024 * MiB}
+RAM_RE = re.compile(r"^([1-9][0-9]*)([MG])?$", re.IGNORECASE)
+
+PAYLOAD = r"""# Memory profiling payload, generated by scripts/ram_profile.py.
+(
+ramprof_sample() {
+    echo "RAMPROF sample t=$1 $(echo $(pidin info 2>&1))"
+}
+
+sleep @SETTLE@
+echo "RAMPROF begin version=@VERSION@ config=@CONFIG@ ram=@RAM@ packages=\"@PACKAGES@\""
+t=0
+ramprof_sample $t
+( @WORKLOAD@ ) > /dev/null 2>&1 &
+wpid=$!
+while :; do
+    sleep @INTERVAL@
+    t=$((t + @INTERVAL@))
+    ramprof_sample $t
+    kill -0 $wpid 2> /dev/null && continue
+    [ $t -ge @DURATION@ ] && break
+done
+wait $wpid
+echo "RAMPROF workload rc=$?"
+echo "RAMPROF end"
+) &
+"""
+
+def parse_ram(value):
+    """Returns the MKQNX_RAM value in bytes (no unit means megabytes), or None."""
+    m = RAM_RE.match(value.strip())
+    if not m:
+        return None
+    return int(m.group(1)) * (1024 * MiB if (m.group(2) or "M").upper() == "G" else MiB)
+
+def format_ram(nbytes):
+    mib = nbytes // MiB
+    return f"{mib // 1024}G" if mib % 1024 == 0 else f"{mib}M"
+
+def enabled_packages(cfg):
+    return [p for p in PACKAGES if bool_of(cfg, p)]
+
+def write_payload(dest, cfg, config="config", workload="", duration=30, interval=2, settle=5):
+    """Writes the payload as an extra content directory at dest."""
+    text = PAYLOAD
+    for key, val in (("SETTLE", settle), ("VERSION", PAYLOAD_VERSION), ("CONFIG", config),
+                     ("RAM", str_of(cfg, "MKQNX_RAM", "1G")), ("PACKAGES", " ".join(enabled_packages(cfg))),
+                     ("WORKLOAD", workload or ":"), ("INTERVAL", interval), ("DURATION", duration)):
+        text = text.replace(f"@{key}@", str(val))
+    snippets = Path(dest) / "snippets"
+    snippets.mkdir(parents=True, exist_ok=True)
+    (snippets / "post_start.custom").write_text(text, encoding="utf-8")
+
+def parse_console(text):
+    """Parses the RAMPROF lines of a console log.
+
+    Returns a dict with the begin line's fields under "info", the samples
+    as (t, free bytes, total bytes), the workload's exit code and whether
+    the end line was seen.
+    """
+    out = {"info": {}, "samples": [], "workload_rc": None, "complete": False}
+    for m in LINE_RE.finditer(text):
+        body = m.group(1)
+        if body.startswith("begin"):
+            # A reboot restarts the payload; only the last run counts.
+            out = {"info": {}, "samples": [], "workload_rc": None, "complete": False}
+            try:
+                out["info"] = dict(f.split("=", 1) for f in shlex.split(body[len("begin"):]) if "=" in f)
+            except ValueError:
+                pass
+        elif body.startswith("sample"):
+            t = re.search(r"\bt=(\d+)", body)
+            mem = FREEMEM_RE.search(body)
+            if t and mem:
+                free = int(mem.group(1)) * UNITS[mem.group(2).lower()]
+                total = int(mem.group(3)) * UNITS[mem.group(4).lower()]
+                out["samples"].append((int(t.group(1)), free, total))
+        elif body.startswith("workload"):
+            rc = re.search(r"\brc=(\d+)", body)
+            out["workload_rc"] = int(rc.group(1)) if rc else None
+        elif body.strip() == "end":
+            out["complete"] = True
+    return out
+
+def analyse(parsed, headroom):
+    """Returns the usage figures and the recommended RAM (bytes) of a parsed log, or None."""
+    samples = parsed["samples"]
+    if not samples:
+        return None
+    used = [total - free for _, free, total in samples]
+    peak = max(used)
+    total = samples[0][2]
+    configured = parse_ram(parsed["info"].get("ram", "")) or total
+    # Memory taken by the kernel and the IFS before pidin can see it.
+    reserved = max(0, configured - total)
+    need = (peak + reserved) * (1 + headroom)
+    recommended = max(MIN_RAM, math.ceil(need / STEP) * STEP)
+    return {"configured": configured, "visible": total, "idle": used[0], "peak": peak,
+            "peak_t": samples[used.index(peak)][0], "recommended": recommended,
+            "low": min(free for _, free, _ in samples)}
+
+def load_history():
+    try:
+        data = json.loads(HISTORY_PATH.read_text(encoding="utf-8"))
+        if data.get("version") == HISTORY_VERSION:
+            return data["runs"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return []
+
+def save_history(runs):
+    HISTORY_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = HISTORY_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"version": HISTORY_VERSION, "runs": runs}, indent=1), encoding="utf-8")
+    os.replace(tmp, HISTORY_PATH)
+
+def package_costs(runs):
+    """Returns {package: (estimated bytes, runs with, runs without)}.
+
+    The estimate is the difference of the mean peak use of the runs with
+    and without the package, so it is only as good as the mix of runs.
+    """
+    out = {}
+    for p in PACKAGES:
+        with_p = [r["peak"] for r in runs if p in r["packages"]]
+        without = [r["peak"] for r in runs if p not in r["packages"]]
+        if with_p and without:
+            out[p] = (sum(with_p) / len(with_p) - sum(without) / len(without), len(with_p), len(without))
+    return out
+
+def print_profile(label, parsed, figures, out=sys.stdout):
+    packages = parsed["info"].get("packages", "").split()
+    print(f"{label}: packages {', '.join(packages) or 'none'}", file=out)
+    print(f"  configured {format_ram(figures['configured'])}, visible to the guest "
+          f"{figures['visible'] / MiB:.0f} MiB", file=out)
+    print(f"  used {figures['idle'] / MiB:.0f} MiB after startup, peak {figures['peak'] / MiB:.0f} MiB "
+          f"at t={figures['peak_t']}s over {len(parsed['samples'])} samples "
+          f"(lowest free {figures['low'] / MiB:.0f} MiB)", file=out)
+    if parsed["workload_rc"]:
+        print(f"  Warning: the workload exited with code {parsed['workload_rc']}; it may have run out "
+              "of memory, so profile again with more RAM.", file=out)
+    if not parsed["complete"]:
+        print("  Warning: the log ends before profiling finished.", file=out)
+    print(f"  recommended MKQNX_RAM={format_ram(figures['recommended'])}", file=out)
+
+def print_costs(runs, out=sys.stdout):
+    costs = package_costs(runs)
+    if not costs:
+        return
+    print("Estimated memory per package (mean peak with minus without, from "
+          f"{len(runs)} recorded runs):", file=out)
+    for p, (cost, n_with, n_without) in sorted(costs.items(), key=lambda kv: -kv[1][0]):
+        print(f"  {p}: {cost / MiB:+.0f} MiB ({n_with} with, {n_without} without)", file=out)
+
+def set_ram(conf_path, value):
+    """Stores MKQNX_RAM in the config file, like edit_users stores MKQNX_USERS."""
+    lines = read_config_lines(conf_path)
+    new_line = f'CONFIG_MKQNX_RAM="{value}"'
+    found = False
+    out_lines = []
+    for ln in lines:
+        if re.match(r'^\s*CONFIG_MKQNX_RAM=', ln):
+            out_lines.append(new_line)
+            found = True
+        else:
+            out_lines.append(ln)
+    if not found:
+        out_lines.append(new_line)
+    write_config_lines(conf_path, out_lines)
+    print("Saved to", conf_path)
+
+def analyse_logs(logs, headroom, record=False):
+    """Parses and reports console logs; returns the largest recommendation, or None."""
+    runs = load_history()
+    best = None
+    for log in logs:
+        parsed = parse_console(Path(log).read_text(encoding="utf-8", errors="replace"))
+        figures = analyse(parsed, headroom)
+        if figures is None:
+            print(f"Warning: no memory samples in {log}", file=sys.stderr)
+            continue
+        print_profile(parsed["info"].get("config") or Path(log).stem, parsed, figures)
+        if record:
+            runs.append({"config": parsed["info"].get("config", ""), "time": time.time(),
+                         "packages": parsed["info"].get("packages", "").split(),
+                         "configured": figures["configured"], "peak": figures["peak"]})
+        best = max(best or 0, figures["recommended"])
+    if record:
+        save_history(runs)
+    print_costs(runs)
+    return best
+
+def cmd_run(args):
+    tool = shutil.which(args.tool)
+    if not tool:
+        print(f"Error: '{args.tool}' not found on PATH.", file=sys.stderr)
+        return 1
+    conf_path = Path(args.config)
+    if not conf_path.exists():
+        print("Config file not found:", conf_path, file=sys.stderr)
+        return 1
+    cfg = parse_config(conf_path)
+    if args.profile_ram:
+        if parse_ram(args.profile_ram) is None:
+            print("Error: invalid --profile-ram:", args.profile_ram, file=sys.stderr)
+            return 1
+        cfg["MKQNX_RAM"] = args.profile_ram
+
+    name = conf_path.name.lstrip(".") or "config"
+    out_dir = Path(args.out).resolve()
+    work = out_dir / name
+    if work.exists():
+        shutil.rmtree(work)
+    work.mkdir(parents=True)
+    write_payload(work / "payload", cfg, name, args.workload, args.duration, args.interval, args.settle)
+
+    print(f"Building {conf_path} with {str_of(cfg, 'MKQNX_RAM', '1G')} of RAM in {work}...")
+    rc = run_build(with_payload(cfg, work / "payload"), tool, ".", work, False)
+    if rc != 0:
+        print(f"Error: build failed with code {rc}; see {work / 'build.log'}.", file=sys.stderr)
+        return 1
+    log = out_dir / f"{name}.log"
+    log.unlink(missing_ok=True)
+    print("Booting and sampling memory use...")
+    result = run_vm([tool, "--run"], until=r"RAMPROF end", timeout=args.timeout, log=log,
+                    echo=args.verbose, cwd=work)
+    if not args.keep:
+        shutil.rmtree(work, ignore_errors=True)
+    if not result.matched:
+        print(f"Warning: the VM {'timed out' if result.timed_out else 'stopped'} before profiling finished; "
+              f"see {log}.", file=sys.stderr)
+    print()
+    return finish(args, [log], conf_path, record=True)
+
+def finish(args, logs, conf_path, record):
+    best = analyse_logs(logs, args.headroom, record)
+    if best is None:
+        return 1
+    if args.write:
+        if conf_path is None:
+            print("Error: --write needs the config to update (-c).", file=sys.stderr)
+            return 1
+        set_ram(conf_path, format_ram(best))
+    return 0
+
+def cmd_report(args):
+    return finish(args, args.logs, Path(args.config) if args.config else None, args.record)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the guest's memory use and recommend MKQNX_RAM.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def analysis_options(p):
+        p.add_argument("--headroom", type=float, default=0.25,
+                       help="fraction added to the measured peak (default 0.25)")
+        p.add_argument("--write", action="store_true", help="store the recommendation as MKQNX_RAM in the config")
+
+    p = sub.add_parser("run", help="build and boot the config and profile its memory use")
+    p.add_argument("config", nargs="?", default=".config", help="path to the .config file")
+    p.add_argument("--workload", metavar="CMD", help="shell command run in the guest while sampling")
+    p.add_argument("--duration", type=int, default=30, help="sample for at least this many seconds (default 30)")
+    p.add_argument("--interval", type=int, default=2, help="seconds between samples (default 2)")
+    p.add_argument("--settle", type=int, default=5, help="seconds to wait after startup (default 5)")
+    p.add_argument("--profile-ram", metavar="SIZE", help="RAM to profile with, e.g. 2G (default: MKQNX_RAM)")
+    p.add_argument("--tool", default="mkqnximage", help="mkqnximage or a compatible tool (default: mkqnximage)")
+    p.add_argument("--out", default=str(OUT_DIR), help="directory for the build and console log "
+                                                       "(default: ramprof)")
+    p.add_argument("--timeout", type=float, default=900, help="seconds to wait for the VM (default 900)")
+    p.add_argument("--keep", action="store_true", help="keep the build directory")
+    p.add_argument("-v", "--verbose", action="store_true", help="echo the VM console")
+    analysis_options(p)
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("report", help="analyse recorded console logs")
+    p.add_argument("logs", nargs="+", help="console logs")
+    p.add_argument("-c", "--config", help="config to update with --write")
+    p.add_argument("--record", action="store_true", help="add the logs to the history in local/")
+    analysis_options(p)
+    p.set_defaults(func=cmd_report)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+if __name__ == "__main__":
+    main()
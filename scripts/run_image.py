@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Launches the built image and watches its console.
+
+By default the image is started with "mkqnximage --run" from the current
+directory, which must be the one the image was built in. The console is
+copied to stdout (and optionally a log file) while it is scanned for the
+login prompt, so the boot-to-login time can be exported as a metric.
+
+With --until the VM is stopped as soon as a line matching the given regular
+expression appears, which lets other tools boot an image, collect the output
+of something it runs at startup and carry on.
+"""
+import argparse
+import os
+import re
+import select
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from build_metrics import Metrics, metrics_target
+
+LOGIN_RE = re.compile(rb"login:\s*$", re.MULTILINE)
+# Only the end of the console is kept in memory; --log has all of it.
+OUTPUT_TAIL = 1024 * 1024
+
+class RunResult:
+    def __init__(self):
+        self.output = bytearray()
+        self.boot_to_login = None
+        self.matched = False
+        self.timed_out = False
+        self.returncode = None
+
+    @property
+    def text(self):
+        return self.output.decode("utf-8", "replace")
+
+def default_command():
+    mkqnx = shutil.which("mkqnximage")
+    if not mkqnx:
+        return None
+    return [mkqnx, "--run"]
+
+def run_vm(cmd, until=None, timeout=None, log=None, echo=True, cwd=None):
+    """Runs cmd, tees its console and stops it when until matches or on timeout."""
+    until_re = re.compile(until.encode(), re.MULTILINE) if until else None
+    result = RunResult()
+    start = time.monotonic()
+    proc = subprocess.Popen(cmd, cwd=cwd, stdin=subprocess.DEVNULL if until else None,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
+    fd = proc.stdout.fileno()
+    logf = open(log, "ab") if log else None
+    scanned = 0
+    try:
+        while True:
+            left = None if timeout is None else timeout - (time.monotonic() - start)
+            if left is not None and left <= 0:
+                result.timed_out = True
+                break
+            r, _, _ = select.select([fd], [], [], 1.0 if left is None else min(left, 1.0))
+            if not r:
+                if proc.poll() is not None:
+                    break
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            if echo:
+                sys.stdout.buffer.write(chunk)
+                sys.stdout.flush()
+            if logf:
+                logf.write(chunk)
+            result.output += chunk
+            # Only rescan from the last complete line to keep this linear.
+            window = result.output[scanned:]
+            if result.boot_to_login is None and LOGIN_RE.search(window):
+                result.boot_to_login = time.monotonic() - start
+            if until_re is not None and until_re.search(window):
+                result.matched = True
+                break
+            nl = result.output.rfind(b"\n")
+            if nl >= 0:
+                scanned = nl + 1
+            if len(result.output) > OUTPUT_TAIL:
+                drop = len(result.output) - OUTPUT_TAIL
+                del result.output[:drop]
+                scanned = max(0, scanned - drop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if logf:
+            logf.close()
+        if proc.poll() is None:
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.wait()
+            except ProcessLookupError:
+                pass
+        result.returncode = proc.wait()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the built image and record its boot time.")
+    parser.add_argument("--cmd", help="command that starts the VM (default: mkqnximage --run)")
+    parser.add_argument("--until", metavar="REGEX", help="stop the VM once console output matches REGEX")
+    parser.add_argument("--timeout", type=float, help="stop the VM after this many seconds")
+    parser.add_argument("--log", help="append the console output to this file")
+    parser.add_argument("--metrics-dir", metavar="DIR",
+                        help="write a Prometheus textfile here (default: $MKQNX_METRICS_DIR)")
+    parser.add_argument("--metrics-push", metavar="URL",
+                        help="push metrics to this Pushgateway (default: $MKQNX_METRICS_PUSH)")
+    args = parser.parse_args()
+
+    cmd = shlex.split(args.cmd) if args.cmd else default_command()
+    if not cmd:
+        print("Error: 'mkqnximage' not found on PATH.", file=sys.stderr)
+        sys.exit(1)
+
+    result = run_vm(cmd, until=args.until, timeout=args.timeout, log=args.log)
+    if result.boot_to_login is not None:
+        print(f"\nBoot to login: {result.boot_to_login:.1f}s", file=sys.stderr)
+
+    metrics_dir, metrics_push = metrics_target(args.metrics_dir, args.metrics_push)
+    if metrics_dir or metrics_push:
+        metrics = Metrics("mkqnx_vm", {"image": Path.cwd().name})
+        if result.boot_to_login is not None:
+            metrics.gauge("vm_boot_to_login_seconds", result.boot_to_login,
+                          "Time from starting the VM to the first login prompt.")
+        metrics.gauge("vm_boot_timed_out", result.timed_out, "Whether the run hit its timeout.")
+        for err in metrics.emit(metrics_dir, metrics_push):
+            print("Warning:", err, file=sys.stderr)
+
+    if args.until and not result.matched:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+RAM-backed staging workspace for mkqnximage.
+
+mkqnximage writes its intermediate IFS, filesystem images and the assembled
+disk into local/ and output/ below the directory it runs in. With staging,
+it runs in a workspace on tmpfs (/dev/shm) seeded with the current local/
+state instead; afterwards only the final images are moved to output/ and the
+persistent local/ state that changed is copied back.
+
+The workspace is only used when the expected build size, with some margin,
+fits both the free space of the tmpfs and the available memory; otherwise the
+build falls back to running on disk.
+
+When a staged build fails, its workspace is kept and recorded in
+local/.staging so that a resumed build can pick up the intermediate files
+mkqnximage already produced; the next build that doesn't resume removes it.
+"""
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from config_parser import str_of
+
+SHM_DIRS = ("/dev/shm", "/run/shm")
+# Used when there is no previous build to estimate from.
+DEFAULT_EXPECTED = 2 * 1024 ** 3
+MARGIN = 1.5
+# Never let the workspace take more than this share of available memory.
+MEM_SHARE = 0.5
+# Files up to this size in local/ are persistent state (options, keys,
+# passwords, snippets) and are kept; anything larger is an intermediate.
+STATE_MAX = 1024 * 1024
+# Records the workspace of a failed staged build.
+KEPT_PATH = Path("local/.staging")
+
+PATH_OPTIONS = ("MKQNX_POLICY", "MKQNX_SSH_IDENT", "MKQNX_ZONEINFO_PATH")
+LIST_OPTIONS = ("MKQNX_REPOS", "MKQNX_EXTRA_DIRS")
+KEYWORDS = ("", "none", "prompt", "no", "yes")
+
+def absolutize_cfg(cfg, base):
+    """Returns a copy of cfg with relative paths resolved against base.
+
+    mkqnximage resolves relative paths against the directory it runs in, so
+    they must be made absolute before running it anywhere else. Extra
+    directory entries that don't exist relative to base are left alone since
+    mkqnximage also looks them up in the 'extras' of its content directories.
+    """
+    base = Path(base).resolve()
+    out = dict(cfg)
+    for key in PATH_OPTIONS:
+        val = str_of(cfg, key, "")
+        if val not in KEYWORDS and not os.path.isabs(val) and not val.startswith(("~", "$")):
+            out[key] = str(base / val)
+    for key in LIST_OPTIONS:
+        val = str_of(cfg, key, "")
+        if not val:
+            continue
+        items = []
+        for item in val.split(":"):
+            prefix = item[:1] if item[:1] in "+-" else ""
+            path = item[len(prefix):]
+            if path and path not in KEYWORDS and not os.path.isabs(path) \
+                    and not path.startswith(("~", "$")) and (base / path).exists():
+                path = str(base / path)
+            items.append(prefix + path)
+        out[key] = ":".join(items)
+    return out
+
+def tree_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for fn in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, fn)).st_size
+            except OSError:
+                pass
+    return total
+
+def mem_available():
+    try:
+        with open("/proc/meminfo") as f:
+            for ln in f:
+                if ln.startswith("MemAvailable:"):
+                    return int(ln.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def expected_size(root="."):
+    """Estimates the workspace size from the previous build, if any."""
+    root = Path(root)
+    out = tree_size(root / "output")
+    return out + tree_size(root / "local") if out else DEFAULT_EXPECTED
+
+def pick_workspace(mode, expected):
+    """Returns (tmpfs directory or None, reason)."""
+    if mode == "off":
+        return None, "staging disabled"
+    need = int(expected * MARGIN)
+    reason = "no writable tmpfs found"
+    for d in SHM_DIRS:
+        if not os.path.isdir(d) or not os.access(d, os.W_OK):
+            continue
+        st = os.statvfs(d)
+        free = st.f_bavail * st.f_frsize
+        mem = mem_available()
+        if need <= free and (mode == "ram" or need <= mem * MEM_SHARE):
+            return d, f"{need >> 20} MiB needed, {free >> 20} MiB free on {d}, {mem >> 20} MiB memory available"
+        reason = f"{need >> 20} MiB needed but only {free >> 20} MiB free on {d} " \
+                 f"and {mem >> 20} MiB memory available"
+    return None, reason
+
+def _skip_intermediates(dirpath, names):
+    skip = []
+    for n in names:
+        p = os.path.join(dirpath, n)
+        if os.path.isfile(p) and not os.path.islink(p) and os.path.getsize(p) > STATE_MAX:
+            skip.append(n)
+    return skip
+
+def copy_state(src, dst):
+    """Copies the persistent state in src/local (not the intermediates) to dst/local."""
+    if (Path(src) / "local").is_dir():
+        shutil.copytree(Path(src) / "local", Path(dst) / "local", symlinks=True, ignore=_skip_intermediates,
+                        dirs_exist_ok=True)
+
+class Workspace:
+    """A temporary build directory seeded with the local/ state and synced back after."""
+
+    def __init__(self, parent, root=".", path=None):
+        self.root = Path(root).resolve()
+        self.path = Path(path) if path else Path(tempfile.mkdtemp(prefix="mkqnx-stage-", dir=parent))
+        self.seeded = {}
+        self.staged_bytes = 0
+        self.persisted_bytes = 0
+
+    @classmethod
+    def kept(cls, root="."):
+        """Returns the workspace a failed build left behind, or None."""
+        try:
+            path = Path(root, KEPT_PATH).read_text(encoding="utf-8").strip()
+        except OSError:
+            return None
+        if not path or not os.path.isdir(path):
+            Path(root, KEPT_PATH).unlink(missing_ok=True)
+            return None
+        return cls(None, root, path)
+
+    def seed(self):
+        """Copies the persistent local/ state in, over whatever a kept workspace has."""
+        copy_state(self.root, self.path)
+        self.seeded = self._snapshot(self.path / "local")
+
+    def _snapshot(self, top):
+        snap = {}
+        for dirpath, _, filenames in os.walk(top):
+            for fn in filenames:
+                p = Path(dirpath) / fn
+                st = p.lstat()
+                snap[p.relative_to(top)] = (st.st_size, st.st_mtime_ns)
+        return snap
+
+    def free_ratio(self):
+        st = os.statvfs(self.path)
+        return st.f_bavail / st.f_blocks if st.f_blocks else 0.0
+
+    def collect(self):
+        """Moves the final images to output/ and copies changed local/ state back.
+
+        Large files written to local/ are intermediate images and stay in the
+        workspace; so do subdirectories of output/. Small files in output/
+        (e.g. launch scripts) may mention the workspace path, which is
+        rewritten to the real build directory.
+        """
+        local = self.path / "local"
+        after = self._snapshot(local)
+        for rel, meta in after.items():
+            self.staged_bytes += meta[0] if self.seeded.get(rel) != meta else 0
+            if self.seeded.get(rel) == meta or meta[0] > STATE_MAX:
+                continue
+            dst = self.root / "local" / rel
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(local / rel, dst, follow_symlinks=False)
+            self.persisted_bytes += meta[0]
+        for rel in set(self.seeded) - set(after):
+            (self.root / "local" / rel).unlink(missing_ok=True)
+
+        out = self.path / "output"
+        if not out.is_dir():
+            return
+        self.staged_bytes += tree_size(out)
+        dst_dir = self.root / "output"
+        dst_dir.mkdir(exist_ok=True)
+        for p in out.iterdir():
+            if not p.is_file() or p.is_symlink():
+                continue
+            size = p.stat().st_size
+            if size <= STATE_MAX:
+                data = p.read_bytes()
+                if os.fsencode(self.path) in data:
+                    p.write_bytes(data.replace(os.fsencode(self.path), os.fsencode(self.root)))
+            self.persisted_bytes += size
+            shutil.move(str(p), str(dst_dir / p.name))
+
+    def keep(self):
+        """Leaves the workspace in place for a resumed build."""
+        marker = self.root / KEPT_PATH
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.write_text(f"{self.path}\n", encoding="utf-8")
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        marker = self.root / KEPT_PATH
+        try:
+            if marker.read_text(encoding="utf-8").strip() == str(self.path):
+                marker.unlink()
+        except OSError:
+            pass
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Stand-in for mkqnximage used to exercise the build tooling without QNX.
+
+It accepts any mkqnximage options, sleeps to simulate the latency of each
+build step and writes small but well-formed outputs: the persistent local/
+state, one image per partition and a disk image with an MBR partition table.
+Without --step it performs all steps in order like a monolithic mkqnximage
+run; with --step=<name> it performs only that step (see image_pipeline.py).
+--help lists the step options, which is how the build recognizes step tools.
+
+Environment:
+  MKQNX_STUB_LATENCY  per-step seconds, e.g. "shared=0.2,system=2"
+  MKQNX_STUB_FAIL     name of a step that should fail
+  MKQNX_STUB_WORK     real work done by every step instead of only sleeping,
+                      e.g. "cpu=2,mem=256M,io=64M" (CPU seconds, memory held,
+                      bytes written and read back), for resource accounting
+"""
+import hashlib
+import os
+import struct
+import sys
+import time
+from pathlib import Path
+
+STEPS = ("shared", "boot", "system", "data", "assemble")
+DEFAULT_LATENCY = {"shared": 0.2, "boot": 0.5, "system": 2.0, "data": 1.0, "assemble": 0.3}
+PART_TYPES = {"boot": 0x0c, "system": 0xb1, "data": 0xb1}
+PART_KB = 64
+
+def latency():
+    out = dict(DEFAULT_LATENCY)
+    for item in os.environ.get("MKQNX_STUB_LATENCY", "").split(","):
+        if "=" in item:
+            k, v = item.split("=", 1)
+            out[k.strip()] = float(v)
+    return out
+
+def do_work(spec):
+    work = {}
+    for item in spec.split(","):
+        if "=" in item:
+            k, v = item.split("=", 1)
+            v = v.strip()
+            mult = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}.get(v[-1:].upper(), 1)
+            work[k.strip()] = float(v[:-1] if mult > 1 else v) * mult
+    held = bytearray(int(work.get("mem", 0)))
+    for i in range(0, len(held), 4096):
+        held[i] = 1
+    if work.get("io"):
+        with open("stub-io.tmp", "wb") as f:
+            for _ in range(int(work["io"]) // (1024 * 1024) or 1):
+                f.write(os.urandom(1024 * 1024))
+            f.flush()
+            os.fsync(f.fileno())
+        with open("stub-io.tmp", "rb") as f:
+            while f.read(1024 * 1024):
+                pass
+        os.unlink("stub-io.tmp")
+    end = time.process_time() + work.get("cpu", 0)
+    while time.process_time() < end:
+        hashlib.sha256(b"x" * 4096).digest()
+
+def image_name(opts):
+    typ = "qemu"
+    for o in opts:
+        if o.startswith("--type="):
+            typ = o.split("=", 1)[1]
+    return f"disk-{typ}"
+
+def run_step(step, opts, parts_dirs):
+    time.sleep(latency().get(step, 0))
+    do_work(os.environ.get("MKQNX_STUB_WORK", ""))
+    if os.environ.get("MKQNX_STUB_FAIL") == step:
+        print(f"stub: step {step} failed", file=sys.stderr)
+        return 1
+    local = Path("local")
+    out = Path("output")
+    if step == "shared":
+        (local / "misc_files").mkdir(parents=True, exist_ok=True)
+        shadow = local / "misc_files" / "shadow"
+        if not shadow.exists():
+            shadow.write_text("root:stub\n")
+        key = local / "misc_files" / "ssh_host_ed25519_key"
+        if not key.exists():
+            key.write_bytes(os.urandom(32))
+        return 0
+    if step in PART_TYPES:
+        if not (local / "misc_files" / "shadow").exists():
+            print(f"stub: step {step} needs the shared inputs", file=sys.stderr)
+            return 1
+        out.mkdir(exist_ok=True)
+        seed = hashlib.sha256((step + "\0".join(opts)).encode()).digest()
+        (out / f"{step}.img").write_bytes(seed * (PART_KB * 1024 // len(seed)))
+        return 0
+    if step == "assemble":
+        out.mkdir(exist_ok=True)
+        mbr = bytearray(512)
+        lba = 2048
+        body = b""
+        for i, part in enumerate(PART_TYPES):
+            data = (Path(parts_dirs[i]) / f"{part}.img").read_bytes()
+            sectors = len(data) // 512
+            struct.pack_into("<4xB3xII", mbr, 446 + i * 16, PART_TYPES[part], lba, sectors)
+            body += data
+            lba += sectors
+        mbr[510:512] = b"\x55\xaa"
+        with open(out / f"{image_name(opts)}.img", "wb") as f:
+            f.write(mbr)
+            f.seek(2048 * 512)
+            f.write(body)
+        return 0
+    print(f"stub: unknown step {step}", file=sys.stderr)
+    return 2
+
+USAGE = f"""Usage: {Path(sys.argv[0]).name} [mkqnximage options] [--step=STEP [--parts=DIR:DIR:DIR]]
+
+Stand-in for mkqnximage; accepts and ignores its options.
+  --step=STEP    run only STEP, one of {"|".join(STEPS)}
+  --parts=DIRS   output/ directories of boot, system and data for --step=assemble
+"""
+
+def main():
+    if "--help" in sys.argv[1:]:
+        print(USAGE, end="")
+        return
+    step = None
+    parts_dirs = None
+    opts = []
+    for arg in sys.argv[1:]:
+        if arg.startswith("--step="):
+            step = arg.split("=", 1)[1]
+        elif arg.startswith("--parts="):
+            parts_dirs = arg.split("=", 1)[1].split(":")
+        else:
+            opts.append(arg)
+    if step is not None:
+        sys.exit(run_step(step, opts, parts_dirs))
+    for s in STEPS:
+        rc = run_step(s, opts, ["output"] * 3)
+        if rc:
+            sys.exit(rc)
+
+if __name__ == "__main__":
+    main()
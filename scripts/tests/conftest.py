@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+SCRIPTS = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SCRIPTS))
+
+@pytest.fixture
+def stub():
+    """Path of the stand-in mkqnximage step tool."""
+    return str(SCRIPTS / "stub_mkqnximage.py")
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """An empty project directory as the working directory, with a fast stub."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MKQNX_STUB_LATENCY", "shared=0,boot=0,system=0,data=0,assemble=0")
+    monkeypatch.delenv("MKQNX_STUB_FAIL", raising=False)
+    monkeypatch.delenv("MKQNX_STUB_WORK", raising=False)
+    return tmp_path
+
+@pytest.fixture
+def build(project, stub, tmp_path_factory):
+    """Returns a function running build_mkqnximage.py on the defconfig with the stub.
+
+    The stub is on PATH as mkqnximage and the partition sizes are fixed, so
+    --pipeline --step-tool=mkqnximage works too.
+    """
+    bin_dir = tmp_path_factory.mktemp("bin")
+    (bin_dir / "mkqnximage").symlink_to(stub)
+    config = (SCRIPTS.parent / "configs" / "defconfig").read_text()
+    config = config.replace('CONFIG_MKQNX_PART_SIZES="full"', 'CONFIG_MKQNX_PART_SIZES="64:64:64"')
+    (project / ".config").write_text(config)
+    env = dict(os.environ, PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+    for var in ("MKQNX_CACHE_URL", "MKQNX_METRICS_DIR", "MKQNX_METRICS_PUSH", "MKQNX_LOG_DIR", "MKQNX_CGROUP"):
+        env.pop(var, None)
+
+    def run(*args, **extra_env):
+        return subprocess.run([sys.executable, str(SCRIPTS / "build_mkqnximage.py"), "--no-preflight",
+                               *args, ".config"], cwd=project, env=dict(env, **extra_env),
+                              capture_output=True, text=True)
+    return run
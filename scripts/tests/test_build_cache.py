@@ -0,0 +1,69 @@
+import shutil
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from build_cache import CacheClient, CacheError, CacheHandler
+
+@pytest.fixture
+def server(tmp_path):
+    store = tmp_path / "build-cache"
+    store.mkdir()
+    handler = type("Handler", (CacheHandler,), {"store_dir": store, "log_message": lambda *a: None})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_store_skips_hidden_files(tmp_path, server):
+    out = tmp_path / "output"
+    (out / ".pipeline").mkdir(parents=True)
+    (out / "disk-qemu.img").write_bytes(b"image" * 1000)
+    (out / ".journal.json").write_text("{}")
+    client = CacheClient(server)
+    client.store("abc123", out)
+    manifest = client.lookup("abc123")
+    assert [f["name"] for f in manifest["files"]] == ["disk-qemu.img"]
+    client.fetch("abc123", manifest, tmp_path / "fetched")
+    assert (tmp_path / "fetched" / "disk-qemu.img").read_bytes() == b"image" * 1000
+
+GOOD = {"name": "disk-qemu.img", "size": 5, "sha256": "0" * 64}
+
+@pytest.mark.parametrize("manifest", [
+    [GOOD],
+    {"key": "abc123"},
+    {"files": ["disk-qemu.img"]},
+    {"files": [dict(GOOD, name="../../etc/passwd")]},
+    {"files": [dict(GOOD, name="/etc/passwd")]},
+    {"files": [dict(GOOD, name="..")]},
+    {"files": [dict(GOOD, name=".cache-partial")]},
+    {"files": [{"name": "disk-qemu.img"}]},
+    {"files": [dict(GOOD, size="5")]},
+    {"files": [dict(GOOD, sha256="nothex")]},
+    {"files": [GOOD, GOOD]},
+])
+def test_fetch_rejects_bad_manifests(tmp_path, manifest):
+    # The checks come before any request, so no server is needed.
+    with pytest.raises(CacheError):
+        CacheClient("http://127.0.0.1:9").fetch("abc123", manifest, tmp_path / "fetched")
+    assert not (tmp_path / "fetched").exists()
+
+def test_lookup_miss(server):
+    assert CacheClient(server).lookup("0123") is None
+
+def test_stored_build_is_a_hit(project, build, server):
+    # The first build creates the persistent local/ state the key depends on.
+    assert build().returncode == 0
+    first = build("--cache", server)
+    assert first.returncode == 0, first.stderr
+    assert "Build cache miss" in first.stdout
+    assert "Stored build in cache" in first.stdout
+    assert "could not store" not in first.stderr
+    image = (project / "output" / "disk-qemu.img").read_bytes()
+    shutil.rmtree(project / "output")
+    second = build("--cache", server)
+    assert second.returncode == 0, second.stderr
+    assert "Build cache hit" in second.stdout
+    assert (project / "output" / "disk-qemu.img").read_bytes() == image
@@ -0,0 +1,53 @@
+import json
+
+from build_journal import Journal
+
+def step_status(project):
+    return {name: entry["status"] for name, entry in
+            json.loads((project / "local" / ".journal.json").read_text())["steps"].items()}
+
+def reused(result):
+    return {line.split()[1].rstrip(":") for line in result.stdout.splitlines() if line.endswith(": up to date")}
+
+def started(result):
+    return {line.split()[1].rstrip(":") for line in result.stdout.splitlines() if line.endswith(": started")}
+
+def test_journal_is_kept_out_of_output(project, build):
+    assert build().returncode == 0
+    assert not (project / "output" / ".journal.json").exists()
+    assert step_status(project) == {"mkqnximage": "done"}
+    assert build("--resume").stdout.strip().endswith("Build is up to date.")
+
+def test_resume_restarts_from_failed_step(project, build):
+    failed = build("--pipeline", "--step-tool=mkqnximage", MKQNX_STUB_FAIL="system")
+    assert failed.returncode == 1
+    assert step_status(project)["system"] == "failed"
+    assert "--resume" in failed.stderr
+
+    resumed = build("--pipeline", "--step-tool=mkqnximage", "--resume")
+    assert resumed.returncode == 0, resumed.stderr
+    assert "resuming the build that failed in step system" in resumed.stdout
+    assert reused(resumed) == {"shared", "boot", "data"}
+    assert started(resumed) == {"system", "assemble"}
+    assert (project / "output" / "disk-qemu.img").exists()
+
+    # The reused shared step was rehashed after its state was collected.
+    again = build("--pipeline", "--step-tool=mkqnximage", "--resume")
+    assert again.returncode == 0, again.stderr
+    assert started(again) == set()
+    assert "resuming the build that failed" not in again.stdout
+    assert reused(again) == {"shared", "boot", "system", "data", "assemble"}
+
+def test_from_step_reruns_downstream(project, build):
+    assert build("--pipeline", "--step-tool=mkqnximage").returncode == 0
+    result = build("--pipeline", "--step-tool=mkqnximage", "--from-step=system")
+    assert result.returncode == 0, result.stderr
+    assert started(result) == {"system", "assemble"}
+    assert build("--pipeline", "--step-tool=mkqnximage", "--from-step=nope").returncode == 2
+
+def test_changed_artifact_is_not_reusable(project, build):
+    assert build("--pipeline", "--step-tool=mkqnximage").returncode == 0
+    (project / "output/.pipeline/data/output/data.img").write_bytes(b"damaged")
+    result = build("--pipeline", "--step-tool=mkqnximage", "--resume")
+    assert started(result) == {"data", "assemble"}
+    assert Journal(project / "local" / ".journal.json").steps["data"]["status"] == "done"
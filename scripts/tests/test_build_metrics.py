@@ -0,0 +1,88 @@
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from build_metrics import Metrics, ProcessSampler, bump_counters
+
+def test_render_text_format():
+    m = Metrics("mkqnx_build", {"config": "defconfig"})
+    m.gauge("image_bytes", 1024, "Size of each file.", file='a"b.img')
+    m.counter("cache_lookups", 3, "Cache lookups.")
+    assert m.render() == (
+        "# HELP mkqnx_image_bytes Size of each file.\n"
+        "# TYPE mkqnx_image_bytes gauge\n"
+        'mkqnx_image_bytes{config="defconfig",file="a\\"b.img"} 1024\n'
+        "# HELP mkqnx_cache_lookups_total Cache lookups.\n"
+        "# TYPE mkqnx_cache_lookups_total counter\n"
+        'mkqnx_cache_lookups_total{config="defconfig"} 3\n')
+
+def test_sampler_runs_are_merged():
+    m = Metrics("mkqnx_build")
+    for rss, cpu in ((100, 1.5), (300, 2.0)):
+        s = ProcessSampler(0)
+        s.peak_rss = rss
+        s._cpu = {1: cpu}
+        s._io = {1: (10, 20)}
+        s.export(m, "mkqnximage")
+    text = m.render()
+    assert text.count('{process="mkqnximage"}') == 5
+    assert 'mkqnx_process_runs{process="mkqnximage"} 2\n' in text
+    assert 'mkqnx_process_peak_rss_bytes{process="mkqnximage"} 300\n' in text
+    assert 'mkqnx_process_cpu_seconds{process="mkqnximage"} 3.5\n' in text
+    assert 'mkqnx_process_write_bytes{process="mkqnximage"} 40\n' in text
+
+def test_unmerged_gauges_keep_every_sample():
+    m = Metrics("mkqnx_build")
+    m.gauge("build_step_seconds", 1, "Step time.", step="boot")
+    m.gauge("build_step_seconds", 2, "Step time.", step="system")
+    assert len(m.families["mkqnx_build_step_seconds"]["samples"]) == 2
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="samples /proc")
+def test_process_sampler_sees_children():
+    code = "import subprocess, sys; subprocess.run([sys.executable, '-c', 'b = bytearray(64 << 20); sum(range(3 * 10**6))'])"
+    proc = subprocess.Popen([sys.executable, "-c", code])
+    sampler = ProcessSampler(proc.pid, interval=0.01)
+    sampler.start()
+    proc.wait()
+    sampler.stop()
+    assert sampler.samples > 1
+    assert sampler.peak_rss > 64 << 20
+    assert sampler.cpu_seconds > 0
+
+def test_textfile_and_counters(tmp_path):
+    m = Metrics("mkqnx_vm")
+    m.gauge("vm_boot_timed_out", False, "Whether the run hit its timeout.")
+    assert m.emit(directory=tmp_path) == []
+    assert (tmp_path / "mkqnx_vm.prom").read_text() == m.render()
+    assert [p.name for p in tmp_path.iterdir()] == ["mkqnx_vm.prom"]
+    bump_counters(tmp_path, "mkqnx_build", lookups=1)
+    assert bump_counters(tmp_path, "mkqnx_build", lookups=1, hits=1) == {"lookups": 2, "hits": 1}
+
+def test_push(tmp_path):
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_PUT(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            received.append((self.path, self.headers["Content-Type"], body.decode()))
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        m = Metrics("mkqnx_build")
+        m.gauge("mkqnximage_exit_code", 0, "Exit code.")
+        assert m.emit(push_url=f"http://127.0.0.1:{httpd.server_port}/") == []
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    assert received == [("/metrics/job/mkqnx_build", "text/plain; version=0.0.4", m.render())]
+    assert m.emit(push_url=f"http://127.0.0.1:{httpd.server_port}") != []
@@ -0,0 +1,42 @@
+import re
+import subprocess
+import sys
+
+from buildlog import LogWriter, load_indexes, read_frame, required_trigrams, search_build
+from conftest import SCRIPTS
+
+TEE = """
+import subprocess, sys
+from buildlog import LogWriter, Tee
+writer = LogWriter({"config": "test"}, sys.argv[1])
+with Tee(writer):
+    print("to stdout")
+    print("to stderr", file=sys.stderr)
+    subprocess.call(["sh", "-c", "echo child stdout; echo child stderr >&2"])
+writer.close(0)
+"""
+
+def archived(log_dir):
+    [idx] = load_indexes(log_dir)
+    return "".join(read_frame(log_dir, idx, f) for f in idx["frames"])
+
+def test_tee_keeps_the_streams_apart(tmp_path):
+    result = subprocess.run([sys.executable, "-c", TEE, str(tmp_path)], cwd=SCRIPTS,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines() == ["to stdout", "child stdout"]
+    assert result.stderr.splitlines() == ["to stderr", "child stderr"]
+    assert sorted(archived(tmp_path).splitlines()) == ["child stderr", "child stdout", "to stderr", "to stdout"]
+
+def test_search_skips_frames_by_bloom_filter(tmp_path):
+    writer = LogWriter({"config": "test"}, tmp_path)
+    for i in range(60000):
+        writer.write(f"line {i}: compiling module_{i % 97}.c\n".encode())
+    writer.write(b"error: undefined reference to `frobnicate'\n")
+    writer.close(1)
+    [idx] = load_indexes(tmp_path)
+    assert idx["lines"] == 60001 and idx["returncode"] == 1 and len(idx["frames"]) > 1
+    grams = required_trigrams("undefined reference to .frobnicate")
+    matches, read = search_build(tmp_path, idx, re.compile("undefined reference to .frobnicate"), grams)
+    assert matches == [(60001, "error: undefined reference to `frobnicate'")]
+    assert read < len(idx["frames"])
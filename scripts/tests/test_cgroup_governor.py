@@ -0,0 +1,104 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from cgroup_governor import CgroupError, Governor, io_max_line, parse_size, read_psi
+from config_parser import bool_of_env
+
+@pytest.fixture
+def root(tmp_path):
+    """A directory imitating the cgroup v2 root."""
+    root = tmp_path / "cgroup"
+    root.mkdir()
+    (root / "cgroup.controllers").write_text("cpu io memory pids\n")
+    (root / "cgroup.subtree_control").write_text("")
+    return root
+
+def test_enter_applies_limits(root):
+    gov = Governor(cpu_weight=50, memory_high="512M", root=root)
+    gov.enter("b1")
+    cg = root / "mkqnx.slice" / "b1"
+    assert (root / "cgroup.subtree_control").read_text() == "+cpu +io +memory\n"
+    assert (cg / "cpu.weight").read_text() == "50\n"
+    assert (cg / "memory.high").read_text() == f"{512 * 1024 * 1024}\n"
+    assert (cg / "cgroup.procs").read_text() == f"{os.getpid()}\n"
+
+def test_failed_setup_removes_the_cgroup(root):
+    gov = Governor(io_max="bogus=1", root=root)
+    with pytest.raises(CgroupError, match="io.max"):
+        gov.enter("b1")
+    assert not (root / "mkqnx.slice" / "b1").exists()
+    assert gov.path is None and gov.leave() == {}
+
+def test_failed_setup_keeps_an_existing_cgroup(root):
+    (root / "mkqnx.slice" / "b1").mkdir(parents=True)
+    with pytest.raises(CgroupError):
+        Governor(memory_high="lots", root=root).enter("b1")
+    assert (root / "mkqnx.slice" / "b1").is_dir()
+
+def test_enter_needs_a_hierarchy(tmp_path):
+    with pytest.raises(CgroupError, match="no cgroup v2"):
+        Governor(root=tmp_path).enter()
+
+def test_stats(root):
+    gov = Governor(root=root)
+    gov.enter("b1")
+    cg = root / "mkqnx.slice" / "b1"
+    (cg / "cpu.stat").write_text("usage_usec 2500000\nuser_usec 2000000\n")
+    (cg / "memory.peak").write_text("1048576\n")
+    (cg / "io.stat").write_text("8:0 rbytes=100 wbytes=200 rios=1 wios=2\n8:16 rbytes=1 wbytes=2\n")
+    assert gov.stats() == {"cpu_seconds": 2.5, "memory_peak_bytes": 1048576,
+                           "io_read_bytes": 101, "io_write_bytes": 202}
+
+def test_stub_workload_is_accounted(project, stub, root, monkeypatch):
+    """Runs the stub's real workload in the build's cgroup and reads it back through leave().
+
+    The fake hierarchy has no kernel behind it, so the child's rusage is
+    written to cpu.stat, memory.peak and io.stat the way the kernel would.
+    """
+    gov = Governor(root=root)
+    gov.enter("b1")
+    cg = gov.path
+    monkeypatch.setenv("MKQNX_STUB_WORK", "cpu=0.2,mem=32M,io=4M")
+    proc = subprocess.Popen([sys.executable, stub, "--step=shared"])
+    _, status, ru = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    assert proc.returncode == 0
+    if not ru.ru_oublock:
+        gov.leave()
+        pytest.skip("no block I/O accounting on this filesystem")
+    (cg / "cpu.stat").write_text(f"usage_usec {int((ru.ru_utime + ru.ru_stime) * 1e6)}\n")
+    (cg / "memory.peak").write_text(f"{ru.ru_maxrss * 1024}\n")
+    (cg / "io.stat").write_text(f"8:0 rbytes={ru.ru_inblock * 512} wbytes={ru.ru_oublock * 512} rios=0 wios=0\n")
+    usage = gov.leave()
+    assert usage["cpu_seconds"] >= 0.2
+    assert usage["memory_peak_bytes"] >= 32 * 1024 ** 2
+    assert usage["io_write_bytes"] >= 4 * 1024 ** 2
+    assert (project / "local" / "misc_files" / "shadow").exists()
+
+def test_admit_waits_for_pressure(tmp_path):
+    psi = tmp_path / "pressure"
+    psi.mkdir()
+    for r in ("cpu", "io", "memory"):
+        (psi / r).write_text("some avg10=1.00 avg60=0.50 avg300=0.10 total=1\n")
+    assert read_psi("cpu", psi) == 1.0
+    assert Governor(psi_limit=5, psi_dir=psi).admit(timeout=0)
+    (psi / "io").write_text("some avg10=40.00 avg60=0.50 avg300=0.10 total=1\n")
+    assert not Governor(psi_limit=5, psi_dir=psi).admit(timeout=0, log=lambda msg: None)
+
+def test_sizes_and_io_max():
+    assert parse_size("2G") == 2 * 1024 ** 3
+    assert io_max_line("8:0 wbps=1M riops=100") == "8:0 wbps=1048576 riops=100"
+    with pytest.raises(CgroupError):
+        io_max_line("8:0 xbps=1")
+
+@pytest.mark.parametrize("value,expected", [("1", True), ("y", True), ("yes", True), ("0", False),
+                                            ("n", False), ("", False), (None, False)])
+def test_cgroup_env_flag(monkeypatch, value, expected):
+    if value is None:
+        monkeypatch.delenv("MKQNX_CGROUP", raising=False)
+    else:
+        monkeypatch.setenv("MKQNX_CGROUP", value)
+    assert bool_of_env("MKQNX_CGROUP") is expected
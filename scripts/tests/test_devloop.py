@@ -0,0 +1,30 @@
+import argparse
+import os
+
+import pytest
+
+from devloop import DevloopError, NfsServer, devloop
+
+def test_export_maps_everything_to_the_invoking_user(tmp_path, monkeypatch):
+    monkeypatch.delenv("SUDO_UID", raising=False)
+    server = NfsServer("unfsd", tmp_path, ["127.0.0.1", "192.168.1.20"], tmp_path)
+    squash = f"all_squash,anonuid={os.getuid()},anongid={os.getgid()}"
+    assert server.options("127.0.0.1") == "rw,insecure," + squash
+    assert server.options("192.168.1.20") == "rw," + squash
+    assert "no_root_squash" not in server.options("localhost")
+
+def test_export_owner_under_sudo(monkeypatch):
+    monkeypatch.setattr(os, "geteuid", lambda: 0)
+    monkeypatch.setenv("SUDO_UID", "1234")
+    monkeypatch.setenv("SUDO_GID", "567")
+    assert NfsServer.owner() == (1234, 567)
+
+def test_bad_source_creates_nothing(project):
+    args = argparse.Namespace(config=".config", export=None, src=["missing"], server="ssh", ssh=None)
+    with pytest.raises(DevloopError, match="source directory not found"):
+        devloop(args)
+    (project / "src").mkdir()
+    args.src = ["src"]
+    with pytest.raises(DevloopError, match="no NFS server"):
+        devloop(args)
+    assert not (project / "devloop").exists()
@@ -0,0 +1,34 @@
+import struct
+
+from disk_image import SECTOR, disk_images, read_partitions
+
+def make_disk(path, entries, signature=b"\x55\xaa"):
+    mbr = bytearray(SECTOR)
+    for i, (ptype, lba, count) in enumerate(entries):
+        struct.pack_into("<4xB3xII", mbr, 446 + i * 16, ptype, lba, count)
+    mbr[510:512] = signature
+    path.write_bytes(bytes(mbr) + bytes(4 * SECTOR))
+
+def test_read_partitions(tmp_path):
+    disk = tmp_path / "disk-qemu.img"
+    make_disk(disk, [(0x0c, 1, 2), (0xb1, 3, 4), (0, 0, 0), (0xb1, 7, 1)])
+    parts = read_partitions(disk)
+    assert [(p.name, p.type, p.start, p.size, p.end) for p in parts] == [
+        ("boot", 0x0c, SECTOR, 2 * SECTOR, 3 * SECTOR),
+        ("system", 0xb1, 3 * SECTOR, 4 * SECTOR, 7 * SECTOR),
+        ("part4", 0xb1, 7 * SECTOR, SECTOR, 8 * SECTOR),
+    ]
+
+def test_no_signature_no_partitions(tmp_path):
+    disk = tmp_path / "disk-qemu.img"
+    make_disk(disk, [(0x0c, 1, 2)], signature=b"\0\0")
+    assert read_partitions(disk) == []
+    (tmp_path / "short.img").write_bytes(b"\x55\xaa")
+    assert read_partitions(tmp_path / "short.img") == []
+
+def test_disk_images(tmp_path):
+    make_disk(tmp_path / "disk-qemu.img", [(0x0c, 1, 2)])
+    make_disk(tmp_path / "other.img", [], signature=b"\0\0")
+    (tmp_path / "ifs.bin").write_bytes(b"\0" * 100)
+    assert [p.name for p in disk_images(tmp_path)] == ["disk-qemu.img"]
+    assert list(disk_images(tmp_path / "missing")) == []
@@ -0,0 +1,68 @@
+import io
+
+import pytest
+
+from fs_bench import config_names, parse_console, parse_time, report, summarize, table
+
+def console(config, open_system, read_seconds, runs=3, nop=0.1, end=True):
+    """A recorded console log with the payload's lines among boot noise."""
+    lines = ["Startup complete", "login: ",
+             f'FSBENCH begin version=1 config={config} options="union qcfs=no ro=none secure-data=no" n=1000 repeat={runs}']
+    for run in range(1, runs + 1):
+        lines += [f'FSBENCH test=nop target=none path=- n=1000 bytes=0 run={run} time="{nop:.2f}s real 0.05s user 0.00s system"',
+                  f'FSBENCH test=open target=system path=/system/lib/libc.so.6 n=1000 bytes=0 run={run} '
+                  f'time="{open_system:.2f}s real 0.01s user 0.20s system"',
+                  f'FSBENCH test=read target=data path=/data/fsbench/blob n=20 bytes={20 * 2**20} run={run} '
+                  f'time="{read_seconds:.2f}s real 0.00s user 0.10s system"']
+        if run == 1:
+            lines += ["FSBENCH test=exec target=data path=/data/fsbench/exec error=not-executable",
+                      "FSBENCH test=open target=ifs error=no-file"]
+    if end:
+        lines.append("FSBENCH end")
+    return "\r\n".join(lines) + "\r\n"
+
+def test_nop_loop_is_subtracted():
+    summary = summarize(parse_console(console("a", open_system=0.6, read_seconds=0.5)))
+    # (0.6 s - 0.1 s) / 1000 operations
+    assert summary[("open", "system")] == pytest.approx(500.0)
+    assert summary[("read", "data")] == pytest.approx(40.0)
+
+def test_error_rows():
+    parsed = parse_console(console("a", 0.6, 0.5))
+    assert [e["error"] for e in parsed["errors"]] == ["not-executable", "no-file"]
+    summary = summarize(parsed)
+    assert summary[("exec", "data")] == "not-executable"
+    assert "not-executable" in table([("a", summary)])
+
+def test_reboot_restarts_the_results():
+    parsed = parse_console(console("a", 5.0, 5.0, end=False) + console("a", 0.6, 0.5))
+    assert parsed["complete"] and len(parsed["samples"]) == 9
+    assert summarize(parsed)[("open", "system")] == pytest.approx(500.0)
+
+def test_time_formats():
+    assert parse_time("0.52s real 0.01s user 0.20s system") == 0.52
+    assert parse_time("real 1m2.500s user 0m0.010s sys 0m0.200s") == 62.5
+    assert parse_time("garbage") is None
+
+def test_compare_two_configs(tmp_path):
+    (tmp_path / "base.log").write_text(console("base", open_system=0.6, read_seconds=0.5))
+    (tmp_path / "qcfs.log").write_text(console("qcfs", open_system=0.35, read_seconds=1.0))
+    out = io.StringIO()
+    assert report([tmp_path / "base.log", tmp_path / "qcfs.log"], out) == 0
+    rows = {ln.split("  ")[0]: ln for ln in out.getvalue().splitlines()}
+    # 500 -> 250 us per open is twice as fast; 40 -> 20 MiB/s half as fast.
+    assert "500.0" in rows["open system (us/op)"] and "250.0 (+100%)" in rows["open system (us/op)"]
+    assert "40.0" in rows["read data (MiB/s)"] and "20.0 (-50%)" in rows["read data (MiB/s)"]
+    assert rows["exec data (us/op)"].split()[-2:] == ["not-executable", "not-executable"]
+
+def test_log_without_results(tmp_path):
+    (tmp_path / "empty.log").write_text("login: \n")
+    assert report([tmp_path / "empty.log"], io.StringIO()) == 1
+
+def test_config_names_are_unique(tmp_path):
+    for d in ("a", "b"):
+        (tmp_path / d).mkdir()
+        (tmp_path / d / "defconfig").write_text("")
+    assert config_names([tmp_path / "a/defconfig", tmp_path / "b/defconfig", tmp_path / "a/defconfig"]) == \
+        ["a-defconfig", "b-defconfig", "a-defconfig-2"]
+    assert config_names([tmp_path / ".config", tmp_path / "a/defconfig"]) == ["config", "defconfig"]
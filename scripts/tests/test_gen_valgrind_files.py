@@ -0,0 +1,99 @@
+import os
+import struct
+
+import pytest
+
+import gen_valgrind_files
+from gen_valgrind_files import closure, read_elf, scan
+
+def make_elf(path, soname=None, needed=(), symtab=True, e_type=3):
+    """Writes a minimal little-endian ELF64 file with a .dynamic section."""
+    dynstr = b"\0"
+    dyn = []
+    for tag, name in [(1, n) for n in needed] + ([(14, soname)] if soname else []):
+        dyn.append(struct.pack("<qQ", tag, len(dynstr)))
+        dynstr += name.encode() + b"\0"
+    dynamic = b"".join(dyn) + struct.pack("<qQ", 0, 0)
+    names = [".shstrtab", ".dynstr", ".dynamic"] + ([".symtab"] if symtab else [])
+    shstrtab = b"\0"
+    offsets = []
+    for n in names:
+        offsets.append(len(shstrtab))
+        shstrtab += n.encode() + b"\0"
+    blobs = [shstrtab, dynstr, dynamic] + ([b"\0" * 24] if symtab else [])
+    types = [3, 3, 6] + ([2] if symtab else [])
+    links = [0, 0, 2] + ([2] if symtab else [])
+
+    data = b""
+    sections = [struct.pack("<IIQQQQIIQQ", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)]
+    for name, typ, link, blob in zip(offsets, types, links, blobs):
+        sections.append(struct.pack("<IIQQQQIIQQ", name, typ, 0, 0, 64 + len(data), len(blob), link, 0, 1, 0))
+        data += blob
+    shoff = 64 + len(data)
+    header = b"\x7fELF\x02\x01\x01" + b"\0" * 9 + struct.pack(
+        "<HHIQQQIHHHHHH", e_type, 62, 1, 0, 0, shoff, 0, 64, 0, 0, 64, len(sections), 1)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(header + data + b"".join(sections))
+
+def test_read_elf(tmp_path):
+    make_elf(tmp_path / "libfoo.so.1", soname="libfoo.so.1", needed=["libc.so.6", "libm.so.3"])
+    assert read_elf(tmp_path / "libfoo.so.1") == {
+        "needed": ["libc.so.6", "libm.so.3"], "soname": "libfoo.so.1",
+        "debuglink": False, "debuginfo": False, "symtab": True,
+    }
+    make_elf(tmp_path / "app", needed=["libfoo.so.1"], symtab=False, e_type=2)
+    assert read_elf(tmp_path / "app")["symtab"] is False
+
+def test_read_elf_rejects_other_files(tmp_path):
+    (tmp_path / "script").write_text("#!/bin/sh\n" + "echo hello\n" * 10)
+    make_elf(tmp_path / "object.o", e_type=1)
+    broken = tmp_path / "broken"
+    make_elf(broken, needed=["libc.so.6"])
+    broken.write_bytes(broken.read_bytes()[:80])
+    assert read_elf(tmp_path / "script") is None
+    assert read_elf(tmp_path / "object.o") is None
+    assert read_elf(broken) is None
+
+@pytest.mark.skipif(not os.path.exists("/bin/sh"), reason="no host binaries")
+def test_read_host_elf():
+    info = read_elf(os.path.realpath("/bin/sh"))
+    if info is None:
+        pytest.skip("/bin/sh is not an ELF file")
+    assert any(lib.startswith("libc.") for lib in info["needed"])
+
+@pytest.fixture
+def repo(project):
+    root = project / "repo"
+    make_elf(root / "usr/lib/libc.so.6", soname="libc.so.6")
+    os.symlink("libc.so.6", root / "usr/lib/libc.so")
+    make_elf(root / "usr/lib/libfoo.so.1.2", soname="libfoo.so.1", needed=["libc.so.6"])
+    make_elf(root / "usr/bin/app", needed=["libfoo.so.1", "libmissing.so"], e_type=2)
+    return root
+
+def test_closure_prefers_real_files_over_dev_symlinks(repo):
+    elfs = scan([repo], 2)
+    paths, missing = closure(elfs, ["app"])
+    assert [elfs[p]["target"] for p in paths] == ["/usr/bin/app", "/usr/lib/libfoo.so.1.2", "/usr/lib/libc.so.6"]
+    assert missing == ["libmissing.so"]
+    # Naming the development link resolves to the file it points to.
+    paths, _ = closure(elfs, ["libc.so"])
+    assert [elfs[p]["target"] for p in paths] == ["/usr/lib/libc.so.6"]
+
+def test_scan_cache_rereads_only_changed_files(repo, monkeypatch, capsys):
+    scan([repo], 2)
+    assert gen_valgrind_files.CACHE_PATH.exists()
+    assert "(4 read, 0 cached)" in capsys.readouterr().err
+
+    reads = []
+    real_read = gen_valgrind_files.read_elf
+    monkeypatch.setattr(gen_valgrind_files, "read_elf", lambda p: reads.append(p) or real_read(p))
+    scan([repo], 2)
+    assert reads == []
+
+    app = repo / "usr/bin/app"
+    make_elf(app, needed=["libc.so.6"], e_type=2)
+    st = app.stat()
+    os.utime(app, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    elfs = scan([repo], 2)
+    assert reads == [str(app)]
+    assert elfs[str(app)]["needed"] == ["libc.so.6"]
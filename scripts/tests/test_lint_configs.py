@@ -0,0 +1,39 @@
+import subprocess
+import sys
+
+import pytest
+
+from conftest import SCRIPTS
+from lint_configs import ROOT, lint, read_entries
+from kconfig_symbols import load_kconfig
+
+@pytest.fixture(scope="module")
+def symbols():
+    return load_kconfig(ROOT / "Kconfig")
+
+def lint_with(tmp_path, symbols, old, new):
+    text = (ROOT / "configs" / "defconfig").read_text()
+    assert old in text
+    path = tmp_path / "config"
+    path.write_text(text.replace(old, new))
+    return [(f.severity, f.message) for f in lint(path, symbols, read_entries(path))]
+
+def test_defconfig_is_clean(tmp_path, symbols):
+    assert lint_with(tmp_path, symbols, "\n", "\n") == []
+
+def test_unknown_symbol(tmp_path, symbols):
+    findings = lint_with(tmp_path, symbols, "CONFIG_MKQNX_CPU=2\n", "CONFIG_MKQNX_CPU=2\nCONFIG_MKQNX_CPUS=2\n")
+    assert ("error", "unknown symbol MKQNX_CPUS") in findings
+
+def test_invalid_cpu(tmp_path, symbols):
+    findings = lint_with(tmp_path, symbols, "CONFIG_MKQNX_CPU=2\n", "CONFIG_MKQNX_CPU=9\n")
+    assert any(sev == "error" and "MKQNX_CPU" in msg for sev, msg in findings)
+
+def test_invalid_ram(tmp_path, symbols):
+    findings = lint_with(tmp_path, symbols, 'CONFIG_MKQNX_RAM="1G"', 'CONFIG_MKQNX_RAM="1 gig"')
+    assert ("error", 'MKQNX_RAM="1 gig" is not a size like 512M or 1G') in findings
+
+def test_shipped_configs_pass():
+    r = subprocess.run([sys.executable, SCRIPTS / "lint_configs.py", "--strict"], capture_output=True, text=True)
+    assert r.returncode == 0, r.stdout
+    assert r.stdout == ""
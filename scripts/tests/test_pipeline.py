@@ -0,0 +1,117 @@
+import os
+import struct
+import sys
+
+import pytest
+
+from image_pipeline import collect, image_steps, multiarch_steps, supports_steps
+from pipeline import Pipeline, PipelineError, Step
+
+def finish_order(pipeline, **kw):
+    finished = []
+    ok = pipeline.run(on_finish=lambda step, ok: finished.append((step.name, ok)), **kw)
+    return ok, finished
+
+def test_order_puts_dependencies_first(project):
+    steps = [Step("c", ["a", "b"], ["true"], "c"), Step("b", ["a"], ["true"], "b"), Step("a", [], ["true"], "a")]
+    assert Pipeline(steps).order == ["a", "b", "c"]
+
+def test_unknown_dependency_and_cycle_are_rejected(project):
+    with pytest.raises(PipelineError, match="unknown step"):
+        Pipeline([Step("a", ["x"], ["true"], "a")])
+    with pytest.raises(PipelineError, match="cycle"):
+        Pipeline([Step("a", ["b"], ["true"], "a"), Step("b", ["a"], ["true"], "b")])
+
+def test_downstream(project, stub):
+    p = Pipeline(image_steps(stub, ["--type=qemu"]))
+    assert p.downstream("system") == {"system", "assemble"}
+    assert p.downstream("shared") == set(p.order)
+
+def test_image_steps_build_the_disk(project, stub):
+    p = Pipeline(image_steps(stub, ["--type=qemu"]))
+    ok, finished = finish_order(p, jobs=3)
+    assert ok and p.failed is None
+    names = [n for n, _ in finished]
+    assert names[0] == "shared" and names[-1] == "assemble"
+    assert sorted(names[1:4]) == ["boot", "data", "system"]
+    collect()
+    disk = (project / "output" / "disk-qemu.img").read_bytes()
+    assert disk[510:512] == b"\x55\xaa"
+    assert [struct.unpack_from("<4xB", disk, 446 + i * 16)[0] for i in range(3)] == [0x0c, 0xb1, 0xb1]
+    assert (project / "local" / "misc_files" / "shadow").read_text() == "root:stub\n"
+
+def test_reused_steps_are_skipped(project, stub):
+    Pipeline(image_steps(stub, ["--type=qemu"])).run()
+    p = Pipeline(image_steps(stub, ["--type=qemu"]))
+    ok, finished = finish_order(p, reuse=lambda step: step.name != "system")
+    assert ok
+    assert [n for n, _ in finished] == ["system"]
+    assert p.reused == ["shared", "boot", "data", "assemble"]
+    assert p.steps["boot"].returncode is None
+
+def test_failure_stops_dependent_steps(project, stub, monkeypatch):
+    monkeypatch.setenv("MKQNX_STUB_FAIL", "system")
+    p = Pipeline(image_steps(stub, ["--type=qemu"]))
+    ok, finished = finish_order(p)
+    assert not ok
+    assert p.failed == "system"
+    assert ("system", False) in finished
+    assert p.steps["assemble"].returncode is None
+    assert "step system failed" in p.steps["system"].log.read_text()
+
+def test_failed_shared_step_runs_nothing_else(project, stub, monkeypatch):
+    monkeypatch.setenv("MKQNX_STUB_FAIL", "shared")
+    p = Pipeline(image_steps(stub, ["--type=qemu"]))
+    ok, finished = finish_order(p)
+    assert not ok and p.failed == "shared"
+    assert finished == [("shared", False)]
+
+def test_missing_tool_fails_the_step(project):
+    p = Pipeline([Step("a", [], [str(project / "no-such-tool")], "a"), Step("b", ["a"], ["true"], "b")])
+    assert not p.run()
+    assert p.failed == "a" and p.steps["b"].returncode is None
+
+def test_multiarch_shares_arch_independent_steps(project, stub):
+    opts = {"x86_64": ["--type=qemu", "--arch=x86_64"], "aarch64le": ["--type=qemu", "--arch=aarch64le"]}
+    steps, shared = multiarch_steps(stub, opts)
+    assert shared == ["shared", "data"]
+    p = Pipeline(steps)
+    assert not any(n.endswith("/data") or n.endswith("/shared") for n in p.order)
+    assert p.run(jobs=4)
+    for arch in opts:
+        collect(project / "output/.pipeline" / arch, f"output/{arch}", shared_dir=project / "output/.pipeline/shared")
+        assert (project / "output" / arch / "disk-qemu.img").exists()
+
+def test_pipeline_refuses_tools_without_steps(build, stub, tmp_path):
+    stock = tmp_path / "stock-mkqnximage"
+    stock.write_text("#!/bin/sh\necho 'Usage: mkqnximage [--type=TYPE] [--arch=ARCH] [--force]'\n"
+                     "test \"$1\" = --help || touch built\n")
+    stock.chmod(0o755)
+    result = build("--pipeline", f"--step-tool={stock}")
+    assert result.returncode == 1
+    assert "does not implement the --step protocol" in result.stderr
+    assert not (tmp_path / "built").exists()
+    assert supports_steps(stub)
+    assert not supports_steps(str(stock))
+
+def test_multiarch_shares_work_with_a_step_tool(project, build):
+    result = build("--archs=x86_64,aarch64le")
+    assert result.returncode == 0, result.stderr
+    assert "[multi-arch] shared steps (shared, data)" in result.stdout
+    for arch in ("x86_64", "aarch64le"):
+        assert (project / "output" / arch / "disk-qemu.img").exists()
+
+def test_multiarch_with_stock_mkqnximage_claims_no_sharing(project, build, stub, tmp_path_factory):
+    bin_dir = tmp_path_factory.mktemp("stock")
+    (bin_dir / "mkqnximage").write_text(f"#!/bin/sh\ntest \"$1\" = --help && echo 'Usage: mkqnximage [--type=TYPE]' "
+                                        f"&& exit 0\nexec {sys.executable} {stub} \"$@\"\n")
+    (bin_dir / "mkqnximage").chmod(0o755)
+    result = build("--archs=x86_64,aarch64le", PATH=f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    assert result.returncode == 0, result.stderr
+    assert "mkqnximage has no --step support: 2 complete builds ran concurrently and nothing was shared" \
+        in result.stdout
+    assert "saving" not in result.stdout
+    assert "each image has its own users, passwords and keys" in result.stdout
+    for arch in ("x86_64", "aarch64le"):
+        assert (project / "output" / arch / "disk-qemu.img").exists()
+    assert (project / "local" / "misc_files" / "shadow").exists()
@@ -0,0 +1,63 @@
+from preflight import check, check_options, parse_options, parse_values
+
+def caps(cpus=2, qemu_version=(8, 2, 0)):
+    tool = {"found": True, "path": "/usr/bin/tool", "version": list(qemu_version)}
+    return {"qemu-x86_64": tool, "qemu-aarch64": tool, "vbox": {"found": False}, "vmware": {"found": False},
+            "mkqnximage": {"found": True, "options": []}, "kvm": {"usable": True, "reason": "usable"},
+            "host": {"machine": "x86_64", "cpus": cpus}}
+
+def warnings(findings):
+    return [msg for level, msg in findings if level == "warning"]
+
+def test_cpu_count_does_not_depend_on_the_host():
+    cfg = {"MKQNX_CPU": "4", "MKQNX_TYPE_QEMU": "y"}
+    out, findings = check(cfg, caps(cpus=2))
+    assert out["MKQNX_CPU"] == "4"
+    assert any("exceeds the 2 host CPU(s)" in w for w in warnings(findings))
+
+def test_no_host_cpu_warning_for_images_run_elsewhere():
+    cfg = {"MKQNX_CPU": "4", "MKQNX_TYPE_VMWARE": "y"}
+    out, findings = check(cfg, caps(cpus=1))
+    assert out["MKQNX_CPU"] == "4"
+    assert not any("host CPU" in w for w in warnings(findings))
+
+def test_old_qemu_aarch64_only_warns():
+    cfg = {"MKQNX_CPU": "2", "MKQNX_ARCH_AARCH64LE": "y"}
+    out, findings = check(cfg, caps(cpus=8, qemu_version=(2, 11, 1)))
+    assert out["MKQNX_CPU"] == "2"
+    assert any("MKQNX_CPU=1" in w for w in warnings(findings))
+
+def test_out_of_range_cpu_is_adjusted():
+    out, findings = check({"MKQNX_CPU": "9"}, caps(cpus=16))
+    assert out["MKQNX_CPU"] == "2"
+    assert any("outside 1-4" in w for w in warnings(findings))
+
+HELP = """Usage: mkqnximage [options]
+  --type=qemu|vbox|vmware    kind of virtual machine
+  --qcfs=yes|no              compress /system (default: no)
+  --repos=<dir>:<dir>        where to look for binaries
+  --ram=SIZE|default         memory of the VM
+  --force                    rebuild everything
+"""
+
+def with_help(text):
+    c = caps()
+    c["mkqnximage"] = {"found": True, "options": parse_options(text), "values": parse_values(text)}
+    return c
+
+def test_parse_values():
+    assert parse_values(HELP) == {"type": ["qemu", "vbox", "vmware"], "qcfs": ["no", "yes"]}
+
+def test_unknown_options_and_values_are_errors():
+    cmd = ["mkqnximage", "--type=qemu", "--qcfs=zstd", "--repos=/a:/b", "--ram=2G", "--force", "--slm=yes"]
+    assert check_options(cmd, with_help(HELP)) == [
+        ("error", "this mkqnximage does not accept --qcfs=zstd; --qcfs takes no|yes"),
+        ("error", "this mkqnximage does not support --slm"),
+    ]
+
+def test_unreadable_help_only_warns():
+    findings = check_options(["mkqnximage", "--qcfs=zstd"], with_help("mkqnximage: cannot open license file\n"))
+    assert [level for level, _ in findings] == ["warning"]
+    findings = check_options(["mkqnximage", "--type=qemu"], with_help("See --manual for the options.\n"))
+    assert [level for level, _ in findings] == ["warning"]
+    assert check_options(["mkqnximage", "--qcfs=zstd"], caps() | {"mkqnximage": {"found": False}}) == []
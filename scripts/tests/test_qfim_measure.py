@@ -0,0 +1,45 @@
+import hashlib
+import subprocess
+import sys
+
+from conftest import SCRIPTS
+
+MANIFEST = "local/qfim/measurements.sha256"
+
+def qfim_config(project):
+    extra = project / "extra"
+    (extra / "bin").mkdir(parents=True)
+    (extra / "bin" / "app").write_bytes(b"app")
+    (extra / "etc.conf").write_bytes(b"conf")
+    config = project / ".config"
+    config.write_text(config.read_text().replace("# CONFIG_MKQNX_QFIM is not set", "CONFIG_MKQNX_QFIM=y")
+                      .replace('CONFIG_MKQNX_EXTRA_DIRS=""', f'CONFIG_MKQNX_EXTRA_DIRS="{extra}"'))
+
+def measure(project, *args):
+    return subprocess.run([sys.executable, SCRIPTS / "qfim_measure.py", "-c", ".config", *args],
+                          cwd=project, capture_output=True, text=True)
+
+def test_build_does_not_measure(project, build):
+    qfim_config(project)
+    result = build()
+    assert result.returncode == 0, result.stderr
+    assert not (project / MANIFEST).exists()
+    assert build("--qfim-measure").returncode == 2
+
+def test_measure_and_cache(project, build):
+    qfim_config(project)
+    result = measure(project)
+    assert result.returncode == 0, result.stderr
+    assert "Measured 2 files (2 hashed, 0 cached)" in result.stdout
+    lines = (project / MANIFEST).read_text().splitlines()
+    assert lines == [f"{hashlib.sha256(b'app').hexdigest()}  /bin/app",
+                     f"{hashlib.sha256(b'conf').hexdigest()}  /etc.conf"]
+    assert "(0 hashed, 2 cached)" in measure(project).stdout
+
+def test_measure_only_the_listed_files(project, build):
+    qfim_config(project)
+    (project / "system.files").write_text("/bin/app\n")
+    result = measure(project, "--list", "system.files")
+    assert result.returncode == 0, result.stderr
+    assert (project / MANIFEST).read_text().endswith("  /bin/app\n")
+    assert len((project / MANIFEST).read_text().splitlines()) == 1
@@ -0,0 +1,70 @@
+import subprocess
+import sys
+
+import pytest
+
+from config_parser import parse_config
+from conftest import SCRIPTS
+from ram_profile import MiB, analyse, format_ram, parse_console, parse_ram
+
+def console(ram, samples, packages="", rc=0, end=True):
+    """A recorded console log; samples are pidin info FreeMem fields."""
+    lines = ["Startup complete", f'RAMPROF begin version=1 config=test ram={ram} packages="{packages}"']
+    for i, mem in enumerate(samples):
+        lines.append(f"RAMPROF sample t={2 * i} CPU:X86_64 Release:8.0.0 FreeMem:{mem} BootTime:Oct 19 2026")
+    if rc is not None:
+        lines.append(f"RAMPROF workload rc={rc}")
+    if end:
+        lines.append("RAMPROF end")
+    return "\r\n".join(lines) + "\r\n"
+
+QNX8 = console("1G", ["846MB/1023MB", "700MB/1023MB", "800MB/1023MB"], "MKQNX_PYTHON")
+QNX7 = console("2G", ["1913Mb/2047Mb", "1500Mb/2047Mb"])
+
+def test_qnx8_freemem():
+    parsed = parse_console(QNX8)
+    assert parsed["samples"] == [(0, 846 * MiB, 1023 * MiB), (2, 700 * MiB, 1023 * MiB), (4, 800 * MiB, 1023 * MiB)]
+    assert parsed["info"]["packages"] == "MKQNX_PYTHON"
+    assert parsed["workload_rc"] == 0 and parsed["complete"]
+
+def test_qnx7_freemem():
+    parsed = parse_console(QNX7)
+    assert parsed["samples"] == [(0, 1913 * MiB, 2047 * MiB), (2, 1500 * MiB, 2047 * MiB)]
+
+def test_reboot_restarts_the_profile():
+    parsed = parse_console(console("1G", ["10MB/1023MB"], rc=None, end=False) + QNX8)
+    assert len(parsed["samples"]) == 3
+    assert analyse(parsed, 0.25)["peak"] == 323 * MiB
+
+def test_headroom_and_rounding():
+    figures = analyse(parse_console(QNX8), 0.25)
+    assert figures["configured"] == 1024 * MiB and figures["visible"] == 1023 * MiB
+    assert figures["idle"] == 177 * MiB and figures["peak"] == 323 * MiB and figures["peak_t"] == 2
+    # (323 MiB peak + 1 MiB the guest can't see) * 1.25 = 405 MiB, rounded up to 448 MiB.
+    assert figures["recommended"] == 448 * MiB
+    assert analyse(parse_console(QNX7), 0.25)["recommended"] == 704 * MiB
+    assert analyse(parse_console(QNX8), 0.0)["recommended"] == 384 * MiB
+    # Never below the minimum.
+    assert analyse(parse_console(console("1G", ["1000MB/1023MB"])), 0.25)["recommended"] == 256 * MiB
+
+def test_no_samples():
+    assert analyse(parse_console("RAMPROF begin ram=1G\r\n"), 0.25) is None
+
+@pytest.mark.parametrize("text,nbytes", [("1G", 1024 * MiB), ("512M", 512 * MiB), ("768", 768 * MiB), ("1.5G", None)])
+def test_ram_values(text, nbytes):
+    assert parse_ram(text) == nbytes
+    if nbytes is not None:
+        assert parse_ram(format_ram(nbytes)) == nbytes
+
+def test_write_round_trip(project):
+    config = (SCRIPTS.parent / "configs" / "defconfig").read_text()
+    (project / ".config").write_text(config)
+    (project / "qnx8.log").write_text(QNX8)
+    result = subprocess.run([sys.executable, str(SCRIPTS / "ram_profile.py"), "report", "qnx8.log",
+                             "-c", ".config", "--write"], cwd=project, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert "recommended MKQNX_RAM=448M" in result.stdout
+    assert parse_config(project / ".config")["MKQNX_RAM"] == "448M"
+    changed = [(a, b) for a, b in zip(config.splitlines(), (project / ".config").read_text().splitlines()) if a != b]
+    assert changed == [('CONFIG_MKQNX_RAM="1G"', 'CONFIG_MKQNX_RAM="448M"')]
+    assert not (project / "local" / ".ram-profile.json").exists()
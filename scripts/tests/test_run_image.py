@@ -0,0 +1,43 @@
+import subprocess
+import sys
+
+from conftest import SCRIPTS
+from run_image import run_vm
+
+CONSOLE = "import sys, time\nprint('Booting'); print('{prompt}', end='', flush=True)\ntime.sleep({sleep})\nprint('\\nafter login', flush=True)\n"
+
+def vm(prompt="qnx login: ", sleep=0):
+    return [sys.executable, "-c", CONSOLE.format(prompt=prompt, sleep=sleep)]
+
+def test_boot_to_login_and_log(tmp_path):
+    log = tmp_path / "console.log"
+    result = run_vm(vm(), log=log, echo=False)
+    assert result.returncode == 0
+    assert result.boot_to_login is not None
+    assert not result.timed_out
+    assert result.text == log.read_text() == "Booting\nqnx login: \nafter login\n"
+
+def test_until_stops_the_vm():
+    result = run_vm(vm(sleep=60), until="login:", echo=False)
+    assert result.matched
+    assert result.returncode != 0
+    assert "after login" not in result.text
+
+def test_timeout():
+    result = run_vm(vm(prompt="", sleep=60), until="login:", timeout=0.5, echo=False)
+    assert result.timed_out and not result.matched
+    assert result.boot_to_login is None
+
+def test_metrics_and_exit_status(tmp_path):
+    script = tmp_path / "console.py"
+    script.write_text(CONSOLE.format(prompt="login:", sleep=0))
+    cmd = f"{sys.executable} {script}"
+    r = subprocess.run([sys.executable, SCRIPTS / "run_image.py", "--cmd", cmd, "--until", "login:",
+                        "--metrics-dir", tmp_path], cwd=tmp_path, capture_output=True, text=True)
+    assert r.returncode == 0, r.stderr
+    prom = (tmp_path / "mkqnx_vm.prom").read_text()
+    assert "mkqnx_vm_boot_to_login_seconds{" in prom
+    assert 'mkqnx_vm_boot_timed_out{image="' + tmp_path.name + '"} 0' in prom
+    r = subprocess.run([sys.executable, SCRIPTS / "run_image.py", "--cmd", cmd, "--until", "never"],
+                       cwd=tmp_path, capture_output=True, text=True)
+    assert r.returncode == 1
@@ -0,0 +1,96 @@
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import staging
+from staging import KEPT_PATH, STATE_MAX, Workspace, absolutize_cfg, pick_workspace
+
+@pytest.fixture
+def shm_dirs(tmp_path, monkeypatch):
+    """Two tmpfs stand-ins, the first with 1 MiB and the second with 1 GiB free."""
+    small, big = tmp_path / "small", tmp_path / "big"
+    small.mkdir()
+    big.mkdir()
+    free = {str(small): 1 << 20, str(big): 1 << 30}
+    monkeypatch.setattr(staging, "SHM_DIRS", (str(tmp_path / "missing"), str(small), str(big)))
+    monkeypatch.setattr(staging.os, "statvfs", lambda d: SimpleNamespace(f_bavail=free[str(d)], f_frsize=1))
+    monkeypatch.setattr(staging, "mem_available", lambda: 4 << 30)
+    return small, big
+
+def test_pick_workspace_tries_every_candidate(shm_dirs):
+    small, big = shm_dirs
+    assert pick_workspace("auto", 100 << 20)[0] == str(big)
+    parent, reason = pick_workspace("auto", 2 << 30)
+    assert parent is None
+    assert str(big) in reason
+    assert pick_workspace("off", 1)[0] is None
+
+def test_pick_workspace_checks_memory(shm_dirs, monkeypatch):
+    monkeypatch.setattr(staging, "mem_available", lambda: 100 << 20)
+    assert pick_workspace("auto", 100 << 20)[0] is None
+    assert pick_workspace("ram", 100 << 20)[0] == str(shm_dirs[1])
+
+def test_absolutize_cfg(tmp_path):
+    (tmp_path / "extra").mkdir()
+    cfg = {"MKQNX_POLICY": "policy.txt", "MKQNX_SSH_IDENT": "prompt", "MKQNX_EXTRA_DIRS": "+extra:-nothere:/abs"}
+    out = absolutize_cfg(cfg, tmp_path)
+    assert out["MKQNX_POLICY"] == str(tmp_path / "policy.txt")
+    assert out["MKQNX_SSH_IDENT"] == "prompt"
+    assert out["MKQNX_EXTRA_DIRS"] == f"+{tmp_path / 'extra'}:-nothere:/abs"
+
+def test_workspace_round_trip(project, tmp_path_factory):
+    (project / "local" / "misc_files").mkdir(parents=True)
+    (project / "local" / "misc_files" / "shadow").write_text("root:old\n")
+    (project / "local" / "gone").write_text("x")
+    (project / "local" / "big.ifs").write_bytes(bytes(STATE_MAX + 1))
+    ws = Workspace(tmp_path_factory.mktemp("shm"))
+    ws.seed()
+    assert not (ws.path / "local" / "big.ifs").exists()
+
+    (ws.path / "local" / "misc_files" / "shadow").write_text("root:new\n")
+    (ws.path / "local" / "gone").unlink()
+    (ws.path / "local" / "system.qcfs").write_bytes(bytes(STATE_MAX + 1))
+    (ws.path / "output").mkdir()
+    (ws.path / "output" / "disk-qemu.img").write_bytes(b"image")
+    (ws.path / "output" / "runimage.sh").write_text(f"cd {ws.path}\n")
+    ws.collect()
+    ws.cleanup()
+
+    assert (project / "local" / "misc_files" / "shadow").read_text() == "root:new\n"
+    assert not (project / "local" / "gone").exists()
+    assert not (project / "local" / "system.qcfs").exists()
+    assert (project / "output" / "disk-qemu.img").read_bytes() == b"image"
+    assert (project / "output" / "runimage.sh").read_text() == f"cd {project}\n"
+    assert not ws.path.exists()
+
+def test_kept_workspace(project, tmp_path_factory):
+    ws = Workspace(tmp_path_factory.mktemp("shm"))
+    ws.keep()
+    assert Workspace.kept().path == ws.path
+    ws.cleanup()
+    assert not (project / KEPT_PATH).exists()
+    assert Workspace.kept() is None
+
+@pytest.mark.skipif(not os.access("/dev/shm", os.W_OK), reason="needs a writable /dev/shm")
+def test_failed_staged_build_is_resumed(project, build):
+    assert build().returncode == 0
+    r = build("--stage=ram", MKQNX_STUB_FAIL="data")
+    assert r.returncode != 0
+    kept = Path((project / KEPT_PATH).read_text().strip())
+    try:
+        assert (kept / "output" / "boot.img").exists()
+        r = build("--stage=ram", "--resume")
+        assert r.returncode == 0, r.stderr
+        assert "resuming the failed build" in r.stdout
+        assert not kept.exists()
+        assert not (project / KEPT_PATH).exists()
+
+        assert build("--stage=ram", MKQNX_STUB_FAIL="data").returncode != 0
+        kept = Path((project / KEPT_PATH).read_text().strip())
+        assert build("--stage=off").returncode == 0
+        assert not kept.exists()
+    finally:
+        if kept.exists():
+            Workspace(None, project, kept).cleanup()
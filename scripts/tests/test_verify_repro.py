@@ -0,0 +1,47 @@
+import struct
+import subprocess
+import sys
+import time
+
+from conftest import SCRIPTS
+from disk_image import SECTOR
+from verify_repro import compare
+
+def verify(project, stub, *args):
+    return subprocess.run([sys.executable, SCRIPTS / "verify_repro.py", f"--tool={stub}", *args, ".config"],
+                          cwd=project, capture_output=True, text=True)
+
+def test_generated_key_is_reported(project, stub):
+    (project / ".config").write_text((SCRIPTS.parent / "configs" / "defconfig").read_text())
+    r = verify(project, stub)
+    assert r.returncode == 1, r.stderr
+    assert "local/misc_files/ssh_host_ed25519_key: 32 byte(s) in 1 range(s)" in r.stdout
+    assert "generated host keys" in r.stdout
+
+def test_seeded_builds_are_reproducible(project, stub):
+    (project / ".config").write_text((SCRIPTS.parent / "configs" / "defconfig").read_text())
+    subprocess.run([stub], cwd=project, check=True)
+    r = verify(project, stub, "--seed-local")
+    assert r.returncode == 0, r.stdout + r.stderr
+    assert "Reproducible" in r.stdout
+
+def disk(path, mac):
+    mbr = bytearray(SECTOR)
+    struct.pack_into("<4xB3xII", mbr, 446, 0xb1, 1, 7)
+    mbr[510:512] = b"\x55\xaa"
+    body = bytearray(7 * SECTOR)
+    body[SECTOR:SECTOR + 17] = mac
+    path.parent.mkdir(parents=True)
+    path.write_bytes(bytes(mbr) + bytes(body))
+
+def test_compare_maps_differences_to_partitions(tmp_path):
+    disk(tmp_path / "a" / "output" / "disk-qemu.img", b"52:54:00:12:34:56")
+    disk(tmp_path / "b" / "output" / "disk-qemu.img", b"52:54:00:ab:cd:ef")
+    (tmp_path / "a" / "output" / "only-a.txt").write_text("x")
+    now = time.time()
+    results = compare(tmp_path / "a", tmp_path / "b", (now - 60, now + 60))
+    assert results == [
+        {"file": "output/disk-qemu.img", "status": "differs", "bytes": 8,
+         "ranges": [(2 * SECTOR + 9, 2 * SECTOR + 17, "boot", "mac")], "causes": {"mac": 1}},
+        {"file": "output/only-a.txt", "status": "only in one build", "causes": {"unknown": 1}},
+    ]
@@ -0,0 +1,111 @@
+import sys
+import time
+
+import pytest
+
+import watch_build
+from watch_build import (SCOPE_DATA, SCOPE_FULL, SCOPE_NONE, Builder, InotifyWatcher, PollingWatcher,
+                         WatchSet)
+
+@pytest.fixture
+def inputs(project):
+    for d in ("repo", "extra", "local", "elsewhere"):
+        (project / d).mkdir()
+    (project / "policy.txt").write_text("policy\n")
+    (project / ".config").write_text(
+        f'CONFIG_MKQNX_REPOS="{project / "repo"}"\nCONFIG_MKQNX_EXTRA_DIRS="+{project / "extra"}"\n'
+        f'CONFIG_MKQNX_POLICY="{project / "policy.txt"}"\nCONFIG_MKQNX_SSH_IDENT="prompt"\n')
+    return project
+
+def watchset(project):
+    return WatchSet(project / ".config", watch_build.parse_config(project / ".config"))
+
+def test_scope_classification(inputs):
+    ws = watchset(inputs)
+    assert ws.scope_of(inputs / ".config", False) == SCOPE_FULL
+    assert ws.scope_of(inputs / "policy.txt", False) == SCOPE_FULL
+    assert ws.scope_of(inputs / "repo" / "lib" / "libc.so", False) == SCOPE_FULL
+    assert ws.scope_of(inputs / "extra" / "bin" / "app", False) == SCOPE_DATA
+    assert ws.scope_of(inputs / "local" / "misc_files" / "shadow", False) == SCOPE_DATA
+    assert ws.scope_of(inputs / "elsewhere" / "file", False) == SCOPE_NONE
+
+def test_local_changes_during_a_build_are_ignored(inputs):
+    ws = watchset(inputs)
+    assert ws.scope_of(inputs / "local" / "misc_files" / "shadow", True) == SCOPE_NONE
+    assert ws.scope_of(inputs / "extra" / "bin" / "app", True) == SCOPE_DATA
+
+def test_directories_to_watch(inputs):
+    dirs = dict(watchset(inputs).directories())
+    assert dirs[inputs] is False
+    assert all(dirs[inputs / d] for d in ("repo", "extra", "local"))
+    assert inputs / "elsewhere" not in dirs
+
+@pytest.fixture
+def fake_build(tmp_path, monkeypatch):
+    """Replaces build_mkqnximage.py with a script recording its arguments."""
+    script = tmp_path / "fake_build.py"
+    script.write_text("import os, sys\n"
+                      "open(os.environ['FAKE_BUILD_LOG'], 'a').write(' '.join(sys.argv[1:]) + '\\n')\n"
+                      "sys.exit(int(os.environ.get('FAKE_BUILD_RC', '0')))\n")
+    monkeypatch.setattr(watch_build, "BUILD_SCRIPT", script)
+    monkeypatch.setenv("FAKE_BUILD_LOG", str(tmp_path / "builds.log"))
+    return tmp_path / "builds.log"
+
+def finish(builder):
+    builder.proc.wait()
+    assert builder.reap()
+
+def test_data_only_change_builds_without_force(inputs, fake_build):
+    builder = Builder(inputs / ".config")
+    builder.start(SCOPE_DATA)
+    finish(builder)
+    builder.start(SCOPE_FULL)
+    finish(builder)
+    assert fake_build.read_text().splitlines() == [f"{inputs / '.config'} --no-force", str(inputs / ".config")]
+
+def test_failed_full_build_is_owed(inputs, fake_build, monkeypatch):
+    builder = Builder(inputs / ".config")
+    monkeypatch.setenv("FAKE_BUILD_RC", "1")
+    builder.start(SCOPE_FULL)
+    finish(builder)
+    assert builder.owed == SCOPE_FULL
+    monkeypatch.setenv("FAKE_BUILD_RC", "0")
+    # A data change after a failed full build still needs --force.
+    builder.start(SCOPE_DATA)
+    finish(builder)
+    assert builder.owed == SCOPE_NONE
+    assert fake_build.read_text().splitlines()[-1] == str(inputs / ".config")
+
+def changes(watcher, want, timeout=5):
+    seen = set()
+    end = time.monotonic() + timeout
+    while want - seen and time.monotonic() < end:
+        seen.update(watcher.read(0.2))
+    return seen
+
+def test_polling_watcher(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "old").write_text("x")
+    watcher = PollingWatcher(interval=0.01)
+    watcher.add(tmp_path, True)
+    (tmp_path / "sub" / "new").write_text("y")
+    (tmp_path / "old").unlink()
+    assert set(watcher.read(0.01)) == {tmp_path / "sub" / "new", tmp_path / "old"}
+    assert watcher.read(0.01) == []
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+def test_inotify_watches_new_subdirectories(tmp_path):
+    watcher = InotifyWatcher()
+    watcher.add(tmp_path, True)
+    (tmp_path / "sub").mkdir()
+    assert tmp_path / "sub" in changes(watcher, {tmp_path / "sub"})
+    (tmp_path / "sub" / "file").write_text("x")
+    assert tmp_path / "sub" / "file" in changes(watcher, {tmp_path / "sub" / "file"})
+    watcher.clear()
+
+def test_falls_back_to_polling_without_inotify(monkeypatch, capsys):
+    def unavailable():
+        raise OSError("inotify_init1 failed")
+    monkeypatch.setattr(watch_build, "InotifyWatcher", unavailable)
+    assert isinstance(watch_build.make_watcher(), PollingWatcher)
+    assert "falling back to polling" in capsys.readouterr().err
@@ -0,0 +1,93 @@
+import os
+import struct
+
+import pytest
+
+from disk_image import SECTOR
+from write_image import BLOCK, Target, WriteError, write_image
+
+IMAGE_SIZE = 3 * BLOCK + 8192
+
+@pytest.fixture
+def image(tmp_path):
+    """A sparse disk image: MBR, data, a block of zeros, a hole and a data tail."""
+    path = tmp_path / "disk-qemu.img"
+    mbr = bytearray(SECTOR)
+    struct.pack_into("<4xB3xII", mbr, 446, 0xb1, 1, IMAGE_SIZE // SECTOR - 1)
+    mbr[510:512] = b"\x55\xaa"
+    with open(path, "wb") as f:
+        f.write(mbr + b"data" * 1000)
+        f.seek(BLOCK)
+        f.write(bytes(BLOCK))
+        f.seek(3 * BLOCK)
+        f.write(b"tail" * 2048)
+    assert path.stat().st_size == IMAGE_SIZE
+    return path
+
+def prefilled(path, size=IMAGE_SIZE):
+    path.write_bytes(b"\xff" * size)
+    return str(path)
+
+def test_file_target_is_truncated(tmp_path, image):
+    target = Target(prefilled(tmp_path / "card.img", 2 * IMAGE_SIZE), IMAGE_SIZE)
+    try:
+        skipped = write_image(image, [target], verify=True)
+    finally:
+        target.close()
+    assert target.error is None
+    assert skipped >= 2 * BLOCK
+    assert (tmp_path / "card.img").read_bytes() == image.read_bytes()
+
+def test_ranges_without_data_are_zeroed(tmp_path, image):
+    target = Target(str(tmp_path / "card.img"), IMAGE_SIZE)
+    # Like a block device: whatever was there before stays unless zeroed.
+    prefilled(tmp_path / "card.img")
+    target.zero = False
+    try:
+        write_image(image, [target], verify=True)
+    finally:
+        target.close()
+    assert target.error is None
+    assert target.zeroed >= 2 * BLOCK
+    assert target.written + target.zeroed == IMAGE_SIZE
+    assert (tmp_path / "card.img").read_bytes() == image.read_bytes()
+
+def test_verify_covers_skipped_ranges(tmp_path, image):
+    target = Target(str(tmp_path / "card.img"), IMAGE_SIZE, assume_zeroed=True)
+    # The target wasn't zero after all; stale bytes must not pass.
+    prefilled(tmp_path / "card.img")
+    try:
+        write_image(image, [target], verify=True)
+    finally:
+        target.close()
+    assert target.error == "verification failed: read-back data does not match"
+
+def test_full_copies_everything(tmp_path, image):
+    targets = [Target(str(tmp_path / f"card{i}.img"), IMAGE_SIZE) for i in range(2)]
+    try:
+        assert write_image(image, targets, full=True, verify=True) == 0
+    finally:
+        for t in targets:
+            t.close()
+    for t in targets:
+        assert t.error is None and t.written == IMAGE_SIZE
+        assert open(t.path, "rb").read() == image.read_bytes()
+
+def test_grow_extends_the_last_partition(tmp_path, image):
+    target = Target(str(tmp_path / "card.img"), IMAGE_SIZE, size=4 * IMAGE_SIZE, grow=True)
+    try:
+        write_image(image, [target], verify=True)
+    finally:
+        target.close()
+    assert target.error is None
+    data = (tmp_path / "card.img").read_bytes()
+    assert len(data) == 4 * IMAGE_SIZE
+    assert struct.unpack_from("<I", data, 446 + 12)[0] == 4 * IMAGE_SIZE // SECTOR - 1
+    assert data[SECTOR:IMAGE_SIZE] == image.read_bytes()[SECTOR:]
+
+
+@pytest.mark.skipif(not os.path.exists("/dev/null"), reason="needs /dev/null")
+def test_target_smaller_than_the_image_is_refused(image):
+    # /dev/null stands in for a device without room: seeking to its end gives 0.
+    with pytest.raises(WriteError, match="smaller than the"):
+        Target("/dev/null", IMAGE_SIZE)
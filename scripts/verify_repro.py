@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Checks whether a .config builds bit-for-bit reproducible images.
+
+The config is built twice, each time in a fresh directory with its own
+local/ state, and the results are compared. Files are hashed in chunks on
+a thread pool; differing chunks are narrowed down to exact byte ranges,
+which are mapped to the partitions of the disk images and, where the bytes
+of a differing generated file (keys, password files, ...) can be found in
+the image, to that file.
+
+Every difference is classified by its usual culprit: embedded timestamps,
+a random MAC address, generated host keys, generated passwords or the
+order of entries. The report lists what to pin to make the build
+reproducible, and therefore cacheable.
+"""
+import argparse
+import contextlib
+import hashlib
+import mmap
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from config_parser import parse_config, str_of
+from build_mkqnximage import build_command
+from disk_image import read_partitions
+from staging import STATE_MAX, absolutize_cfg, copy_state
+
+CHUNK = 1024 * 1024
+# Differences closer than this are reported as one range.
+GAP = 16
+# Only this many ranges per file are classified and listed.
+MAX_RANGES = 200
+# Integers within this distance of the build times are taken for timestamps.
+CLOCK_SLACK = 2 * 86400
+
+MAC_RE = re.compile(rb"(?i)\b[0-9a-f]{2}(?::[0-9a-f]{2}){5}\b")
+TIME_TEXT_RE = re.compile(rb"\b\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}|\b\d{2}:\d{2}:\d{2}\b")
+
+CAUSES = {
+    "timestamp": ("embedded timestamps",
+                  "Build with a fixed clock: export SOURCE_DATE_EPOCH for the tools that honour it, "
+                  "or run the build under faketime."),
+    "mac": ("random MAC address",
+            "Set MKQNX_MACADDR; when it is empty a random address is generated for every build."),
+    "host-key": ("generated host keys",
+                 "Keep the generated keys in local/misc_files between builds (build from the same "
+                 "local/ state), or disable MKQNX_SSHD_PREGEN so the keys are generated on first boot."),
+    "password": ("generated password hashes",
+                 "Password hashes use a random salt; build from the same local/ state so the "
+                 "generated password files are reused."),
+    "ordering": ("entry order",
+                 "Entries were written in a different order; check the extra directories "
+                 "(MKQNX_EXTRA_DIRS) and repositories for inputs listed in directory order."),
+    "generated": ("other generated files in local/",
+                  "Build from the same local/ state, or pin the option that generates the file."),
+    "unknown": ("unclassified", "Inspect the listed ranges."),
+}
+
+def run_build(cfg, tool, root, work, seed):
+    """Builds cfg in work; returns the exit code. The output goes to work/build.log."""
+    if seed:
+        copy_state(root, work)
+    cmd = build_command(absolutize_cfg(cfg, root), tool)
+    if "--noprompt" not in cmd:
+        cmd.append("--noprompt")
+    with open(work / "build.log", "wb") as log:
+        return subprocess.call(cmd, cwd=work, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+
+@contextlib.contextmanager
+def _mapped(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+def _chunk_digest(mm, offset):
+    return hashlib.sha256(mm[offset:offset + CHUNK]).digest()
+
+def _diff_spans(a, b, offset, length, out):
+    """Appends the exact (start, end) spans where a and b differ."""
+    if a[offset:offset + length] == b[offset:offset + length]:
+        return
+    if length <= 64:
+        for i in range(offset, offset + length):
+            if a[i] != b[i]:
+                if out and i - out[-1][1] <= GAP:
+                    out[-1][1] = i + 1
+                else:
+                    out.append([i, i + 1])
+        return
+    half = length // 2
+    _diff_spans(a, b, offset, half, out)
+    _diff_spans(a, b, offset + half, length - half, out)
+
+def diff_file(path_a, path_b, pool):
+    """Returns the list of [start, end] byte ranges where the files differ."""
+    size_a, size_b = path_a.stat().st_size, path_b.stat().st_size
+    common = min(size_a, size_b)
+    ranges = []
+    if common:
+        with _mapped(path_a) as a, _mapped(path_b) as b:
+            offsets = range(0, common, CHUNK)
+            # hashlib releases the GIL on large buffers, so the chunks of
+            # both files are hashed in parallel.
+            ha = pool.map(lambda o: _chunk_digest(a, o), offsets)
+            hb = pool.map(lambda o: _chunk_digest(b, o), offsets)
+            for off, da, db in zip(offsets, ha, hb):
+                if da != db:
+                    _diff_spans(a, b, off, min(CHUNK, common - off), ranges)
+    if size_a != size_b:
+        ranges.append([common, max(size_a, size_b)])
+    return ranges
+
+def _window(data, start, end, pad=32):
+    return data[max(0, start - pad):end + pad]
+
+def classify_range(a, b, start, end, clock, located):
+    """Returns the cause of the difference a[start:end] != b[start:end]."""
+    for (lo, hi), cause in located:
+        if start < hi and end > lo:
+            return cause
+    wa, wb = _window(a, start, end), _window(b, start, end)
+    macs_a, macs_b = set(MAC_RE.findall(wa)), set(MAC_RE.findall(wb))
+    if macs_a != macs_b:
+        return "mac"
+    if TIME_TEXT_RE.search(a[max(0, start - 20):end + 20]) and TIME_TEXT_RE.search(b[max(0, start - 20):end + 20]):
+        return "timestamp"
+    lo, hi = clock
+    for fmt, scale in (("<I", 1), ("<Q", 1), ("<Q", 10 ** 9)):
+        n = struct.calcsize(fmt)
+        for off in range(start - start % 4 - n + 4, end, 4):
+            if off < 0 or off + n > min(len(a), len(b)):
+                continue
+            va, vb = struct.unpack_from(fmt, a, off)[0], struct.unpack_from(fmt, b, off)[0]
+            if va != vb and lo <= va / scale <= hi and lo <= vb / scale <= hi:
+                return "timestamp"
+    if end - start > 1 and sorted(a[start:end]) == sorted(b[start:end]):
+        return "ordering"
+    return "unknown"
+
+def classify_file(rel):
+    name = rel.name.lower()
+    if "ssh_host" in name or name.endswith("_key") or name.endswith("_key.pub"):
+        return "host-key"
+    if name in ("shadow", "passwd", "master.passwd") or "passwd" in name:
+        return "password"
+    return "generated"
+
+def locate(data, blobs):
+    """Returns [((start, end), cause)] for the blobs found in data."""
+    found = []
+    for blob, cause in blobs:
+        if len(blob) < 16:
+            continue
+        i = data.find(blob)
+        while i != -1:
+            found.append(((i, i + len(blob)), cause))
+            i = data.find(blob, i + 1)
+    return found
+
+def partition_of(parts, offset):
+    for p in parts:
+        if p.start <= offset < p.end:
+            return p.name
+    return "partition table" if offset < 512 else "unpartitioned"
+
+def compare(dir_a, dir_b, clock, jobs=None):
+    """Compares two build directories; returns a list of per-file results."""
+    results = []
+    files = set()
+    for top in ("output", "local"):
+        for d in (dir_a, dir_b):
+            if (d / top).is_dir():
+                files.update(p.relative_to(d) for p in (d / top).rglob("*") if p.is_file())
+
+    # Generated files whose contents may show up inside the images.
+    blobs = []
+    for rel in sorted(files):
+        pa, pb = dir_a / rel, dir_b / rel
+        if rel.parts[0] == "local" and pa.is_file() and pb.is_file() \
+                and pa.stat().st_size <= STATE_MAX and pa.read_bytes() != pb.read_bytes():
+            blobs.append((pa.read_bytes(), classify_file(rel)))
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for rel in sorted(files):
+            pa, pb = dir_a / rel, dir_b / rel
+            if not pa.is_file() or not pb.is_file():
+                results.append({"file": str(rel), "status": "only in one build",
+                                "causes": {classify_file(rel) if rel.parts[0] == "local" else "unknown": 1}})
+                continue
+            ranges = diff_file(pa, pb, pool)
+            if not ranges:
+                continue
+            entry = {"file": str(rel), "status": "differs", "bytes": sum(e - s for s, e in ranges),
+                     "ranges": [], "causes": {}}
+            parts = read_partitions(pa)
+            with _mapped(pa) as a, _mapped(pb) as b:
+                located = locate(a, blobs)
+                if rel.parts[0] == "local" and len(a) <= STATE_MAX:
+                    located.append(((0, len(a) + 1), classify_file(rel)))
+                for start, end in ranges:
+                    cause = classify_range(a, b, start, end, clock, located)
+                    entry["causes"][cause] = entry["causes"].get(cause, 0) + 1
+                    if len(entry["ranges"]) < MAX_RANGES:
+                        entry["ranges"].append((start, end, partition_of(parts, start) if parts else None, cause))
+            results.append(entry)
+    return results
+
+def report(results, cfg, out=sys.stdout):
+    if not results:
+        print("Reproducible: both builds are bit-for-bit identical.", file=out)
+        return
+    causes = {}
+    print("Not reproducible. Differences:", file=out)
+    for r in results:
+        if r["status"] != "differs":
+            print(f"  {r['file']}: {r['status']}", file=out)
+        else:
+            print(f"  {r['file']}: {r['bytes']} byte(s) in {sum(r['causes'].values())} range(s)", file=out)
+            for start, end, part, cause in r["ranges"][:10]:
+                where = f" [{part}]" if part else ""
+                print(f"    {start:#x}-{end:#x}{where}: {CAUSES[cause][0]}", file=out)
+            if len(r["ranges"]) > 10:
+                print(f"    ... {sum(r['causes'].values()) - 10} more", file=out)
+        for cause, n in r["causes"].items():
+            causes.setdefault(cause, []).append(r["file"])
+    print("\nTo pin:", file=out)
+    for cause in CAUSES:
+        if cause in causes:
+            label, advice = CAUSES[cause]
+            print(f"  {label} ({', '.join(sorted(set(causes[cause])))}):\n    {advice}", file=out)
+    if not str_of(cfg, "MKQNX_MACADDR", "") and "mac" not in causes:
+        print("  MKQNX_MACADDR is empty; if the VM configuration carries a MAC address, set it.", file=out)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a config twice and report what makes the images differ.")
+    parser.add_argument("config", help="path to the .config file")
+    parser.add_argument("--tool", default="mkqnximage", help="mkqnximage or a compatible tool (default: mkqnximage)")
+    parser.add_argument("--seed-local", action="store_true",
+                        help="start both builds from the current local/ state instead of an empty one")
+    parser.add_argument("--serial", action="store_true", help="run the two builds one after the other")
+    parser.add_argument("--keep", action="store_true", help="keep the build directories")
+    parser.add_argument("-j", "--jobs", type=int, help="hashing threads")
+    args = parser.parse_args()
+
+    conf_path = Path(args.config)
+    if not conf_path.exists():
+        print("Config file not found:", conf_path, file=sys.stderr)
+        sys.exit(1)
+    tool = shutil.which(args.tool)
+    if not tool:
+        print(f"Error: '{args.tool}' not found on PATH.", file=sys.stderr)
+        sys.exit(1)
+    cfg = parse_config(conf_path)
+
+    base = Path(tempfile.mkdtemp(prefix="mkqnx-repro-"))
+    dirs = [base / "a", base / "b"]
+    for d in dirs:
+        d.mkdir()
+    try:
+        started = time.time()
+        print(f"Building {conf_path} twice in {base}...")
+        with ThreadPoolExecutor(max_workers=1 if args.serial else 2) as pool:
+            rcs = list(pool.map(lambda d: run_build(cfg, tool, ".", d, args.seed_local), dirs))
+        for d, rc in zip(dirs, rcs):
+            if rc != 0:
+                print(f"Error: build in {d} failed with code {rc}; see {d / 'build.log'}.", file=sys.stderr)
+                args.keep = True
+                sys.exit(1)
+        clock = (started - CLOCK_SLACK, time.time() + CLOCK_SLACK)
+        results = compare(dirs[0], dirs[1], clock, args.jobs)
+        report(results, cfg)
+        if results:
+            sys.exit(1)
+    finally:
+        if args.keep:
+            print("Build directories kept in", base)
+        else:
+            shutil.rmtree(base, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
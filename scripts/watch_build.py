@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Continuous rebuild mode for build_mkqnximage.py.
+
+Watches .config, local/, the MKQNX_EXTRA_DIRS and MKQNX_REPOS directories,
+the MKQNX_POLICY file and the MKQNX_SSH_IDENT key and rebuilds the image
+when any of them change:
+
+- Bursts of changes are debounced into a single rebuild.
+- Changes that only touch /data content (local/ and extra directories) are
+  rebuilt incrementally, without --force, so mkqnximage reuses the boot and
+  system images it already built.
+- Changes to .config, the policy, the ssh identity or the repositories
+  trigger a full --force rebuild.
+- A build that is made obsolete by newer edits is cancelled and restarted.
+
+Uses inotify through libc when available and falls back to polling.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import signal
+import struct
+import subprocess
+import sys
+import time
+from pathlib import Path
+from config_parser import parse_config, str_of
+
+BUILD_SCRIPT = Path(__file__).resolve().parent / "build_mkqnximage.py"
+
+# Rebuild scopes, ordered from cheapest to most expensive.
+SCOPE_NONE = 0
+SCOPE_DATA = 1
+SCOPE_FULL = 2
+SCOPE_NAMES = {SCOPE_NONE: "none", SCOPE_DATA: "data", SCOPE_FULL: "full"}
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+EVENT_HDR = struct.Struct("iIII")
+
+def split_dirs(value):
+    """Splits a colon separated MKQNX_* directory list into existing paths."""
+    out = []
+    for item in os.path.expandvars(value).split(":"):
+        item = item.strip().lstrip("+-")
+        if not item or item == "none":
+            continue
+        p = Path(item).expanduser()
+        if p.is_dir():
+            out.append(p.resolve())
+    return out
+
+def optional_file(cfg, key, skip):
+    """Returns the resolved path of a file-valued option, if it names one."""
+    val = str_of(cfg, key, "")
+    if not val or val in skip:
+        return None
+    return Path(os.path.expandvars(val)).expanduser().resolve()
+
+class WatchSet:
+    """The files and directory trees a given .config depends on, by scope."""
+
+    def __init__(self, conf_path, cfg):
+        self.conf_path = conf_path.resolve()
+        # Only watch repositories that were configured explicitly; the
+        # default of $QNX_TARGET is the whole SDP and far too large.
+        repos = str_of(cfg, "MKQNX_REPOS", "")
+        self.trees = [(d, SCOPE_FULL) for d in split_dirs(repos)]
+        self.trees += [(d, SCOPE_DATA) for d in split_dirs(str_of(cfg, "MKQNX_EXTRA_DIRS", ""))]
+        local = Path("local").resolve()
+        if local.is_dir():
+            self.trees.append((local, SCOPE_DATA))
+        self.local = local
+        self.files = {self.conf_path: SCOPE_FULL}
+        for key, skip in (("MKQNX_POLICY", ("none",)), ("MKQNX_SSH_IDENT", ("prompt", "none"))):
+            f = optional_file(cfg, key, skip)
+            if f is not None:
+                self.files[f] = SCOPE_FULL
+
+    def scope_of(self, path, building):
+        """Returns the rebuild scope a change to path calls for."""
+        if path in self.files:
+            return self.files[path]
+        scope = SCOPE_NONE
+        for root, s in self.trees:
+            if path == root or root in path.parents:
+                # mkqnximage itself writes to local/ while it runs, so
+                # changes there cannot be attributed to the user mid-build.
+                if building and root == self.local:
+                    continue
+                scope = max(scope, s)
+        return scope
+
+    def directories(self):
+        """Yields (directory, recursive) pairs that must be watched."""
+        for f in self.files:
+            if f.parent.is_dir():
+                yield f.parent, False
+        for root, _ in self.trees:
+            yield root, True
+
+class InotifyWatcher:
+    """Minimal inotify wrapper reporting changed paths."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm = libc.inotify_rm_watch
+        self._rm.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wds = {}
+        self.recursive = set()
+        self.exhausted = False
+
+    def add(self, directory, recursive):
+        if recursive:
+            for dirpath, dirnames, _ in os.walk(directory):
+                self._add_one(Path(dirpath), True)
+        else:
+            self._add_one(directory, False)
+
+    def _add_one(self, directory, recursive):
+        wd = self._add(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC and not self.exhausted:
+                self.exhausted = True
+                print("Warning: inotify watch limit reached; some directories are not watched "
+                      "(see /proc/sys/fs/inotify/max_user_watches).", file=sys.stderr)
+            return
+        self.wds[wd] = directory
+        if recursive:
+            self.recursive.add(wd)
+
+    def clear(self):
+        for wd in list(self.wds):
+            self._rm(self.fd, wd)
+        self.wds.clear()
+        self.recursive.clear()
+
+    def read(self, timeout):
+        """Returns the changed paths seen within timeout seconds."""
+        r, _, _ = select.select([self.fd], [], [], timeout)
+        if not r:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        off = 0
+        while off < len(buf):
+            wd, mask, _, length = EVENT_HDR.unpack_from(buf, off)
+            off += EVENT_HDR.size
+            name = buf[off:off + length].rstrip(b"\0")
+            off += length
+            if mask & IN_Q_OVERFLOW:
+                # Lost events; report every watched directory as changed.
+                paths.extend(self.wds.values())
+                continue
+            base = self.wds.get(wd)
+            if base is None:
+                continue
+            path = base / os.fsdecode(name) if name else base
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and wd in self.recursive:
+                self.add(path, True)
+            paths.append(path)
+        return paths
+
+class PollingWatcher:
+    """Fallback for hosts without inotify: compares mtimes periodically."""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.dirs = []
+        self.snapshot = {}
+
+    def add(self, directory, recursive):
+        self.dirs.append((directory, recursive))
+        self.snapshot.update(self._scan(directory, recursive))
+
+    def clear(self):
+        self.dirs = []
+        self.snapshot = {}
+
+    def _scan(self, directory, recursive):
+        out = {}
+        if recursive:
+            walker = os.walk(directory)
+        else:
+            walker = [(str(directory), [], os.listdir(directory) if directory.is_dir() else [])]
+        for dirpath, _, filenames in walker:
+            for fn in filenames:
+                p = Path(dirpath) / fn
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                out[p] = (st.st_mtime_ns, st.st_size)
+        return out
+
+    def read(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        current = {}
+        for directory, recursive in self.dirs:
+            current.update(self._scan(directory, recursive))
+        changed = [p for p in set(current) | set(self.snapshot)
+                   if current.get(p) != self.snapshot.get(p)]
+        self.snapshot = current
+        return changed
+
+def make_watcher():
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):
+            pass
+    print("inotify unavailable; falling back to polling.", file=sys.stderr)
+    return PollingWatcher()
+
+class Builder:
+    """Runs build_mkqnximage.py in the background and cancels it on demand."""
+
+    def __init__(self, conf_path):
+        self.conf_path = conf_path
+        self.proc = None
+        self.scope = SCOPE_NONE
+        self.started = 0.0
+        # Scope that must be rebuilt no matter what, e.g. after a cancelled
+        # or failed forced build that may have left partial output behind.
+        self.owed = SCOPE_NONE
+
+    def running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self, scope):
+        scope = max(scope, self.owed)
+        cmd = [sys.executable, str(BUILD_SCRIPT), str(self.conf_path)]
+        if scope < SCOPE_FULL:
+            cmd.append("--no-force")
+        print(f"[watch] starting {SCOPE_NAMES[scope]} rebuild", flush=True)
+        self.scope = scope
+        self.started = time.monotonic()
+        self.proc = subprocess.Popen(cmd, start_new_session=True)
+
+    def cancel(self):
+        if not self.running():
+            return
+        print("[watch] cancelling obsolete build", flush=True)
+        try:
+            os.killpg(self.proc.pid, signal.SIGTERM)
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+            self.proc.wait()
+        except ProcessLookupError:
+            pass
+        self.owed = max(self.owed, self.scope)
+        self.proc = None
+
+    def reap(self):
+        """Reports a finished build; returns True if one just finished."""
+        if self.proc is None or self.proc.poll() is None:
+            return False
+        rc = self.proc.returncode
+        elapsed = time.monotonic() - self.started
+        if rc == 0:
+            print(f"[watch] {SCOPE_NAMES[self.scope]} rebuild done in {elapsed:.1f}s", flush=True)
+            self.owed = SCOPE_NONE
+        else:
+            print(f"[watch] build failed with code {rc} after {elapsed:.1f}s", file=sys.stderr, flush=True)
+            self.owed = max(self.owed, self.scope)
+        self.proc = None
+        return True
+
+def watch(conf_path, debounce, initial):
+    cfg = parse_config(conf_path)
+    watcher = make_watcher()
+    watchset = None
+    builder = Builder(conf_path)
+
+    def rewatch():
+        nonlocal watchset
+        watcher.clear()
+        watchset = WatchSet(conf_path, cfg)
+        for d, recursive in watchset.directories():
+            watcher.add(d, recursive)
+
+    rewatch()
+    if initial:
+        builder.start(SCOPE_FULL)
+    print("[watch] watching for changes; press Ctrl-C to stop", flush=True)
+
+    pending = SCOPE_NONE
+    last_event = 0.0
+    try:
+        while True:
+            building = builder.running()
+            changed = watcher.read(debounce if pending else 0.5)
+            if builder.reap():
+                # Whatever is still queued was written by the finished build.
+                building = True
+                while True:
+                    more = watcher.read(0)
+                    if not more:
+                        break
+                    changed += more
+                if not any(root == watchset.local for root, _ in watchset.trees) and watchset.local.is_dir():
+                    rewatch()
+            for p in changed:
+                p = Path(p)
+                if p == watchset.conf_path:
+                    # Saving .config without changing any value is a no-op.
+                    if not p.exists() or parse_config(p) == cfg:
+                        continue
+                    cfg = parse_config(p)
+                    rewatch()
+                scope = watchset.scope_of(p, building)
+                if scope == SCOPE_NONE:
+                    continue
+                pending = max(pending, scope)
+                last_event = time.monotonic()
+            if not pending or time.monotonic() - last_event < debounce:
+                continue
+
+            builder.cancel()
+            builder.start(pending)
+            pending = SCOPE_NONE
+    finally:
+        builder.cancel()
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the QNX image whenever its inputs change.")
+    parser.add_argument("config", nargs="?", default=".config", help="path to the .config file")
+    parser.add_argument("--debounce", type=float, default=0.3,
+                        help="seconds of quiet before a burst of changes triggers a rebuild (default 0.3)")
+    parser.add_argument("--no-initial", action="store_true",
+                        help="don't build once at startup; wait for the first change")
+    args = parser.parse_args()
+
+    conf_path = Path(args.config)
+    if not conf_path.exists():
+        print("Config file not found:", conf_path, file=sys.stderr)
+        sys.exit(1)
+    try:
+        watch(conf_path, args.debounce, not args.no_initial)
+    except KeyboardInterrupt:
+        print()
+
+if __name__ == "__main__":
+    main()
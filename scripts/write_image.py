@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Writes a built disk image to one or more SD cards, block devices or files.
+
+The image is read once and streamed to all targets at the same time, each
+written by its own thread. Only the parts of the image holding data are
+copied: holes (found with SEEK_DATA/SEEK_HOLE) and blocks of zeros are
+zeroed on block devices with BLKZEROOUT instead, which the device or the
+kernel does without the data passing through here (or written as zeros
+where that isn't supported). --assume-zeroed skips them altogether for
+targets known to be zero already; --full copies them like any other data.
+
+Writes go through O_DIRECT with large page-aligned buffers where the target
+supports it, so the page cache doesn't fill up with image data; otherwise
+the target is written through the page cache and synced at the end.
+
+With --grow the last partition (data) is extended to the end of each
+target in the partition table written to it, as mkqnximage does when the
+data size is omitted. With --verify the whole image range of each target
+is read back and compared by SHA-256.
+
+Regular files are accepted as targets for testing: they are truncated and
+created sparsely with the image size, or with --size to stand in for a
+larger device, so they are zero wherever nothing is written.
+"""
+import argparse
+import fcntl
+import hashlib
+import mmap
+import os
+import queue
+import stat
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from disk_image import SECTOR, disk_images, read_mbr, read_partitions
+
+BLOCK = 4 * 1024 * 1024
+ALIGN = 4096
+QUEUE_DEPTH = 8
+ZEROS = bytes(BLOCK)
+BLKZEROOUT = 0x127f  # _IO(0x12, 127)
+
+class WriteError(Exception):
+    pass
+
+def parse_size(text):
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    text = text.strip().upper()
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def data_extents(fd, size):
+    """Yields (start, end) of the regions of fd that hold data."""
+    off = 0
+    try:
+        while off < size:
+            start = os.lseek(fd, off, os.SEEK_DATA)
+            end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+            yield start, end
+            off = end
+    except OSError:
+        # ENXIO: no more data after off. Other errors: no hole support,
+        # so treat the rest as data.
+        if off == 0:
+            yield 0, size
+        return
+
+def grown_mbr(mbr, device_size):
+    """Returns mbr with its last partition extended to the end of the device."""
+    mbr = bytearray(mbr)
+    last = None
+    for i in range(4):
+        ptype, lba, count = struct.unpack_from("<4xB3xII", mbr, 446 + i * 16)
+        if ptype and count and (last is None or lba > last[1]):
+            last = (i, lba, count)
+    if last is None:
+        return bytes(mbr)
+    i, lba, count = last
+    sectors = min(device_size // SECTOR, 0xFFFFFFFF + lba) - lba
+    if sectors > count:
+        struct.pack_into("<I", mbr, 446 + i * 16 + 12, sectors)
+    return bytes(mbr)
+
+def mounted(path):
+    """Returns True if path or one of its partitions is mounted."""
+    real = os.path.realpath(path)
+    try:
+        with open("/proc/mounts") as f:
+            for ln in f:
+                dev = ln.split(" ", 1)[0]
+                if dev.startswith("/dev/") and os.path.realpath(dev).startswith(real):
+                    return True
+    except OSError:
+        pass
+    return False
+
+class Target:
+    """One destination; consumes blocks from its queue on its own thread."""
+
+    def __init__(self, path, image_size, size=None, grow=False, direct=True, assume_zeroed=False):
+        self.path = path
+        self.queue = queue.Queue(QUEUE_DEPTH)
+        self.image_size = image_size
+        self.written = 0
+        self.zeroed = 0
+        self.seconds = 0.0
+        self.verify_seconds = None
+        self.error = None
+        self.mbr = None
+        self.grow = grow
+        self.digest = hashlib.sha256()
+
+        exists = os.path.exists(path)
+        self.is_file = not exists or stat.S_ISREG(os.stat(path).st_mode)
+        flags = os.O_WRONLY | (os.O_CREAT if self.is_file else 0)
+        self.fd = os.open(path, flags, 0o644)
+        if self.is_file:
+            # Drop the old contents so that what isn't written reads as zeros.
+            os.ftruncate(self.fd, 0)
+            os.ftruncate(self.fd, max(size or 0, image_size))
+        # Whether the ranges the image has no data in are zero already.
+        self.zero = self.is_file or assume_zeroed
+        self.size = os.lseek(self.fd, 0, os.SEEK_END)
+        if self.size < image_size:
+            os.close(self.fd)
+            raise WriteError(f"{path}: {self.size >> 20} MiB is smaller than the "
+                             f"{image_size >> 20} MiB image")
+        self.direct_fd = None
+        if direct and hasattr(os, "O_DIRECT"):
+            try:
+                self.direct_fd = os.open(path, os.O_WRONLY | os.O_DIRECT)
+            except OSError:
+                pass
+        self.buf = mmap.mmap(-1, BLOCK)
+
+    def _write(self, offset, data):
+        n = len(data)
+        if self.direct_fd is not None and offset % ALIGN == 0 and n % ALIGN == 0:
+            self.buf[:n] = data
+            try:
+                os.pwrite(self.direct_fd, memoryview(self.buf)[:n], offset)
+                return
+            except OSError:
+                # Some filesystems accept O_DIRECT at open but not at write.
+                os.close(self.direct_fd)
+                self.direct_fd = None
+        os.pwrite(self.fd, data, offset)
+
+    def _zero_out(self, offset, length):
+        try:
+            fcntl.ioctl(self.fd, BLKZEROOUT, struct.pack("QQ", offset, length))
+            return
+        except OSError:
+            pass
+        end = offset + length
+        while offset < end:
+            n = min(BLOCK, end - offset)
+            self._write(offset, ZEROS[:n])
+            offset += n
+
+    def run(self):
+        start = time.monotonic()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                offset, data = item
+                if isinstance(data, int):
+                    # A range without data, of that length.
+                    for n in range(0, data, BLOCK):
+                        self.digest.update(ZEROS[:min(BLOCK, data - n)])
+                    if not self.zero:
+                        self._zero_out(offset, data)
+                        self.zeroed += data
+                    continue
+                if offset == 0 and self.mbr is not None:
+                    data = self.mbr + data[SECTOR:]
+                self._write(offset, data)
+                self.digest.update(data)
+                self.written += len(data)
+            os.fsync(self.fd)
+        except OSError as e:
+            self.error = str(e)
+            # Keep draining so the reader never blocks on a dead target.
+            while self.queue.get() is not None:
+                pass
+        finally:
+            self.seconds = time.monotonic() - start
+
+    def verify(self):
+        """Reads back the image range and compares its hash with what was written."""
+        start = time.monotonic()
+        h = hashlib.sha256()
+        with open(self.path, "rb", buffering=0) as f:
+            fd = f.fileno()
+            if hasattr(os, "posix_fadvise"):
+                # Read from the medium, not from the page cache.
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            for offset in range(0, self.image_size, BLOCK):
+                h.update(os.pread(fd, min(BLOCK, self.image_size - offset), offset))
+        self.verify_seconds = time.monotonic() - start
+        return h.digest() == self.digest.digest()
+
+    def close(self):
+        for fd in (self.fd, self.direct_fd):
+            if fd is not None:
+                os.close(fd)
+        self.buf.close()
+
+def write_image(image, targets, full=False, verify=False):
+    """Streams image to every target; returns the number of bytes not copied.
+
+    Those are the holes and zero blocks of the image, which each target
+    zeroes itself unless it is zero there already; with full, everything is
+    copied.
+    """
+    image_size = os.path.getsize(image)
+    mbr = read_mbr(image)
+    for t in targets:
+        if t.grow and mbr is not None:
+            t.mbr = grown_mbr(mbr, t.size)
+
+    threads = [threading.Thread(target=t.run, name=f"write {t.path}") for t in targets]
+    for th in threads:
+        th.start()
+
+    def send(item):
+        for t in targets:
+            if t.error is None:
+                t.queue.put(item)
+
+    # Ranges without data are passed on as (offset, length), merged.
+    skipped = 0
+    gap = 0
+    with open(image, "rb", buffering=0) as f:
+        fd = f.fileno()
+        extents = [(0, image_size)] if full else list(data_extents(fd, image_size))
+        off = 0
+        for start, end in extents + [(image_size, image_size)]:
+            if start > off:
+                skipped += start - off
+                off = start
+            while off < end:
+                n = min(end, (off // BLOCK + 1) * BLOCK) - off
+                data = os.pread(fd, n, off)
+                if not data:
+                    break
+                if not full and data == ZEROS[:len(data)]:
+                    skipped += len(data)
+                    off += len(data)
+                    continue
+                if skipped > gap:
+                    send((off - (skipped - gap), skipped - gap))
+                    gap = skipped
+                send((off, data))
+                off += len(data)
+        if skipped > gap:
+            send((image_size - (skipped - gap), skipped - gap))
+    for t in targets:
+        t.queue.put(None)
+    for th in threads:
+        th.join()
+
+    for t in targets:
+        if t.error is None and verify and not t.verify():
+            t.error = "verification failed: read-back data does not match"
+    return skipped
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a disk image to one or more devices or files at once.")
+    parser.add_argument("targets", nargs="+", help="block devices or files to write")
+    parser.add_argument("-i", "--image", help="disk image (default: the one in output/)")
+    parser.add_argument("--full", action="store_true", help="copy zero blocks and holes like data")
+    parser.add_argument("--assume-zeroed", action="store_true",
+                        help="leave the target alone where the image has no data, e.g. on new or "
+                             "discarded media")
+    parser.add_argument("--grow", action="store_true", help="extend the data partition to the end of each target")
+    parser.add_argument("--verify", action="store_true", help="read back and compare what was written")
+    parser.add_argument("--no-direct", action="store_true", help="write through the page cache")
+    parser.add_argument("--size", help="size of file targets, e.g. 8G (default: the image size)")
+    parser.add_argument("--force", action="store_true", help="write even to mounted devices")
+    args = parser.parse_args()
+
+    image = args.image
+    if image is None:
+        images = list(disk_images("output"))
+        if len(images) != 1:
+            print("Error: found", len(images), "disk images in output/; choose one with --image.", file=sys.stderr)
+            sys.exit(1)
+        image = images[0]
+    image = Path(image)
+    if not image.is_file():
+        print("Image not found:", image, file=sys.stderr)
+        sys.exit(1)
+
+    targets = []
+    for path in args.targets:
+        if not args.force and os.path.exists(path) and stat.S_ISBLK(os.stat(path).st_mode) and mounted(path):
+            print(f"Error: {path} is mounted; unmount it or use --force.", file=sys.stderr)
+            sys.exit(1)
+        try:
+            targets.append(Target(path, image.stat().st_size, parse_size(args.size) if args.size else None,
+                                  args.grow, not args.no_direct, args.assume_zeroed))
+        except (OSError, WriteError) as e:
+            print("Error:", e, file=sys.stderr)
+            sys.exit(1)
+
+    print(f"Writing {image} ({image.stat().st_size / 2**20:.1f} MiB) to {len(targets)} target(s)...")
+    start = time.monotonic()
+    try:
+        skipped = write_image(image, targets, args.full, args.verify)
+    finally:
+        for t in targets:
+            t.close()
+    print(f"{skipped / 2**20:.1f} MiB of holes and zeros not copied; done in {time.monotonic() - start:.1f}s.")
+
+    failed = 0
+    for t in targets:
+        rate = t.written / t.seconds / 2**20 if t.seconds else 0.0
+        line = f"  {t.path}: {t.written / 2**20:.1f} MiB in {t.seconds:.1f}s ({rate:.1f} MiB/s"
+        line += ", O_DIRECT)" if t.direct_fd is not None else ")"
+        if t.zeroed:
+            line += f", zeroed {t.zeroed / 2**20:.1f} MiB"
+        if t.verify_seconds is not None:
+            line += f", verified in {t.verify_seconds:.1f}s"
+        if t.mbr is not None:
+            parts = read_partitions(t.path)
+            if parts:
+                line += f", {parts[-1].name} partition {parts[-1].size / 2**20:.0f} MiB"
+        if t.error:
+            line += f": FAILED: {t.error}"
+            failed += 1
+        print(line)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()